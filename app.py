@@ -1,10 +1,12 @@
+import os
 import streamlit as st
-import joblib
-import pandas as pd
-from model import predict_price
-import plotly.express as px
 import time
 
+from model import INTERVAL_COVERAGE, current_version
+
+# Seconds a session waits for its prediction before showing an error
+PREDICT_TIMEOUT = 30
+
 # Set page configuration
 st.set_page_config(
     page_title="Avito Car Price Predictor - Morocco",
@@ -138,10 +140,207 @@ st.markdown("""
 
 
 
+# Resources are loaded once per server process and shared by every session
+# and rerun, instead of being reloaded on each widget interaction
+@st.cache_data
+def load_options():
+    """Load the dropdown options from the artifact bundle (or the pickles)."""
+    from bundle import load_artifact
+    return {
+        "marques": load_artifact("marque_list"),
+        "brand_model_dict": load_artifact("brand_model_dict"),
+        "boites": load_artifact("boite_list"),
+        "etats": load_artifact("etat_list"),
+        "localisations": load_artifact("localisation_list")
+    }
+
+
+@st.cache_resource
+def load_predictor():
+    """
+    Return the prediction batcher shared by all sessions; the model itself is
+    unpickled on first use.
+    
+    Concurrent sessions are scored together in batched model calls (see
+    batcher.py) instead of one call per session thread.
+    
+    Set CAR_PRICE_MODELS_DIR to hot-reload model versions from a directory
+    (and CAR_PRICE_CANDIDATE_SHARE to send part of the traffic to the newest one).
+    """
+    import model
+    from batcher import get_batcher
+    models_dir = os.environ.get("CAR_PRICE_MODELS_DIR")
+    if models_dir:
+        model.enable_registry(models_dir, candidate_share=float(os.environ.get("CAR_PRICE_CANDIDATE_SHARE", 0)))
+    return get_batcher()
+
+
+@st.cache_data(max_entries=10_000, show_spinner=False)
+def cached_predict(input_data, model_sha256, _version):
+    """
+    Predict a price and its interval, memoized on input_data and the model version.
+    
+    The caller routes the request to a version once and passes it here, so
+    the result is scored by and memoized under the version that served it
+    (keyed on its model file's SHA-256; Streamlit does not hash _version).
+    
+    The inference time is measured here and memoized with the prices, so
+    repeated inputs report the time of the model call, not of the cache lookup.
+    """
+    start = time.perf_counter()
+    price, lower, upper = predictor.predict(input_data, timeout=PREDICT_TIMEOUT, version=_version)
+    latency_ms = (time.perf_counter() - start) * 1000
+    return float(price), float(lower), float(upper), latency_ms
+
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def cached_depreciation_curve(input_data, model_sha256, _version):
+    """Value retained by the entered car over the years, memoized on input_data and the model version."""
+    from depreciation import depreciation_curve
+    return depreciation_curve(input_data, version=_version)
+
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def cached_price_surface(input_data, model_sha256, _version):
+    """Price of the entered car over model year x mileage, memoized on input_data and the model version."""
+    from depreciation import KILOMETRAGES, YEARS, price_surface
+    return price_surface(input_data, years=YEARS, kilometrages=KILOMETRAGES, version=_version)
+
+
+@st.cache_data(max_entries=10_000, show_spinner=False)
+def cached_explanation(input_data, model_sha256, _version):
+    """Contribution of each input field to the predicted price, memoized on input_data and the model version."""
+    from explain import explain_price
+    return explain_price(input_data, version=_version)
+
+
+predictor = load_predictor()
+
+# Display names of the input fields in the price factors card
+FACTOR_LABELS = {
+    "marque": "Brand",
+    "modele": "Model",
+    "annee_modele": "Year",
+    "kilometrage": "Mileage",
+    "nombre_de_portes": "Doors",
+    "puissance_fiscale": "Fiscal power",
+    "premiere_main": "First owner",
+    "boite_vitesses": "Transmission",
+    "type_de_carburant": "Fuel",
+    "origine": "Origin",
+    "etat_du_vehicule": "Condition",
+    "localisation": "City"
+}
+
+
+def show_prediction(input_data):
+    """
+    Render the estimated price and the key price factors of one car.
+    
+    The price range is only shown when the model's intervals were calibrated
+    on held-out sale prices; uncalibrated bounds would mislead users.
+    """
+    try:
+        # Route once: the price and its explanation come from the same version
+        version = current_version()
+        price, lower, upper, latency_ms = cached_predict(input_data, version.sha256, version)
+        
+        # Format the prices with spaces for thousands
+        formatted_price = f"{int(price):,}".replace(",", " ")
+        range_line = ""
+        if version.forest().calibrated(INTERVAL_COVERAGE):
+            formatted_range = f"{int(lower):,} – {int(upper):,}".replace(",", " ")
+            range_line = f"<div>{INTERVAL_COVERAGE:.0%} range: {formatted_range} MAD</div>"
+        
+        # Display animated result card
+        st.markdown(f"""
+        <div class='result-card animated'>
+            <div class='result-label'>Estimated Price</div>
+            <div class='result-value'>{formatted_price} MAD</div>{range_line}
+            <div>Based on current market conditions</div>
+        </div>
+        """, unsafe_allow_html=True)
+        st.caption(f"⏱️ Model latency: {latency_ms:.1f} ms")
+        
+        # Price factors: what the model actually did for this car
+        st.markdown("<div class='card'>", unsafe_allow_html=True)
+        st.markdown("### Key Price Factors")
+        
+        explanation = cached_explanation(input_data, version.sha256, version)
+        base_value = explanation.pop("base_value")
+        st.caption(f"Starting from an average listing at {int(base_value):,} MAD".replace(",", " "))
+        
+        factors = list(explanation.items())[:8]
+        factors_col1, factors_col2 = st.columns(2)
+        for i, (field, contribution) in enumerate(factors):
+            label, value = FACTOR_LABELS[field], input_data[field]
+            if field == "kilometrage":
+                value = f"{value:,} km".replace(",", " ")
+            elif field == "premiere_main":
+                value = "Yes" if value == 1 else "No"
+            impact = f"{'+' if contribution >= 0 else '−'}{abs(int(contribution)):,} MAD".replace(",", " ")
+            color = "green" if contribution >= 0 else "red"
+            with (factors_col1 if i % 2 == 0 else factors_col2):
+                st.markdown(f"**{label}:** {value} — :{color}[{impact}]")
+            
+        st.markdown("</div>", unsafe_allow_html=True)
+        
+        # Additional information box
+        st.markdown("""
+        <div class='info-box'>
+        <strong>Note:</strong> This estimate is based on historical data from Avito.ma. 
+        The actual selling price may vary based on specific vehicle condition, 
+        additional features, market trends, and negotiation.
+        </div>
+        """, unsafe_allow_html=True)
+        
+    except Exception as e:
+        st.error(f"Error during prediction: {e}")
+        st.error("Please check that all necessary files are available and the model is correctly configured.")
+        
+        # Provide more specific guidance based on error
+        if isinstance(e, TimeoutError):
+            st.warning(f"The model did not answer within {PREDICT_TIMEOUT} seconds. Please try again.")
+        elif "feature_names mismatch" in str(e):
+            st.warning("There appears to be a mismatch between the features expected by the model and the data provided. Please check your model configuration.")
+        elif "not callable" in str(e):
+            st.warning("There seems to be an issue with the prediction function. Please verify the MODEL.py file.")
+
+
+
+def show_price_trends(input_data):
+    """Render the predicted depreciation and price surface of one car."""
+    import plotly.express as px
+    
+    try:
+        # Depreciation of the entered car, predicted by the model
+        version = current_version()
+        ages, percentage = cached_depreciation_curve(input_data, version.sha256, version)
+        
+        fig3 = px.line(x=ages, y=percentage, 
+                      labels={'x': 'Vehicle Age (Years)', 'y': 'Value Retained (%)'},
+                      title="Car Value Depreciation Over Time")
+        fig3.update_traces(line=dict(color='#1e40af', width=3))
+        fig3.update_layout(height=400)
+        st.plotly_chart(fig3, use_container_width=True)
+        
+        # Price over model year x mileage, scored in one call
+        surface_years, surface_kms, surface = cached_price_surface(input_data, version.sha256, version)
+        fig4 = px.imshow(surface, x=surface_kms, y=surface_years, origin='lower', aspect='auto',
+                         labels={'x': 'Mileage (km)', 'y': 'Model Year', 'color': 'Price (MAD)'},
+                         color_continuous_scale='Blues',
+                         title="Estimated Price by Model Year and Mileage")
+        fig4.update_layout(height=500)
+        st.plotly_chart(fig4, use_container_width=True)
+    except Exception as e:
+        st.error(f"Error while computing price trends: {e}")
+
+
 # Load dropdown options
-marques = joblib.load("marque_list.pkl")
-brand_model_dict = joblib.load("brand_model_dict.pkl")
-boites = joblib.load("boite_list.pkl")
+options = load_options()
+marques = options["marques"]
+brand_model_dict = options["brand_model_dict"]
+boites = options["boites"]
 
 # Fix carburants - add Diesel
 carburants = ["Essence", "Diesel", "Electrique", "Hybride", "LPG"]
@@ -149,8 +348,8 @@ carburants = ["Essence", "Diesel", "Electrique", "Hybride", "LPG"]
 # Fix origines - add Dédouanée
 origines = ["Dédouanée", "Importée neuve", "Pas encore dédouanée", "WW au Maroc"]
 
-etats = joblib.load("etat_list.pkl")
-localisations = joblib.load("localisation_list.pkl")
+etats = options["etats"]
+localisations = options["localisations"]
 
 # Sidebar for project information
 with st.sidebar:
@@ -248,78 +447,38 @@ with tab1:
     with col2:
         predict_button = st.button("💰 Predict Price")
     
+    # The result is filled in at the end of the script, so that the rest of
+    # the page is not held up while the price is being computed
+    result_area = st.empty()
     if predict_button:
-        try:
-            # Show loading spinner
-            with st.spinner("Calculating estimated price..."):
-                # Add slight delay for effect
-                time.sleep(1.2)
-                price = predict_price(input_data)
-                
-                # Format the price with spaces for thousands
-                formatted_price = f"{int(price):,}".replace(",", " ")
-            
-            # Display animated result card
-            st.markdown(f"""
-            <div class='result-card animated'>
-                <div class='result-label'>Estimated Price</div>
-                <div class='result-value'>{formatted_price} MAD</div>
-                <div>Based on current market conditions</div>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Price factors explanation
-            st.markdown("<div class='card'>", unsafe_allow_html=True)
-            st.markdown("### Key Price Factors")
-            
-            # Calculate age effect
-            age = 2025 - annee_modele
-            age_impact = "High negative impact" if age > 10 else "Medium negative impact" if age > 5 else "Low negative impact"
-            
-            # Calculate mileage effect
-            mileage_impact = "High negative impact" if kilometrage > 200000 else "Medium negative impact" if kilometrage > 100000 else "Low negative impact"
-            
-            # Display factors
-            factors_col1, factors_col2 = st.columns(2)
-            
-            with factors_col1:
-                st.markdown(f"**Age:** {age} years ({age_impact})")
-                st.markdown(f"**Mileage:** {kilometrage:,} km ({mileage_impact})".replace(",", " "))
-                st.markdown(f"**Brand popularity:** {'High' if marque in ['Dacia', 'Renault', 'Volkswagen'] else 'Medium'}")
-                
-            with factors_col2:
-                st.markdown(f"**Condition:** {etat_du_vehicule}")
-                st.markdown(f"**Origin:** {origine}")
-                st.markdown(f"**First Owner:** {'Yes' if premiere_main == 1 else 'No'}")
-                
-            st.markdown("</div>", unsafe_allow_html=True)
-            
-            # Additional information box
-            st.markdown("""
-            <div class='info-box'>
-            <strong>Note:</strong> This estimate is based on historical data from Avito.ma. 
-            The actual selling price may vary based on specific vehicle condition, 
-            additional features, market trends, and negotiation.
-            </div>
-            """, unsafe_allow_html=True)
-            
-        except Exception as e:
-            st.error(f"Error during prediction: {e}")
-            st.error("Please check that all necessary files are available and the model is correctly configured.")
-            
-            # Provide more specific guidance based on error
-            if "feature_names mismatch" in str(e):
-                st.warning("There appears to be a mismatch between the features expected by the model and the data provided. Please check your model configuration.")
-            elif "not callable" in str(e):
-                st.warning("There seems to be an issue with the prediction function. Please verify the MODEL.py file.")
+        result_area.markdown("""
+        <div class='result-card'>
+            <div class='result-label'>Estimated Price</div>
+            <div>Calculating estimated price...</div>
+        </div>
+        """, unsafe_allow_html=True)
 
 with tab2:
+    # Streamlit runs every tab on each rerun, so this still imports plotly on the
+    # first render; importing it here only lets the Predict Price tab appear first
+    import plotly.express as px
+    from market_stats import get_stats
+    
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("### Morocco Car Market Insights")
     
-    # Create sample data for visualization
-    brands = ['Dacia', 'Renault', 'Volkswagen', 'Peugeot', 'Hyundai', 'Citroen', 'Ford', 'Toyota', 'Mercedes', 'BMW']
-    values = [18, 16, 12, 10, 9, 8, 7, 7, 7, 6]
+    # Aggregated listing history (see market_stats.py), reloaded when the
+    # file is updated; sample figures until it has been built
+    stats = get_stats()
+    if stats is not None and stats.rows:
+        brands, values = stats.brand_shares(10)
+        age_ranges, age_dist = stats.age_distribution()
+        st.caption(f"Computed from {stats.rows:,} listings".replace(",", " "))
+    else:
+        brands = ['Dacia', 'Renault', 'Volkswagen', 'Peugeot', 'Hyundai', 'Citroen', 'Ford', 'Toyota', 'Mercedes', 'BMW']
+        values = [18, 16, 12, 10, 9, 8, 7, 7, 7, 6]
+        age_ranges = ['< 3 years', '3-5 years', '6-10 years', '11-15 years', '> 15 years']
+        age_dist = [15, 22, 35, 18, 10]
     
     # Create horizontal bar chart of popular brands
     fig = px.bar(x=values, y=brands, orientation='h', 
@@ -332,8 +491,6 @@ with tab2:
     
     # Age distribution
     st.markdown("### Age Distribution of Used Cars")
-    age_ranges = ['< 3 years', '3-5 years', '6-10 years', '11-15 years', '> 15 years']
-    age_dist = [15, 22, 35, 18, 10]
     
     col1, col2 = st.columns(2)
     
@@ -353,22 +510,33 @@ with tab2:
         - Popular cities for car sales: Casablanca, Rabat, Marrakech, Tangier
         """)
     
+    # Listed prices of the top brands: median, with the 10th-90th percentile range
+    if stats is not None and stats.priced_rows:
+        st.markdown("### Listed Prices by Brand")
+        priced = [(b, stats.price_quantiles(marque=b)) for b in brands]
+        priced = [(b, q) for b, q in priced if q is not None]
+        median = [q[1] for _, q in priced]
+        fig_prices = px.bar(x=[b for b, _ in priced], y=median,
+                            error_y=[q[2] - q[1] for _, q in priced],
+                            error_y_minus=[q[1] - q[0] for _, q in priced],
+                            labels={'x': 'Brand', 'y': 'Median Price (MAD)'})
+        fig_prices.update_traces(marker_color='#1e40af')
+        fig_prices.update_layout(height=400)
+        st.plotly_chart(fig_prices, use_container_width=True)
+    
     st.markdown("</div>", unsafe_allow_html=True)
     
     # Price trends
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.markdown("### Price Trends by Car Age")
     
-    # Sample data for price depreciation
-    years = list(range(0, 16))
-    percentage = [100, 85, 75, 67, 60, 54, 49, 45, 41, 38, 35, 32, 29, 27, 25, 23]
+    st.markdown(f"Model predictions for the car entered in **Predict Price**: "
+                f"{marque} {modele}, {kilometrage:,} km".replace(",", " "))
     
-    fig3 = px.line(x=years, y=percentage, 
-                  labels={'x': 'Vehicle Age (Years)', 'y': 'Value Retained (%)'},
-                  title="Car Value Depreciation Over Time")
-    fig3.update_traces(line=dict(color='#1e40af', width=3))
-    fig3.update_layout(height=400)
-    st.plotly_chart(fig3, use_container_width=True)
+    # The charts score a few thousand cars: they are filled in at the end of
+    # the script, after the price, which must not wait behind them
+    trends_area = st.empty()
+    trends_area.caption("Computing price trends...")
     
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -437,4 +605,11 @@ st.markdown("""
     <p>© 2025 Moroccan Car Price Predictor | Data sourced from Avito.ma | Created for academic purposes</p>
     <p>This application is for educational use only and does not represent an official valuation tool.</p>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+if predict_button:
+    with result_area.container():
+        show_prediction(input_data)
+
+with trends_area.container():
+    show_price_trends(input_data)
@@ -0,0 +1,181 @@
+"""
+In-process prediction batcher shared by concurrent callers.
+
+The Streamlit app runs every session's script in its own thread. Instead
+of each session scoring its car separately, requests are put on one queue
+and a single worker thread scores whatever has accumulated with one
+vectorized call: at low load a request is scored alone and immediately,
+under load the requests that arrived during the previous call share the
+next one. Each caller gets a Future for its own (price, lower, upper).
+
+This is the thread-based counterpart of service.MicroBatcher, which does
+the same for the asyncio HTTP service.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+import numpy as np
+
+import model
+from instrumentation import metrics
+
+
+class PredictionBatcher:
+    """
+    Worker thread scoring queued cars in batches.
+    
+    Args:
+        max_batch_size (int): Maximum number of cars per model call
+        max_wait (float): Seconds a batch waits for more cars after its
+            first one (0 only takes the cars already queued)
+        coverage (float): Nominal coverage of the price intervals (calibrated
+            only when forest.Forest.calibrated(coverage))
+    """
+    
+    def __init__(self, max_batch_size=256, max_wait=0.0, coverage=model.INTERVAL_COVERAGE):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.coverage = coverage
+        self.batches = 0
+        self.rows = 0
+        self.batch_sizes = Counter()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        """Start the worker, or restart it if it is no longer running."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="prediction-batcher", daemon=True)
+                self._thread.start()
+        return self
+    
+    def stop(self):
+        """Finish the queued cars, then stop the worker."""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+    
+    def submit(self, input_data, version=None):
+        """
+        Queue one car.
+        
+        Args:
+            input_data (dict): Input in the predict_price format
+            version (ModelVersion): Model to score it with (routed per batch
+                if None)
+        
+        Returns:
+            concurrent.futures.Future: Resolves to (price, lower, upper) in MAD
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        future = Future()
+        self._queue.put((input_data, version, future))
+        return future
+    
+    def predict(self, input_data, timeout=None, version=None):
+        """Queue one car and wait for its (price, lower, upper)."""
+        return self.submit(input_data, version).result(timeout)
+    
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Stop after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            groups = {}
+            for input_data, version, future in batch:
+                groups.setdefault(version, []).append((input_data, future))
+            for version, cars in groups.items():
+                try:
+                    self._score(cars, version)
+                except Exception as e:
+                    # E.g. the model failed to load: fail these cars, keep serving
+                    for _, future in cars:
+                        if not future.done():
+                            future.set_exception(e)
+    
+    def _score(self, batch, version):
+        # One version for the cars not routed by their caller, as in model.predict_prices
+        version = version or model.current_version()
+        schema = version.schema
+        X = np.empty((len(batch), schema.n_features), dtype=np.float32)
+        valid = []
+        for input_data, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                # Encoded row by row: a bad car only fails its own request
+                schema.encode_row(input_data, out=X[len(valid)])
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            valid.append(future)
+        if not valid:
+            return
+        
+        prices, lower, upper = version.forest().predict_interval(
+            X[:len(valid)], coverage=self.coverage
+        )
+        self.batches += 1
+        self.rows += len(valid)
+        self.batch_sizes[len(valid)] += 1
+        for i, future in enumerate(valid):
+            future.set_result((prices[i], lower[i], upper[i]))
+    
+    def stats(self):
+        """Return the number of batches, rows and the batch-size histogram."""
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": round(self.rows / self.batches, 2) if self.batches else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items()))
+        }
+
+
+_lock = threading.Lock()
+_batcher = None
+
+
+def get_batcher():
+    """Return the shared batcher, starting it on first use."""
+    global _batcher
+    if _batcher is None:
+        with _lock:
+            if _batcher is None:
+                _batcher = PredictionBatcher().start()
+    return _batcher
+
+
+def _collect():
+    if _batcher is not None:
+        yield "batcher_batches", "counter", {}, _batcher.batches
+        yield "batcher_rows", "counter", {}, _batcher.rows
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,70 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks are run from the repository root, e.g.
+``python benchmarks/bench_batch.py``, so the model artifacts are found
+with the same relative paths as the Streamlit app.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from bundle import load_artifact
+
+CARBURANTS = ["Essence", "Diesel", "Electrique", "Hybride", "LPG"]
+ORIGINES = ["Dédouanée", "Importée neuve", "Pas encore dédouanée", "WW au Maroc"]
+
+
+def synthetic_listings(n, seed=0):
+    """
+    Generate n random but realistic inputs from the real category lists.
+    
+    Args:
+        n (int): Number of rows
+        seed (int): Random seed
+        
+    Returns:
+        pd.DataFrame: One row per car, with the predict_price input columns
+    """
+    rng = np.random.default_rng(seed)
+    brand_model_dict = load_artifact("brand_model_dict")
+    pairs = [(b, m) for b, models in brand_model_dict.items() for m in models]
+    pair_idx = rng.integers(0, len(pairs), n)
+    marques = np.array([p[0] for p in pairs], dtype=object)
+    modeles = np.array([p[1] for p in pairs], dtype=object)
+    localisations = np.array(load_artifact("localisation_list"), dtype=object)
+    etats = np.array(load_artifact("etat_list"), dtype=object)
+    boites = np.array(load_artifact("boite_list"), dtype=object)
+    
+    return pd.DataFrame({
+        "marque": marques[pair_idx],
+        "modele": modeles[pair_idx],
+        "annee_modele": rng.integers(1990, 2025, n),
+        "kilometrage": rng.integers(0, 101, n) * 5000,
+        "nombre_de_portes": rng.choice([3, 4, 5], n),
+        "puissance_fiscale": rng.integers(1, 21, n),
+        "premiere_main": rng.integers(0, 2, n),
+        "boite_vitesses": rng.choice(boites, n),
+        "type_de_carburant": rng.choice(np.array(CARBURANTS, dtype=object), n),
+        "origine": rng.choice(np.array(ORIGINES, dtype=object), n),
+        "etat_du_vehicule": rng.choice(etats, n),
+        "localisation": rng.choice(localisations, n)
+    })
+
+
+def best_of(fn, repeat=3):
+    """Return the best wall-clock time of fn() over a few runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
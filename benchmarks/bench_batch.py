@@ -0,0 +1,43 @@
+"""
+Throughput of model.predict_prices against the row-by-row predict_price.
+
+Usage:
+    python benchmarks/bench_batch.py [--max-rows 1000000]
+"""
+import argparse
+
+import numpy as np
+
+from _common import best_of, synthetic_listings
+
+import model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max-rows", type=int, default=1_000_000)
+    parser.add_argument("--parity-rows", type=int, default=200)
+    args = parser.parse_args()
+    
+    data = synthetic_listings(args.max_rows)
+    
+    # Parity: the batch path must reproduce predict_price row for row
+    sample = data.head(args.parity_rows)
+    expected = np.array([model.predict_price(row) for row in sample.to_dict("records")])
+    np.testing.assert_array_equal(model.predict_prices(sample), expected)
+    print(f"parity: {len(sample)} rows identical to predict_price")
+    
+    single = best_of(lambda: [model.predict_price(row) for row in sample.head(50).to_dict("records")])
+    print(f"{'predict_price':>14} {50 / single:>14,.0f} rows/s")
+    
+    print(f"{'batch size':>14} {'rows/s':>14}")
+    size = 1
+    while size <= args.max_rows:
+        batch = data.head(size)
+        elapsed = best_of(lambda: model.predict_prices(batch), repeat=3 if size < 100_000 else 1)
+        print(f"{size:>14,} {size / elapsed:>14,.0f}")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
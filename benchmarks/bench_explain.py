@@ -0,0 +1,46 @@
+"""
+Explanations per second, exact TreeSHAP against the Saabas approximation.
+
+Also checks additivity: base value + contributions must give the predicted
+price for every row.
+
+Usage:
+    python benchmarks/bench_explain.py [--max-rows 10000]
+"""
+import argparse
+
+import numpy as np
+
+from _common import best_of, synthetic_listings
+
+import model
+from explain import explain_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max-rows", type=int, default=10_000)
+    args = parser.parse_args()
+    
+    X = model.encode_batch(synthetic_listings(args.max_rows))
+    prices = model.predict_matrix(X)
+    for approximate in (False, True):
+        contributions, base_values = explain_matrix(X[:1000], approximate=approximate)
+        error = np.abs(base_values + contributions.sum(axis=1) - prices[:1000]) / np.abs(prices[:1000])
+        print(f"additivity ({'approximate' if approximate else 'exact'}): "
+              f"max relative error {error.max():.1e}")
+    
+    print(f"{'batch size':>12} {'exact/s':>12} {'approximate/s':>14} {'predict/s':>12}")
+    size = 1
+    while size <= args.max_rows:
+        batch = X[:size]
+        repeat = 5 if size < 1000 else 1
+        exact = best_of(lambda: explain_matrix(batch), repeat=repeat)
+        approximate = best_of(lambda: explain_matrix(batch, approximate=True), repeat=repeat)
+        point = best_of(lambda: model.predict_matrix(batch), repeat=repeat)
+        print(f"{size:>12,} {size / exact:>12,.0f} {size / approximate:>14,.0f} {size / point:>12,.0f}")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
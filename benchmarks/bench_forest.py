@@ -0,0 +1,75 @@
+"""
+NumPy forest (forest.py) against the pickled XGBoost model.
+
+Checks parity on a large synthetic input set (including missing values),
+then compares cold start and batch throughput.
+
+Usage:
+    python forest.py export
+    python benchmarks/bench_forest.py [--rows 1000000]
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from _common import ROOT, best_of, synthetic_listings
+
+import model
+from forest import Forest
+
+COLD_START = {
+    "forest": "import numpy as np; from forest import Forest; "
+              "Forest.load().predict(np.zeros((1, 22), np.float32))",
+    "pickle": "import numpy as np, joblib; "
+              "joblib.load('best_car_price_model.pkl').predict(np.zeros((1, 22), np.float32))"
+}
+
+
+def cold_start(code, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+    
+    forest = Forest.load()
+    
+    # Parity on realistic rows, with some missing cities
+    X = model.encode_batch(synthetic_listings(args.rows))
+    X[::13, model.get_schema().index["localisation"]] = np.nan
+    np.testing.assert_array_equal(forest.predict(X), model.predict_matrix(X))
+    
+    # Parity on uniformly random rows, with random missing values
+    rng = np.random.default_rng(1)
+    R = (rng.random((args.rows // 10, X.shape[1])) * np.nanmax(X, axis=0) * 1.2).astype(np.float32)
+    R[rng.random(R.shape) < 0.05] = np.nan
+    np.testing.assert_array_equal(forest.predict(R), model.predict_matrix(R))
+    print(f"parity: {len(X) + len(R):,} rows identical to the pickled model")
+    
+    for name, code in COLD_START.items():
+        print(f"cold start ({name}): {cold_start(code) * 1000:8.0f} ms")
+    
+    print(f"{'batch size':>12} {'xgboost rows/s':>16} {'forest rows/s':>16}")
+    size = 1
+    while size <= args.rows:
+        batch = X[:size]
+        repeat = 20 if size < 1000 else 3 if size < 100_000 else 1
+        xgb = best_of(lambda: model.predict_matrix(batch), repeat)
+        npy = best_of(lambda: forest.predict(batch), repeat)
+        print(f"{size:>12,} {size / xgb:>16,.0f} {size / npy:>16,.0f}")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
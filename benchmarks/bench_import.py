@@ -0,0 +1,74 @@
+"""
+Startup-time report for the prediction modules, based on ``python -X importtime``.
+
+Each target runs in a fresh interpreter. The report shows the total time and
+the slowest imported packages, and --max-ms turns it into a regression check
+(exit code 1 when a target is slower than allowed).
+
+Usage:
+    python benchmarks/bench_import.py [--top 10] [--max-ms 500]
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from _common import ROOT
+
+TARGETS = {
+    "import model": "import model",
+    "model.warmup()": "import model; model.warmup()",
+    "import forest": "import forest",
+    "import service": "import service"
+}
+
+
+def importtime(code):
+    """
+    Run code in a fresh interpreter with -X importtime.
+    
+    Returns:
+        tuple: (wall-clock seconds, {top-level package: microseconds})
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-W", "ignore", "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    elapsed = time.perf_counter() - start
+    
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        # Self time summed per top-level package (numpy, pandas, xgboost, ...)
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    return elapsed, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup-time report")
+    parser.add_argument("--top", type=int, default=8, help="Slowest packages to show per target")
+    parser.add_argument("--max-ms", type=float, help="Fail if a plain import takes longer")
+    args = parser.parse_args()
+    
+    failed = []
+    for label, code in TARGETS.items():
+        elapsed, packages = importtime(code)
+        print(f"{label}: {elapsed * 1000:.0f} ms wall clock")
+        for package, us in sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"    {us / 1000:8.1f} ms  {package}")
+        if args.max_ms and label.startswith("import") and elapsed * 1000 > args.max_ms:
+            failed.append(label)
+    
+    if failed:
+        print(f"Startup regression: {', '.join(failed)} slower than {args.max_ms:g} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
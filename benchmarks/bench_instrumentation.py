@@ -0,0 +1,53 @@
+"""
+Overhead of the prediction-path instrumentation, disabled and enabled.
+
+Rounds alternate between the two modes so that machine noise affects both
+equally; the best round of each mode is reported.
+
+Usage:
+    python benchmarks/bench_instrumentation.py [--rows 2000] [--rounds 5]
+"""
+import argparse
+import time
+
+from _common import synthetic_listings
+
+import instrumentation
+import model
+
+
+def per_call_us(records):
+    start = time.perf_counter()
+    for record in records:
+        model.predict_price(record)
+    return (time.perf_counter() - start) / len(records) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    
+    records = synthetic_listings(args.rows).to_dict("records")
+    model.warmup()
+    per_call_us(records[:100])
+    
+    best = {"disabled": float("inf"), "enabled": float("inf")}
+    for _ in range(args.rounds):
+        for mode in best:
+            if mode == "enabled":
+                instrumentation.enable()
+            else:
+                instrumentation.disable()
+            best[mode] = min(best[mode], per_call_us(records))
+    instrumentation.disable()
+    
+    print(f"{'mode':>10} {'us/call':>10}")
+    for mode, us in best.items():
+        print(f"{mode:>10} {us:>10.1f}")
+    print(f"enabled overhead: {best['enabled'] - best['disabled']:+.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Cost of prediction intervals against point predictions.
+
+Intervals come from one pass of the NumPy forest over the trees; the point
+prediction is the pickled XGBoost model. Both are timed on the same encoded
+rows, and the interval prices are checked to be identical to the point ones.
+
+Usage:
+    python benchmarks/bench_interval.py [--max-rows 100000]
+"""
+import argparse
+
+import numpy as np
+
+from _common import best_of, synthetic_listings
+
+import model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max-rows", type=int, default=100_000)
+    args = parser.parse_args()
+    
+    X = model.encode_batch(synthetic_listings(args.max_rows))
+    prices, lower, upper = model.predict_interval_matrix(X)
+    np.testing.assert_array_equal(prices, model.predict_matrix(X))
+    assert (lower <= prices).all() and (prices <= upper).all()
+    width = (upper - lower) / prices
+    print(f"parity: {len(X):,} interval prices identical to the point predictions")
+    print(f"90% interval width: median {np.median(width):.0%} of the price, "
+          f"p10 {np.percentile(width, 10):.0%}, p90 {np.percentile(width, 90):.0%}")
+    
+    print(f"{'batch size':>12} {'point rows/s':>14} {'interval rows/s':>16} {'overhead':>9}")
+    size = 1
+    while size <= args.max_rows:
+        batch = X[:size]
+        repeat = 20 if size < 1000 else 3
+        point = best_of(lambda: model.predict_matrix(batch), repeat=repeat)
+        interval = best_of(lambda: model.predict_interval_matrix(batch), repeat=repeat)
+        print(f"{size:>12,} {size / point:>14,.0f} {size / interval:>16,.0f} {interval / point:>8.1f}x")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Memory and encoding speed of the input representations.
+
+The same listings are held as input dicts, CarListing records, a
+DataFrame and a columnar CarListingBatch. Memory is traced with tracemalloc
+while each representation is built from scratch and is reported per million
+listings. Then each one is encoded into the model's feature matrix.
+
+Usage:
+    python benchmarks/bench_listing.py [--rows 200000]
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from _common import best_of, synthetic_listings
+
+import model
+from listing import CarListing, CarListingBatch
+
+
+def traced(build):
+    """Return (object, bytes still allocated by build once it returned)."""
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+    
+    data = synthetic_listings(args.rows)
+    # Plain Python scalars, as a JSON or CSV reader would produce
+    columns = {field: data[field].tolist() for field in data.columns}
+    model.warmup()
+    schema = model.get_schema()
+    
+    builders = {
+        "dicts": lambda: [dict(zip(columns, row)) for row in zip(*columns.values())],
+        "CarListing": lambda: [CarListing(*row) for row in zip(*columns.values())],
+        "DataFrame": lambda: pd.DataFrame(columns),
+        "CarListingBatch": lambda: CarListingBatch.from_frame(pd.DataFrame(columns))
+    }
+    print(f"{'representation':>16} {'MiB per 1M':>11} {'build s':>8} {'encode rows/s':>14}")
+    for name, build in builders.items():
+        start = time.perf_counter()
+        build()
+        build_seconds = time.perf_counter() - start
+        inputs, size = traced(build)
+        
+        if name == "DataFrame":
+            encode = lambda: schema.encode_frame(inputs)
+        elif name == "CarListingBatch":
+            encode = lambda: schema.encode_listings(inputs)
+        else:
+            # Row by row into one matrix, as the batcher does
+            def encode():
+                X = np.empty((len(inputs), schema.n_features), dtype=np.float32)
+                for i, record in enumerate(inputs):
+                    schema.encode_row(record, out=X[i])
+                return X
+        np.testing.assert_array_equal(encode(), schema.encode_frame(data))
+        elapsed = best_of(encode, repeat=2)
+        print(f"{name:>16} {size / len(data) * 1e6 / 2 ** 20:>11,.1f} {build_seconds:>8.2f} "
+              f"{len(data) / elapsed:>14,.0f}")
+        del inputs
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Throughput and resolution rate of the fuzzy category lookups on dirty inputs.
+
+A share of the brands, models and cities is rewritten the way scraped data
+misspells them (case, accents, punctuation, truncation, typos) and the
+resolver is asked to recover the original spelling.
+
+Usage:
+    python benchmarks/bench_lookup.py [--rows 1000000] [--dirty 0.3]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from _common import synthetic_listings
+
+from lookup import ListingResolver
+
+FIELDS = ["marque", "modele", "localisation"]
+
+
+def _misspell(value, rng):
+    kind = rng.integers(0, 5)
+    if kind == 0:
+        return value.lower()
+    if kind == 1:
+        return value.upper().replace("-", " ")
+    if kind == 2:
+        return value.replace("é", "e").replace("è", "e").replace("ë", "e") + " "
+    if kind == 3 and len(value) > 6:
+        return value[:max(4, len(value) - 3)]
+    if len(value) <= 4:
+        return value.lower()
+    # Drop one character, the most common typo
+    i = rng.integers(0, len(value))
+    return value[:i] + value[i + 1:]
+
+
+def dirty_listings(n, share, seed=0):
+    """Return (clean, dirty) listings where share of the category values are misspelled."""
+    rng = np.random.default_rng(seed)
+    clean = synthetic_listings(n, seed)
+    dirty = clean.copy()
+    for field in FIELDS:
+        values = dirty[field].to_numpy(dtype=object)
+        # Few distinct misspellings, like real scraped data
+        variants = {v: [_misspell(v, rng) for _ in range(3)] for v in set(values)}
+        rows = np.flatnonzero(rng.random(n) < share)
+        picks = rng.integers(0, 3, len(rows))
+        values[rows] = [variants[values[r]][p] for r, p in zip(rows, picks)]
+        dirty[field] = values
+    return clean, dirty
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--dirty", type=float, default=0.3, help="Share of misspelled values")
+    args = parser.parse_args()
+    
+    clean, dirty = dirty_listings(args.rows, args.dirty)
+    
+    start = time.perf_counter()
+    resolver = ListingResolver()
+    print(f"index build: {1000 * (time.perf_counter() - start):.1f} ms")
+    
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        cleaned, report = resolver.clean(dirty)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {args.rows:,} rows in {elapsed:.2f} s, {60 * args.rows / elapsed:,.0f} rows/min")
+    
+    print(f"{'field':>14} {'exact':>10} {'normalized':>10} {'prefix':>10} {'fuzzy':>10} "
+          f"{'unresolved':>10} {'correct':>9}")
+    for field in FIELDS:
+        counts = report[field]
+        correct = (cleaned[field].to_numpy() == clean[field].to_numpy()).mean()
+        print(f"{field:>14} {counts['exact']:>10,} {counts['normalized']:>10,} {counts['prefix']:>10,} "
+              f"{counts['fuzzy']:>10,} {counts['unresolved']:>10,} {correct:>9.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Market statistics: incremental updates and query latency against pandas.
+
+Synthetic priced listings are aggregated in batches, as new listing files
+would be merged into the saved statistics. The tab's queries (brand
+shares, age distribution and price quantiles of the top brands) are then
+timed on the loaded statistics and against recomputing them with pandas
+from the raw listings, and the sketched quantiles are compared with the
+exact ones.
+
+Usage:
+    python benchmarks/bench_market_stats.py [--rows 2000000] [--batches 10]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from _common import best_of, synthetic_listings
+
+from market_stats import PRICE_COLUMN, MarketStats
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def priced_listings(n, seed=0):
+    df = synthetic_listings(n, seed=seed)
+    rng = np.random.default_rng(seed)
+    # Lognormal prices, with a level per brand and a discount per year of age
+    brands, codes = np.unique(df["marque"].to_numpy(dtype=str), return_inverse=True)
+    level = rng.normal(11.8, 0.4, len(brands))[codes]
+    age = 2024 - df["annee_modele"].to_numpy()
+    df[PRICE_COLUMN] = np.exp(level - 0.06 * age + rng.normal(0, 0.35, n)).round(-2)
+    return df
+
+
+def tab_queries(stats):
+    brands, shares = stats.brand_shares(10)
+    ages = stats.age_distribution()
+    return brands, shares, ages, [stats.price_quantiles(marque=b, quantiles=QUANTILES) for b in brands]
+
+
+def pandas_queries(df):
+    shares = df["marque"].value_counts(normalize=True).head(10) * 100
+    age = df["annee_modele"].max() - df["annee_modele"]
+    ages = np.histogram(age, bins=[0, 3, 6, 11, 16, np.inf])[0] / len(df) * 100
+    top = df[df["marque"].isin(shares.index)]
+    return shares, ages, top.groupby("marque")[PRICE_COLUMN].quantile(list(QUANTILES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--batches", type=int, default=10)
+    args = parser.parse_args()
+    
+    df = priced_listings(args.rows)
+    batches = np.array_split(np.arange(len(df)), args.batches)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "market_stats.npz")
+        MarketStats().save(path)
+        merge_seconds = []
+        for rows in batches:
+            start = time.perf_counter()
+            batch = MarketStats()
+            batch.update(df.iloc[rows])
+            MarketStats.load(path).merge(batch).save(path)
+            merge_seconds.append(time.perf_counter() - start)
+        size = os.path.getsize(path)
+        load_seconds = best_of(lambda: MarketStats.load(path))
+        stats = MarketStats.load(path)
+    
+    # Merged batches give the same tables as one pass over all the listings
+    whole = MarketStats()
+    whole.update(df)
+    for name, table in whole.tables.items():
+        merged = stats.tables[name]
+        np.testing.assert_array_equal(merged.counts[[merged.index[k] for k in table.keys]], table.counts)
+    
+    per_batch = len(df) / args.batches
+    print(f"{len(df):,} listings in {args.batches} batches: {np.mean(merge_seconds):.2f} s per batch "
+          f"({per_batch / np.mean(merge_seconds):,.0f} rows/s, load + merge + save included)")
+    print(f"statistics file: {size / 1024:,.0f} KiB, loaded in {load_seconds * 1000:.1f} ms")
+    
+    sketch_ms = best_of(lambda: tab_queries(stats), repeat=20) * 1000
+    pandas_ms = best_of(lambda: pandas_queries(df)) * 1000
+    print(f"tab queries: {sketch_ms:.2f} ms from the statistics, {pandas_ms:,.0f} ms with pandas "
+          f"({pandas_ms / sketch_ms:,.0f}x)")
+    
+    brands, _, _, sketched = tab_queries(stats)
+    errors = []
+    for marque, prices in zip(brands, sketched):
+        exact = np.quantile(df.loc[df["marque"] == marque, PRICE_COLUMN], QUANTILES, method="lower")
+        errors.append(np.abs(prices / exact - 1).max())
+    print(f"price quantiles of the top brands: max relative error {max(errors):.2%}")
+
+
+if __name__ == "__main__":
+    main()
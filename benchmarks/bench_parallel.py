@@ -0,0 +1,47 @@
+"""
+Scaling of parallel.ParallelScorer from 1 to N workers.
+
+Checks that every configuration returns exactly the single-process output.
+
+Usage:
+    python benchmarks/bench_parallel.py [--rows 1000000] [--max-workers 32]
+"""
+import argparse
+import os
+
+import numpy as np
+
+from _common import best_of, synthetic_listings
+
+import model
+from parallel import ParallelScorer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--backend", choices=["process", "thread", "both"], default="both")
+    args = parser.parse_args()
+    
+    data = synthetic_listings(args.rows)
+    expected = model.predict_prices(data)
+    single = best_of(lambda: model.predict_prices(data), repeat=1)
+    print(f"single process: {args.rows / single:>12,.0f} rows/s")
+    
+    backends = ["process", "thread"] if args.backend == "both" else [args.backend]
+    workers = 1
+    print(f"{'backend':>8} {'workers':>8} {'rows/s':>12} {'speedup':>8}")
+    while workers <= args.max_workers:
+        for backend in backends:
+            with ParallelScorer(workers, backend) as scorer:
+                # The first call also starts the workers and loads the model
+                np.testing.assert_array_equal(scorer.score(data), expected)
+                elapsed = best_of(lambda: scorer.score(data), repeat=1)
+            print(f"{backend:>8} {workers:>8} {args.rows / elapsed:>12,.0f} {single / elapsed:>7.2f}x")
+        workers *= 2
+    print("output identical to single-process scoring")
+
+
+if __name__ == "__main__":
+    main()
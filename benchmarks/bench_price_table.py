@@ -0,0 +1,81 @@
+"""
+Precomputed price table lookups against live inference.
+
+Builds a table in a temporary file, checks that every tabulated price is
+identical to model.predict_price, then times single-car predictions on the
+grid (lookups) and off the grid (fallback to the model).
+
+Usage:
+    python benchmarks/bench_price_table.py [--rows 5000] [--top-models 100]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from _common import best_of
+
+import model
+import price_table
+
+
+def grid_records(table, n, seed=0):
+    """Random inputs on the table's grid."""
+    rng = np.random.default_rng(seed)
+    header = table.header
+    year_start, n_years = header["years"]
+    km_start, km_step, n_km = header["kilometrages"]
+    records = []
+    for _ in range(n):
+        marque, modele = header["pairs"][rng.integers(len(header["pairs"]))]
+        records.append(dict(
+            header["contexts"][rng.integers(len(header["contexts"]))],
+            marque=marque,
+            modele=modele,
+            annee_modele=year_start + int(rng.integers(n_years)),
+            kilometrage=km_start + km_step * int(rng.integers(n_km)),
+            etat_du_vehicule=header["etats"][rng.integers(len(header["etats"]))]
+        ))
+    return records
+
+
+def per_call_us(predict, records):
+    return best_of(lambda: [predict(record) for record in records], repeat=3) / len(records) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--top-models", type=int, default=100)
+    args = parser.parse_args()
+    
+    model.warmup()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, price_table.TABLE_PATH)
+        start = time.perf_counter()
+        header = price_table.build_table(path, args.top_models)
+        print(f"built {np.prod(header['shape']):,} prices in {time.perf_counter() - start:.1f} s, "
+              f"{os.path.getsize(path) / 2 ** 20:.1f} MiB")
+        
+        table = price_table.PriceTable(path)
+        on_grid = grid_records(table, args.rows)
+        prices = np.array([table.lookup(record) for record in on_grid])
+        np.testing.assert_array_equal(prices, [model.predict_price(record) for record in on_grid])
+        print(f"parity: {len(on_grid):,} tabulated prices identical to the model")
+        
+        # Same cars, one kilometre off the grid
+        off_grid = [dict(record, kilometrage=record["kilometrage"] + 1) for record in on_grid]
+        live = per_call_us(model.predict_price, on_grid)
+        hit = per_call_us(table.predict_price, on_grid)
+        miss = per_call_us(table.predict_price, off_grid)
+        print(f"{'path':>22} {'us/call':>10} {'speedup':>8}")
+        print(f"{'live model':>22} {live:>10.1f} {1:>7.1f}x")
+        print(f"{'table hit':>22} {hit:>10.1f} {live / hit:>7.1f}x")
+        print(f"{'table miss + model':>22} {miss:>10.1f} {live / miss:>7.1f}x")
+        del table
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Incremental update against full rebuild of the model and its encoders.
+
+Synthetic listings, with brands and models drawn with their training
+frequencies, are priced by the current model with noise. The
+"history" is priced as is, and the "new month" 8% higher, as if the market
+had moved. A base artifact set is first trained on the history, then, each
+in a fresh process (so peak memory is its own):
+
+    update:  train.py update new_month.csv --base-dir base  (continues boosting)
+    rebuild: train.py rebuild history.csv new_month.csv     (from scratch)
+
+Both are timed and evaluated on held-out listings of the new month.
+
+Usage:
+    python benchmarks/bench_train.py [--history-rows 300000] [--new-rows 30000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import joblib
+import numpy as np
+
+from _common import ROOT, synthetic_listings
+
+import model
+from bundle import load_artifact
+from features import FeatureEncoder, FeatureSchema, model_feature_names
+from train import MODEL_FILE, PRICE_COLUMN
+
+DRIFT = 1.08
+
+
+def priced_listings(n, drift, seed):
+    df = synthetic_listings(n, seed=seed)
+    rng = np.random.default_rng(seed)
+    # Brands and models as frequent as in the training data, so that the
+    # updated frequency encoders stay close to the current ones
+    modele_freq = load_artifact("modele_freq")
+    pairs = [(b, m) for b, models in load_artifact("brand_model_dict").items() for m in models]
+    weights = np.array([modele_freq.get(m, 0) for _, m in pairs])
+    chosen = rng.choice(len(pairs), n, p=weights / weights.sum())
+    df["marque"] = [pairs[i][0] for i in chosen]
+    df["modele"] = [pairs[i][1] for i in chosen]
+    noise = rng.lognormal(0, 0.1, n)
+    df[PRICE_COLUMN] = np.maximum(model.predict_prices(df), 5000) * drift * noise
+    return df
+
+
+def rmse(artifact_dir, listings):
+    fitted = joblib.load(os.path.join(artifact_dir, MODEL_FILE))
+    schema = FeatureSchema(model_feature_names(fitted), encoder=FeatureEncoder(artifact_dir))
+    X = schema.encode_frame(listings, unknown_localisation="missing")
+    error = fitted.get_booster().inplace_predict(X) - listings[PRICE_COLUMN].to_numpy()
+    return float(np.sqrt(np.mean(error ** 2)))
+
+
+def run_training(command, paths, output_dir, base_dir=ROOT):
+    report_path = output_dir + ".json"
+    subprocess.run([sys.executable, "-W", "ignore", "train.py", command, *paths, "--output-dir", output_dir,
+                    "--base-dir", base_dir, "--report", report_path],
+                   cwd=ROOT, check=True, capture_output=True)
+    with open(report_path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--history-rows", type=int, default=300_000)
+    parser.add_argument("--new-rows", type=int, default=30_000)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        history = os.path.join(tmp, "history.csv")
+        new_month = os.path.join(tmp, "new_month.csv")
+        priced_listings(args.history_rows, 1.0, seed=1).to_csv(history, index=False)
+        priced_listings(args.new_rows, DRIFT, seed=2).to_csv(new_month, index=False)
+        holdout = priced_listings(10_000, DRIFT, seed=3)
+        
+        base = os.path.join(tmp, "base")
+        run_training("rebuild", [history], base)
+        reports = {
+            "update": run_training("update", [new_month], os.path.join(tmp, "update"), base_dir=base),
+            "rebuild": run_training("rebuild", [history, new_month], os.path.join(tmp, "rebuild"))
+        }
+        print(f"new-month RMSE of the base model, trained on the history: {rmse(base, holdout):,.0f} MAD")
+        print(f"{'':>8} {'rows':>9} {'trees':>6} {'seconds':>8} {'peak MiB':>9} {'RMSE':>9}")
+        for mode, report in reports.items():
+            error = rmse(os.path.join(tmp, mode), holdout)
+            print(f"{mode:>8} {report['rows']:>9,} {report['trees']:>6} {report['seconds']['total']:>8.1f} "
+                  f"{report['peak_rss_mib']:>9,.0f} {error:>9,.0f}")
+        speedup = reports["rebuild"]["seconds"]["total"] / reports["update"]["seconds"]["total"]
+        print(f"update is {speedup:.1f}x faster than a full rebuild")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Multi-session load test of the Streamlit app's prediction path.
+
+Each simulated session is a thread, like a Streamlit script run, that
+predicts a price and its interval for distinct cars (cache misses) as fast
+as possible. Sessions either score their car directly, each in its own
+thread as the app used to, or through the shared batcher (batcher.py) that
+the app now uses. Throughput and latency percentiles are reported for both.
+
+Usage:
+    python benchmarks/load_app.py [--sessions 1,8,32,64] [--duration 5]
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from _common import synthetic_listings
+
+import batcher
+import model
+
+
+def direct(input_data):
+    return model.predict_price(input_data, return_interval=True)
+
+
+def run(predict, records, sessions, duration):
+    """Run sessions concurrent callers for duration seconds; return (calls, elapsed, latencies)."""
+    latencies = [[] for _ in range(sessions)]
+    barrier = threading.Barrier(sessions + 1)
+    
+    def session(i):
+        own = records[i::sessions]
+        barrier.wait()
+        deadline = time.monotonic() + duration
+        n = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            predict(own[n % len(own)])
+            latencies[i].append(time.perf_counter() - start)
+            n += 1
+    
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ms = np.concatenate([np.array(values) for values in latencies]) * 1000
+    return len(ms), elapsed, ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", default="1,8,32,64",
+                        help="Comma-separated numbers of concurrent sessions")
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+    
+    records = synthetic_listings(20_000).to_dict("records")
+    model.warmup()
+    shared = batcher.get_batcher()
+    direct(records[0])
+    shared.predict(records[0])
+    
+    print(f"{'sessions':>8} {'mode':>8} {'calls/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11}")
+    for sessions in [int(n) for n in args.sessions.split(",")]:
+        for mode, predict in (("direct", direct), ("batched", shared.predict)):
+            before = shared.stats()
+            calls, elapsed, ms = run(predict, records, sessions, args.duration)
+            batch = "-"
+            if mode == "batched":
+                after = shared.stats()
+                batch = f"{(after['rows'] - before['rows']) / max(after['batches'] - before['batches'], 1):.1f}"
+            print(f"{sessions:>8} {mode:>8} {calls / elapsed:>10,.0f} {np.percentile(ms, 50):>8.2f} "
+                  f"{np.percentile(ms, 99):>8.2f} {batch:>11}")
+
+
+if __name__ == "__main__":
+    main()
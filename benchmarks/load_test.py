@@ -0,0 +1,92 @@
+"""
+Local load test for service.py.
+
+Opens several keep-alive connections and sends single-car /predict requests
+as fast as possible, then reports throughput, client-side latency and the
+server's own metrics.
+
+Usage:
+    python service.py &
+    python benchmarks/load_test.py --concurrency 64 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from _common import synthetic_listings
+
+
+async def _request(reader, writer, host, method, path, payload=None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def _client(host, port, records, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    i = 0
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            status, _ = await _request(reader, writer, host, "POST", "/predict", records[i % len(records)])
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+            i += 1
+    finally:
+        writer.close()
+
+
+async def run(host, port, concurrency, duration):
+    records = synthetic_listings(10_000).to_dict("records")
+    records = [{k: v.item() if hasattr(v, "item") else v for k, v in r.items()} for r in records]
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _client(host, port, records[i::concurrency], deadline, latencies, errors)
+        for i in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - start
+    
+    ms = np.array(latencies) * 1000
+    print(f"requests:   {len(ms):,} ({len(errors)} errors) in {elapsed:.1f} s")
+    print(f"throughput: {len(ms) / elapsed:,.0f} req/s with {concurrency} connections")
+    print(f"latency:    p50 {np.percentile(ms, 50):.2f} ms, p99 {np.percentile(ms, 99):.2f} ms")
+    
+    reader, writer = await asyncio.open_connection(host, port)
+    _, metrics = await _request(reader, writer, host, "GET", "/metrics")
+    writer.close()
+    print("server metrics:")
+    print(json.dumps(metrics, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the prediction service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.host, args.port, args.concurrency, args.duration))
+
+
+if __name__ == "__main__":
+    main()
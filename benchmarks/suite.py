@@ -0,0 +1,303 @@
+"""
+Benchmark suite and regression gate for the prediction path.
+
+Measures cold import, single-call latency (split into encoding and
+inference), batch throughput at several sizes and peak memory per 100k rows,
+on synthetic inputs drawn from the real category lists. Results are written
+as JSON and compared against a stored baseline: the exit code is 1 when a
+metric is worse than the baseline by more than the threshold.
+
+Sub-millisecond timings on a shared machine easily move by 50% from one run
+to the next, so the timed cases are repeated --trials times and each
+metric keeps the median and the best trial. Every trial
+also times a fixed NumPy and Python reference workload: when the whole
+machine is slower than when the baseline was saved, the timings are scaled
+by the reference before they are compared. A metric only regresses when
+both its median and its best trial are worse than the baseline's by more
+than the threshold. The baseline records the machine it was measured on.
+Hardware differences are left to the reference scaling and only printed;
+the gate always runs, and a baseline taken with other Python, NumPy or
+XGBoost versions is reported with a warning, since library changes move the
+timings in ways the reference does not capture. The default threshold, 50%,
+is above the noise of a busy single-core machine; use a lower one on a quiet
+dedicated runner.
+
+Usage:
+    python benchmarks/suite.py [--output results.json] [--threshold 0.5] [--trials 5]
+    python benchmarks/suite.py --save-baseline    # after an intended change
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from _common import ROOT, best_of, synthetic_listings
+
+import model
+
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+BATCH_SIZES = [1, 100, 10_000, 100_000]
+TRIALS = 5
+# Run-to-run noise of the medians on a single-core VM reaches about 30%
+THRESHOLD = 0.5
+
+
+def _metric(value, unit, better, gated=True):
+    metric = {"value": round(float(value), 4), "unit": unit, "better": better}
+    if not gated:
+        metric["gated"] = False
+    return metric
+
+
+def _combine(trials):
+    """Merge the metrics of repeated trials into their median and best value."""
+    combined = {}
+    for name, metric in trials[0].items():
+        values = [trial[name]["value"] for trial in trials]
+        best = min(values) if metric["better"] == "lower" else max(values)
+        combined[name] = dict(_metric(np.median(values), metric["unit"], metric["better"],
+                                      metric.get("gated", True)),
+                              best=round(float(best), 4), trials=len(values))
+    return combined
+
+
+# Machine keys that change the timings in ways the reference workload does
+# not measure; the others (kernel, processor, cpus) are covered by its scaling
+STABLE_MACHINE_KEYS = ("python", "numpy", "xgboost")
+
+
+def machine():
+    """Describe the machine and library versions the results were measured with."""
+    import xgboost
+    
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "xgboost": xgboost.__version__
+    }
+
+
+def _run(code):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, result.stdout
+
+
+def cold_start(repeat=1):
+    """Fresh-interpreter import of model, and import plus first prediction."""
+    row = synthetic_listings(1).iloc[0].to_dict()
+    first = f"import model; model.predict_price({row!r})"
+    return {
+        "cold_import_model": _metric(min(_run("import model")[0] for _ in range(repeat)), "s", "lower"),
+        "cold_first_prediction": _metric(min(_run(first)[0] for _ in range(repeat)), "s", "lower")
+    }
+
+
+def reference_workload():
+    """Time of a fixed workload independent of the model, to measure the machine's speed."""
+    values = np.random.default_rng(0).random(100_000)
+    keys = [f"k{i}" for i in range(2000)]
+    
+    def work():
+        np.sort(values)
+        table = {}
+        for key in keys:
+            table[key] = table.get(key, 0) + len(key)
+    
+    return {"reference_workload": _metric(best_of(work, repeat=5) * 1000, "ms", "lower", gated=False)}
+
+
+def single_latency(rows):
+    """Per-call latency of predict_price, and of its encoding and inference stages."""
+    records = rows.to_dict("records")
+    schema = model.get_schema()
+    model.predict_price(records[0])
+    total, encode, infer = [], [], []
+    for record in records:
+        start = time.perf_counter()
+        model.predict_price(record)
+        total.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        X = schema.encode_row(record)
+        encode.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        model.predict_matrix(X)
+        infer.append(time.perf_counter() - start)
+    ms = {name: np.array(values) * 1000 for name, values in
+          (("total", total), ("encode", encode), ("infer", infer))}
+    return {
+        "predict_price_p50": _metric(np.percentile(ms["total"], 50), "ms", "lower"),
+        # Mostly measures the other processes on the machine; reported only
+        "predict_price_p99": _metric(np.percentile(ms["total"], 99), "ms", "lower", gated=False),
+        "encode_row_p50": _metric(np.percentile(ms["encode"], 50), "ms", "lower"),
+        "inference_p50": _metric(np.percentile(ms["infer"], 50), "ms", "lower")
+    }
+
+
+def batch_throughput(data, sizes):
+    """Rows per second of predict_prices for each batch size."""
+    metrics = {}
+    for size in sizes:
+        batch = data.head(size)
+        elapsed = best_of(lambda: model.predict_prices(batch), repeat=5 if size < 10_000 else 2)
+        metrics[f"batch_{size}_rows_per_s"] = _metric(size / elapsed, "rows/s", "higher")
+    return metrics
+
+
+def peak_memory(data):
+    """
+    Peak memory allocated while encoding and scoring 100k rows.
+    
+    Traced with tracemalloc, which sees Python and NumPy allocations but not
+    the booster's native buffers.
+    """
+    batch = data.head(100_000)
+    model.predict_prices(batch.head(1000))
+    tracemalloc.start()
+    try:
+        model.predict_prices(batch)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_memory_per_100k_rows": _metric(peak / len(batch) * 100_000 / 2 ** 20, "MiB", "lower")}
+
+
+def run_suite(quick=False, trials=TRIALS):
+    """
+    Run every case and return the results document.
+    
+    Args:
+        quick (bool): Fewer repetitions and no 100k batch, for a smoke run
+        trials (int): Number of times the timed cases are run
+    """
+    sizes = BATCH_SIZES[:-1] if quick else BATCH_SIZES
+    data = synthetic_listings(max(sizes))
+    metrics = {}
+    timings = []
+    for _ in range(trials):
+        trial = reference_workload()
+        trial.update(cold_start())
+        trial.update(single_latency(data.head(200 if quick else 2000)))
+        trial.update(batch_throughput(data, sizes))
+        timings.append(trial)
+    metrics.update(_combine(timings))
+    metrics.update(peak_memory(data))
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine(),
+        "metrics": metrics
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results with a baseline document.
+    
+    Repeated metrics are first scaled by the ratio of the reference
+    workload times, and are worse only if their median and their best trial
+    both are; the change printed is the scaled median's. Metrics saved with
+    "gated": false are printed but never fail the comparison.
+    
+    Returns:
+        list[str]: Names of the metrics worse than the baseline by more than threshold
+    """
+    speed = 1.0
+    reference = results["metrics"].get("reference_workload")
+    base_reference = baseline["metrics"].get("reference_workload")
+    if reference and base_reference:
+        # > 1 when this run's machine is slower than the baseline's
+        speed = reference["best"] / base_reference["best"]
+        print(f"Machine speed relative to the baseline: {1 / speed:.2f}x")
+    
+    def change(value, base_value, better, repeated):
+        if repeated:
+            value = value / speed if better == "lower" else value * speed
+        return value / base_value - 1
+    
+    def worse_than(value_change, better):
+        return value_change > threshold if better == "lower" else value_change < -threshold
+    
+    regressions = []
+    print(f"{'metric':<30} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metric in results["metrics"].items():
+        base = baseline["metrics"].get(name)
+        if base is None or not base["value"]:
+            print(f"{name:<30} {'-':>12} {metric['value']:>12,.3f}")
+            continue
+        repeated = name != "reference_workload" and "best" in metric and bool(base.get("best"))
+        median_change = change(metric["value"], base["value"], metric["better"], repeated)
+        worse = metric.get("gated", True) and worse_than(median_change, metric["better"])
+        if repeated:
+            worse = worse and worse_than(change(metric["best"], base["best"], metric["better"], True),
+                                         metric["better"])
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:<30} {base['value']:>12,.3f} {metric['value']:>12,.3f} {median_change:>+8.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="Write the results JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Allowed relative slowdown before failing (0.5 = 50%%)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baseline")
+    parser.add_argument("--trials", type=int, default=TRIALS,
+                        help="Repetitions of the timed cases")
+    parser.add_argument("--quick", action="store_true", help="Smaller, faster smoke run")
+    args = parser.parse_args()
+    
+    results = run_suite(quick=args.quick, trials=args.trials)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    
+    if not os.path.exists(args.baseline):
+        print(json.dumps(results, indent=2))
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    measured_on = baseline.get("machine", {})
+    changed = [key for key in results["machine"]
+               if measured_on.get(key) != results["machine"][key]]
+    hardware = [key for key in changed if key not in STABLE_MACHINE_KEYS]
+    versions = [key for key in changed if key in STABLE_MACHINE_KEYS]
+    if hardware:
+        print("The baseline was measured on other hardware ("
+              + ", ".join(f"{key}: {measured_on.get(key)} -> {results['machine'][key]}"
+                          for key in hardware)
+              + "); timings are scaled by the reference workload")
+    if versions:
+        print("WARNING: the baseline was measured with other library versions ("
+              + ", ".join(f"{key}: {measured_on.get(key)} -> {results['machine'][key]}"
+                          for key in versions)
+              + "); the comparison may not hold, save a baseline here with --save-baseline")
+    if regressions:
+        print(f"{len(regressions)} metric(s) regressed by more than {args.threshold:.0%}: "
+              f"{', '.join(regressions)}")
+        sys.exit(1)
+    print(f"No regression beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Streaming bulk valuation of CSV or Parquet listing files.
+
+The input is read in fixed-size chunks; each chunk is encoded and scored with
+one model call and appended to the output, so peak memory depends on the
+chunk size and not on the file size.
+
+Unknown brands and models get a frequency of 0 and unknown conditions are
+encoded as "Correct", exactly like model.predict_price. Unknown cities, which
+predict_price rejects, are scored as a missing value instead of aborting the
+stream, and counted in the progress line. With --resolve, misspelled brands,
+models and cities are first mapped to their known spelling (see lookup.py).
+With --explain, the contribution of every input field to the price is added
+as <field>_contribution columns (see explain.py).
+
+Usage:
+    python bulk.py listings.csv valued.parquet --chunk-size 100000 [--resolve] [--explain approximate]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import model
+from features import RAW_FIELDS, NUMERIC_FEATURES
+
+PRICE_COLUMN = "predicted_price"
+CONTRIBUTION_SUFFIX = "_contribution"
+
+# Read text fields as strings, so that e.g. the model "207" is not parsed as a number
+STRING_FIELDS = [f for f in RAW_FIELDS if f not in NUMERIC_FEATURES]
+
+
+def _file_format(path, fmt=None):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    if ext in (".csv", ".txt", ".gz", ".bz2", ".zip", ".xz"):
+        return "csv"
+    raise ValueError(f"Cannot infer the file format of {path}, use --input-format/--output-format")
+
+
+def read_chunks(path, chunk_size, fmt=None):
+    """
+    Yield the rows of a CSV or Parquet file as DataFrames of at most chunk_size rows.
+    
+    Args:
+        path (str): Input file
+        chunk_size (int): Rows per chunk
+        fmt (str): "csv" or "parquet" (inferred from the extension by default)
+    """
+    if _file_format(path, fmt) == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype={f: str for f in STRING_FIELDS})
+
+
+class ChunkWriter:
+    """
+    Appends DataFrame chunks to a CSV or Parquet file.
+    
+    Args:
+        path (str): Output file
+        fmt (str): "csv" or "parquet" (inferred from the extension by default)
+    """
+    
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = _file_format(path, fmt)
+        self._writer = None
+        self._schema = None
+        self._first = True
+    
+    def write(self, df):
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+    
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def value_file(input_path, output_path, chunk_size=100_000, input_format=None,
+               output_format=None, progress=True, resolve=False, explain=None):
+    """
+    Value every listing of input_path and write them with their price to output_path.
+    
+    Args:
+        input_path (str): CSV or Parquet file with the predict_price input columns
+        output_path (str): CSV or Parquet file to write
+        chunk_size (int): Rows read, scored and written at a time
+        input_format (str): Force "csv" or "parquet" for the input
+        output_format (str): Force "csv" or "parquet" for the output
+        progress (bool): Print a progress line to stderr
+        resolve (bool): Map misspelled brands, models and cities to known
+            spellings before encoding (the written columns are unchanged)
+        explain (str): "exact" or "approximate" to add per-field
+            contribution columns, None to skip explanations
+    
+    Returns:
+        dict: Rows processed, unknown cities, elapsed seconds and, with
+            resolve, the rows per lookup stage of each field
+    """
+    rows = 0
+    unknown_localisation = 0
+    resolver = None
+    if resolve:
+        from lookup import ListingResolver, format_report
+        resolver = ListingResolver()
+    start = time.perf_counter()
+    
+    with ChunkWriter(output_path, output_format) as writer:
+        for chunk in read_chunks(input_path, chunk_size, input_format):
+            inputs, report = resolver.clean(chunk) if resolver else (chunk, None)
+            # One version per chunk, for the encoding, prices and explanations
+            version = model.current_version()
+            X = model.encode_batch(inputs, unknown_localisation="missing", version=version)
+            localisation = X[:, version.schema.index["localisation"]]
+            unknown_localisation += int((np.isnan(localisation) & chunk["localisation"].notna().to_numpy()).sum())
+            chunk[PRICE_COLUMN] = version.predict_matrix(X) if len(X) else []
+            if explain and len(X):
+                from explain import explain_matrix
+                contributions, _ = explain_matrix(X, approximate=explain == "approximate", version=version)
+                for i, field in enumerate(RAW_FIELDS):
+                    chunk[f"{field}{CONTRIBUTION_SUFFIX}"] = contributions[:, i]
+            writer.write(chunk)
+            
+            rows += len(chunk)
+            if progress:
+                elapsed = time.perf_counter() - start
+                line = f"{rows:,} rows, {rows / elapsed:,.0f} rows/s, {unknown_localisation:,} unknown cities"
+                if resolver:
+                    line += f", {resolver.totals['marque']['unresolved']:,} unknown brands, " \
+                            f"{resolver.totals['modele']['unresolved']:,} unknown models " \
+                            f"(last chunk: {format_report(report)})"
+                print(f"\r{line}", end="", file=sys.stderr, flush=True)
+    
+    if progress:
+        print(file=sys.stderr)
+    summary = {
+        "rows": rows,
+        "unknown_localisation": unknown_localisation,
+        "seconds": time.perf_counter() - start
+    }
+    if resolver:
+        summary["lookup"] = {field: dict(counts) for field, counts in resolver.totals.items()}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Value a CSV or Parquet file of car listings")
+    parser.add_argument("input", help="CSV or Parquet file with the predict_price input columns")
+    parser.add_argument("output", help="CSV or Parquet file to write (input columns + predicted_price)")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--input-format", choices=["csv", "parquet"])
+    parser.add_argument("--output-format", choices=["csv", "parquet"])
+    parser.add_argument("--quiet", action="store_true", help="Do not print progress")
+    parser.add_argument("--resolve", action="store_true",
+                        help="Map misspelled brands, models and cities to known spellings")
+    parser.add_argument("--explain", choices=["exact", "approximate"],
+                        help="Add the contribution of each input field to the price")
+    args = parser.parse_args()
+    
+    value_file(args.input, args.output, args.chunk_size, args.input_format,
+               args.output_format, progress=not args.quiet, resolve=args.resolve,
+               explain=args.explain)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Versioned, memory-mapped bundle of the encoding artifacts.
+
+All lookup tables (frequency maps, city mapping, brand -> models dictionary
+and the dropdown lists) are stored in one file instead of nine pickles:
+
+    magic (8 bytes) | header length (uint64) | JSON header | aligned arrays
+
+Strings are stored as one UTF-8 byte array plus offsets, numbers as raw
+little-endian arrays. The file is memory-mapped read-only and nothing is
+unpickled: arrays are zero-copy views shared by every process on the host
+through the page cache. The encoder looks values up in dicts, though, which
+get() decodes from those arrays once per process; only the raw arrays, not
+the decoded tables, are shared. The header records the SHA-256 of the model
+pickle the bundle was built for.
+
+Usage:
+    python bundle.py build [artifacts.bundle] [--model best_car_price_model.pkl]
+    python bundle.py info [artifacts.bundle]
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+BUNDLE_PATH = "artifacts.bundle"
+MAGIC = b"CARBNDL\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# Artifact name -> pickle file it is converted from
+ARTIFACTS = {
+    "marque_freq": "marque_freq.pkl",
+    "modele_freq": "modele_freq.pkl",
+    "localisation_mapping": "localisation_mapping.pkl",
+    "brand_model_dict": "brand_model_dict.pkl",
+    "marque_list": "marque_list.pkl",
+    "modele_list": "modele_list.pkl",
+    "boite_list": "boite_list.pkl",
+    "carburant_list": "carburant_list.pkl",
+    "etat_list": "etat_list.pkl",
+    "localisation_list": "localisation_list.pkl",
+    "origine_list": "origine_list.pkl"
+}
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _string_arrays(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _artifact_arrays(name, value):
+    """Convert one artifact into (kind, {suffix: array})."""
+    if isinstance(value, list):
+        offsets, data = _string_arrays(value)
+        return "strings", {"offsets": offsets, "data": data}
+    if isinstance(value, dict) and all(isinstance(v, list) for v in value.values()):
+        key_offsets, key_data = _string_arrays(list(value))
+        members = [m for v in value.values() for m in v]
+        member_offsets, member_data = _string_arrays(members)
+        groups = np.zeros(len(value) + 1, dtype="<i8")
+        groups[1:] = np.cumsum([len(v) for v in value.values()])
+        return "groups", {
+            "keys.offsets": key_offsets, "keys.data": key_data,
+            "values.offsets": member_offsets, "values.data": member_data,
+            "groups": groups
+        }
+    if isinstance(value, dict):
+        key_offsets, key_data = _string_arrays(list(value))
+        values = np.array(list(value.values()))
+        dtype = "<i8" if np.issubdtype(values.dtype, np.integer) else "<f8"
+        return "mapping", {
+            "keys.offsets": key_offsets, "keys.data": key_data,
+            "values": values.astype(dtype)
+        }
+    raise TypeError(f"Cannot store artifact {name} of type {type(value).__name__}")
+
+
+def build_bundle(output_path=BUNDLE_PATH, model_path="best_car_price_model.pkl", artifact_dir="."):
+    """
+    Convert the pickled artifacts into a single bundle file.
+    
+    Args:
+        output_path (str): Bundle file to write
+        model_path (str): Model pickle the bundle is tied to
+        artifact_dir (str): Directory containing the .pkl artifacts
+    
+    Returns:
+        dict: The bundle header
+    """
+    import joblib
+    
+    header = {
+        "format_version": FORMAT_VERSION,
+        "model_sha256": file_sha256(model_path),
+        "artifacts": {},
+        "arrays": {}
+    }
+    arrays = []
+    offset = 0
+    for name, filename in ARTIFACTS.items():
+        path = os.path.join(artifact_dir, filename)
+        if not os.path.exists(path):
+            continue
+        kind, parts = _artifact_arrays(name, joblib.load(path))
+        header["artifacts"][name] = kind
+        for suffix, array in parts.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            header["arrays"][f"{name}.{suffix}"] = {
+                "offset": offset,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape)
+            }
+            arrays.append((offset, array))
+            offset += array.nbytes
+    
+    data = bytearray(offset)
+    for start, array in arrays:
+        data[start:start + array.nbytes] = array.tobytes()
+    header["data_sha256"] = hashlib.sha256(data).hexdigest()
+    
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix = len(MAGIC) + 8 + len(header_bytes)
+    padding = -prefix % ALIGNMENT
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes) + padding))
+        f.write(header_bytes + b" " * padding)
+        f.write(data)
+    # Atomic replace, so readers never see a half-written bundle
+    os.replace(tmp_path, output_path)
+    return header
+
+
+class ArtifactBundle:
+    """
+    Read-only, memory-mapped view of a bundle file.
+    
+    Arrays are zero-copy views of the mapping; Python objects (dicts and
+    lists) are only built for the artifacts actually requested, once per
+    process, and are private to it.
+    
+    Args:
+        path (str): Bundle file
+    """
+    
+    def __init__(self, path=BUNDLE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an artifact bundle")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(bytes(self._mmap[start:start + header_length]))
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported bundle format version {self.header['format_version']}")
+        self._data_start = start + header_length
+        self._objects = {}
+    
+    @property
+    def model_sha256(self):
+        """str: SHA-256 of the model pickle this bundle was built for."""
+        return self.header["model_sha256"]
+    
+    @property
+    def data_sha256(self):
+        """str: SHA-256 of the stored arrays, i.e. of the lookup tables' contents."""
+        return self.header["data_sha256"]
+    
+    def names(self):
+        """Return the names of the stored artifacts."""
+        return list(self.header["artifacts"])
+    
+    def array(self, name):
+        """Return a zero-copy view of one stored array."""
+        spec = self.header["arrays"][name]
+        count = int(np.prod(spec["shape"]))
+        return np.frombuffer(self._mmap, dtype=spec["dtype"], count=count,
+                             offset=self._data_start + spec["offset"]).reshape(spec["shape"])
+    
+    def strings(self, prefix):
+        """Decode a stored string table into a list."""
+        offsets = self.array(f"{prefix}.offsets")
+        data = self.array(f"{prefix}.data").tobytes()
+        return [data[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+    
+    def get(self, name):
+        """
+        Return an artifact as the Python object the pickle contained.
+        
+        Args:
+            name (str): Artifact name, e.g. "marque_freq" or "etat_list"
+        
+        Returns:
+            list | dict: The decoded artifact, cached for later calls
+        """
+        if name in self._objects:
+            return self._objects[name]
+        kind = self.header["artifacts"].get(name)
+        if kind is None:
+            raise KeyError(f"Artifact {name} is not in {self.path}")
+        if kind == "strings":
+            value = self.strings(f"{name}")
+        elif kind == "mapping":
+            value = dict(zip(self.strings(f"{name}.keys"), self.array(f"{name}.values").tolist()))
+        else:
+            members = self.strings(f"{name}.values")
+            groups = self.array(f"{name}.groups")
+            value = {
+                key: members[a:b]
+                for key, a, b in zip(self.strings(f"{name}.keys"), groups[:-1], groups[1:])
+            }
+        self._objects[name] = value
+        return value
+    
+    def verify(self, model_path=None):
+        """
+        Check the data checksum and, optionally, that the bundle matches a model pickle.
+        
+        Raises:
+            ValueError: If the data is corrupted or built for another model
+        """
+        data = self._mmap[self._data_start:]
+        if hashlib.sha256(data).hexdigest() != self.header["data_sha256"]:
+            raise ValueError(f"{self.path} is corrupted (data checksum mismatch)")
+        if model_path is not None and file_sha256(model_path) != self.model_sha256:
+            raise ValueError(
+                f"{self.path} was built for another model than {model_path}; "
+                "rebuild it with `python bundle.py build`"
+            )
+
+
+def load_artifact(name, artifact_dir="."):
+    """
+    Load one artifact from the bundle if there is one, else from its pickle.
+    
+    Args:
+        name (str): Artifact name, e.g. "marque_list"
+        artifact_dir (str): Directory containing the bundle or the pickles
+    
+    Returns:
+        list | dict: The artifact
+    """
+    path = os.path.join(artifact_dir, BUNDLE_PATH)
+    if os.path.exists(path):
+        return ArtifactBundle(path).get(name)
+    import joblib
+    return joblib.load(os.path.join(artifact_dir, ARTIFACTS[name]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the artifact bundle")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("path", nargs="?", default=BUNDLE_PATH)
+    parser.add_argument("--model", default="best_car_price_model.pkl")
+    args = parser.parse_args()
+    
+    if args.command == "build":
+        header = build_bundle(args.path, args.model)
+        print(f"Wrote {args.path}: {len(header['artifacts'])} artifacts, "
+              f"{os.path.getsize(args.path):,} bytes, model {header['model_sha256'][:12]}")
+    else:
+        bundle = ArtifactBundle(args.path)
+        bundle.verify()
+        print(f"{args.path}: format v{bundle.header['format_version']}, "
+              f"model {bundle.model_sha256[:12]}, data checksum OK")
+        for name, kind in bundle.header["artifacts"].items():
+            print(f"    {name:<22} {kind:<8} {len(bundle.get(name)):>5} entries")
+
+
+if __name__ == "__main__":
+    main()
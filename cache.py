@@ -0,0 +1,257 @@
+"""
+Bounded LRU cache in front of model.predict_price.
+
+Inputs are normalized into a hashable key (numeric fields as floats, mileage
+bucketed to the UI's 5000 km step) and the price of the normalized input is
+kept in a size-bounded LRU with an optional TTL. Keys include the SHA-256 of
+the model version that computed the price, so under A/B routing each arm
+only gets its own prices back. Everything is invalidated when the model or
+encoding artifacts change on disk.
+
+The HTTP service (service.py --cache-size) puts it in front of its batcher.
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import model
+from features import NUMERIC_FEATURES, RAW_FIELDS, to_float
+from instrumentation import metrics
+
+# Same step as the mileage number_input in app.py
+KILOMETRAGE_STEP = 5000
+
+WATCHED_FILES = [
+    "best_car_price_model.pkl",
+    "artifacts.bundle",
+    "marque_freq.pkl",
+    "modele_freq.pkl",
+    "localisation_mapping.pkl",
+    # Model registry: new, replaced or removed versions and routing changes
+    "models",
+    "models/routing.json"
+]
+
+
+def normalize_input(input_data, kilometrage_step=KILOMETRAGE_STEP):
+    """
+    Normalize a raw input into a hashable key.
+    
+    Numeric fields are converted the same way the encoder converts them, and
+    kilometrage is rounded to the nearest kilometrage_step.
+    
+    Args:
+        input_data (dict): Raw input, as built by the Streamlit UI
+        kilometrage_step (int): Mileage bucket size in km (None or 0 to disable)
+    
+    Returns:
+        tuple: Field values in RAW_FIELDS order
+    """
+    key = []
+    for field in RAW_FIELDS:
+        value = input_data[field]
+        if field in NUMERIC_FEATURES:
+            value = to_float(value)
+            if field == "kilometrage" and kilometrage_step:
+                value = float(round(value / kilometrage_step) * kilometrage_step)
+        key.append(value)
+    return tuple(key)
+
+
+def _entry_size(key, value):
+    """Approximate memory used by one cache entry, in bytes."""
+    version, fields = key
+    return (
+        sys.getsizeof(key)
+        + sys.getsizeof(version)
+        + sys.getsizeof(fields)
+        + sum(sys.getsizeof(item) for item in fields)
+        + sys.getsizeof(value)
+        # Linked-list node and dict slot of the OrderedDict
+        + 100
+    )
+
+
+class PredictionCache:
+    """
+    Size-bounded LRU of predicted prices with optional TTL.
+    
+    Args:
+        maxsize (int): Maximum number of cached prices
+        ttl (float): Seconds after which an entry expires (None to never expire)
+        kilometrage_step (int): Mileage bucket size used in the key
+        watched_files (list[str]): Files whose change clears the cache
+        check_interval (float): Minimum seconds between two checks of watched_files
+    """
+    
+    def __init__(self, maxsize=100_000, ttl=None, kilometrage_step=KILOMETRAGE_STEP,
+                 watched_files=WATCHED_FILES, check_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.kilometrage_step = kilometrage_step
+        self.watched_files = list(watched_files)
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented by clear(), so that prices computed before it are not stored after it
+        self.generation = 0
+        self._bytes = 0
+        self._signature = self._files_signature()
+        self._checked = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def _files_signature(self):
+        signature = []
+        for path in self.watched_files:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def _check_files(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+        signature = self._files_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.clear()
+            self.invalidations += 1
+    
+    def clear(self):
+        """Drop every cached price, including those still being computed."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+    
+    def key(self, input_data, version=None):
+        """
+        Return the cache key of an input.
+        
+        Args:
+            input_data (dict): Raw input
+            version (str): SHA-256 of the model version serving it
+        
+        Returns:
+            tuple: (version, normalized input)
+        """
+        return version, normalize_input(input_data, self.kilometrage_step)
+    
+    def get(self, key):
+        """Return the cached price of a key, or None on a miss."""
+        self._check_files()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._bytes -= _entry_size(key, value)
+                self.expirations += 1
+            self.misses += 1
+        return None
+    
+    def put(self, key, value, generation):
+        """
+        Store a computed price.
+        
+        Args:
+            key (tuple): Key returned by key()
+            value (float): Price
+            generation (int): The cache's generation when the computation
+                started; the price is dropped if the cache was cleared since
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key not in self._entries:
+                self._bytes += _entry_size(key, value)
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                old_key, (old_value, _) = self._entries.popitem(last=False)
+                self._bytes -= _entry_size(old_key, old_value)
+                self.evictions += 1
+    
+    def get_or_compute(self, input_data, compute, version=None):
+        """
+        Return the cached price for input_data, computing it on a miss.
+        
+        Args:
+            input_data (dict): Raw input
+            compute (callable): Called with the normalized input dict on a miss
+            version (str): SHA-256 of the model version compute uses
+        
+        Returns:
+            float: Predicted price
+        """
+        key = self.key(input_data, version)
+        value = self.get(key)
+        if value is None:
+            generation = self.generation
+            # Compute outside the lock so concurrent misses do not serialize
+            value = float(compute(dict(zip(RAW_FIELDS, key[1]))))
+            self.put(key, value, generation)
+        return value
+    
+    def stats(self):
+        """Return hit ratio, eviction and memory counters."""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "memory_bytes": self._bytes + sys.getsizeof(self._entries)
+        }
+
+
+# Shared cache used by cached_predict_price
+prediction_cache = PredictionCache()
+
+
+def cached_predict_price(input_data):
+    """
+    Predict a car price through the shared LRU cache.
+    
+    Args:
+        input_data (dict): User input from the Streamlit interface
+    
+    Returns:
+        float: Predicted price in MAD for the normalized input
+    """
+    # Routed once, so the price is computed by the version it is keyed on
+    version = model.current_version()
+    return prediction_cache.get_or_compute(
+        input_data, lambda normalized: model.predict_price(normalized, version=version), version.sha256
+    )
+
+
+def _collect():
+    """Prediction cache counters, exported with the instrumentation metrics."""
+    stats = prediction_cache.stats()
+    for name in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        yield f"prediction_cache_{name}", "counter", {}, stats[name]
+    yield "prediction_cache_size", "gauge", {}, stats["size"]
+
+
+metrics.register_collector(_collect)
@@ -0,0 +1,63 @@
+"""
+Price surfaces over model year and mileage for a single car.
+
+The car's invariant features are encoded once and broadcast across the whole
+year x mileage grid, which is scored with a single vectorized predict.
+"""
+import numpy as np
+
+import model
+
+# Same ranges as the year slider and mileage input in app.py
+YEARS = np.arange(1990, 2025)
+KILOMETRAGES = np.arange(0, 500_001, 5000)
+
+
+def price_surface(input_data, years=None, kilometrages=None, version=None):
+    """
+    Predict the price of one car for every combination of model year and mileage.
+    
+    Args:
+        input_data (dict): Base car, in the predict_price input format
+        years (array-like): Model years to sweep (the car's own year if None)
+        kilometrages (array-like): Mileages to sweep (the car's own mileage if None)
+        version (ModelVersion): Model to score with (routed per call if None)
+    
+    Returns:
+        tuple: (years, kilometrages, prices) where prices has shape
+            (len(years), len(kilometrages)), in MAD
+    """
+    years = np.atleast_1d(np.asarray(input_data["annee_modele"] if years is None else years))
+    kilometrages = np.atleast_1d(np.asarray(input_data["kilometrage"] if kilometrages is None else kilometrages))
+    
+    # Encode the invariant features once, then broadcast them across the grid
+    version = version or model.current_version()
+    schema = version.schema
+    base = schema.encode_row(input_data, out=np.empty((1, schema.n_features), dtype=np.float32))
+    X = np.repeat(base, len(years) * len(kilometrages), axis=0)
+    X[:, schema.index["annee_modele"]] = np.repeat(years, len(kilometrages))
+    X[:, schema.index["kilometrage"]] = np.tile(kilometrages, len(years))
+    
+    prices = version.predict_matrix(X).reshape(len(years), len(kilometrages))
+    return years, kilometrages, prices
+
+
+def depreciation_curve(input_data, reference_year=2025, years=YEARS, version=None):
+    """
+    Value retained by a car as it ages, at its current mileage.
+    
+    Args:
+        input_data (dict): Base car, in the predict_price input format
+        reference_year (int): Year used to turn model years into ages
+        years (array-like): Model years to sweep
+        version (ModelVersion): Model to score with (routed per call if None)
+    
+    Returns:
+        tuple: (ages, percentage) sorted by increasing age, where percentage
+            is the price relative to the newest model year
+    """
+    years, _, prices = price_surface(input_data, years=years, version=version)
+    prices = prices[:, 0]
+    order = np.argsort(years)[::-1]
+    ages = reference_year - years[order]
+    return ages, 100 * prices[order] / prices[order][0]
@@ -0,0 +1,132 @@
+"""
+Per-prediction explanations: how much each input field moved the price.
+
+Contributions come from the model itself (XGBoost pred_contribs): exact
+TreeSHAP values, or the much faster Saabas approximation for bulk exports.
+They are computed for whole batches and folded back from the encoded
+columns (frequencies, one-hot groups) into the raw input fields, so that
+for every car
+
+    base_value + sum(contributions) == predicted price
+"""
+import numpy as np
+
+import model
+from features import RAW_FIELDS
+
+BASE_VALUE = "base_value"
+
+# Encoded column prefixes -> raw input field
+ONE_HOT_PREFIXES = {
+    "type_carburant_": "type_de_carburant",
+    "origine_": "origine",
+    "etat_": "etat_du_vehicule",
+    "boite_vitesses_": "boite_vitesses"
+}
+
+
+def raw_field(column):
+    """
+    Return the raw input field an encoded model column is derived from.
+    
+    Args:
+        column (str): Model feature name, e.g. "marque_freq" or "etat_Neuf"
+    
+    Returns:
+        str: Raw field name, e.g. "marque" or "etat_du_vehicule"
+    """
+    if column in RAW_FIELDS:
+        return column
+    if column.endswith("_freq"):
+        return column[:-len("_freq")]
+    for prefix, field in ONE_HOT_PREFIXES.items():
+        if column.startswith(prefix):
+            return field
+    raise ValueError(f"Cannot map model column {column!r} to an input field")
+
+
+def fold_matrix(feature_names):
+    """
+    Return the (n_features, n_fields) 0/1 matrix that sums encoded columns per raw field.
+    
+    Args:
+        feature_names (list[str]): Model feature names, in column order
+    """
+    fold = np.zeros((len(feature_names), len(RAW_FIELDS)), dtype=np.float32)
+    for i, column in enumerate(feature_names):
+        fold[i, RAW_FIELDS.index(raw_field(column))] = 1
+    return fold
+
+
+def explain_matrix(X, approximate=False, version=None):
+    """
+    Compute per-field contributions for an encoded feature matrix.
+    
+    Args:
+        X (np.ndarray): float32 matrix of shape (n_rows, n_features)
+        approximate (bool): Use the Saabas approximation instead of exact
+            TreeSHAP values (orders of magnitude faster, same additivity)
+        version (ModelVersion): Model to explain (routed per call if None)
+    
+    Returns:
+        tuple: (contributions, base_values) where contributions has shape
+            (n_rows, len(RAW_FIELDS)) in MAD, columns in RAW_FIELDS order
+    """
+    import xgboost as xgb
+    
+    version = version or model.current_version()
+    if not hasattr(version.model, "get_booster"):
+        raise TypeError(f"Explanations need an XGBoost model, got {type(version.model).__name__}")
+    booster = version.model.get_booster()
+    names = version.schema.feature_names
+    contribs = booster.predict(xgb.DMatrix(X, feature_names=names),
+                               pred_contribs=True, approx_contribs=approximate)
+    # The last column is the bias term, shared by every row
+    return contribs[:, :-1] @ fold_matrix(names), contribs[:, -1]
+
+
+def explain_prices(records, unknown_localisation="raise", approximate=False):
+    """
+    Explain the predicted price of many cars at once.
+    
+    Args:
+        records (list[dict] | pd.DataFrame): Raw inputs, one per car
+        unknown_localisation (str): "raise" or "missing", see model.predict_prices
+        approximate (bool): Use the fast Saabas approximation
+    
+    Returns:
+        pd.DataFrame: One row per car, the contribution of each raw field in
+            MAD and the base value
+    """
+    import pandas as pd
+    
+    version = model.current_version()
+    X = model.encode_batch(records, unknown_localisation=unknown_localisation, version=version)
+    if len(X) == 0:
+        return pd.DataFrame(columns=RAW_FIELDS + [BASE_VALUE], dtype=np.float32)
+    contributions, base_values = explain_matrix(X, approximate=approximate, version=version)
+    explanation = pd.DataFrame(contributions, columns=RAW_FIELDS)
+    explanation[BASE_VALUE] = base_values
+    return explanation
+
+
+def explain_price(input_data, approximate=False, version=None):
+    """
+    Explain one predicted price.
+    
+    Args:
+        input_data (dict): User input from the Streamlit interface
+        approximate (bool): Use the fast Saabas approximation
+        version (ModelVersion): Model to explain (routed per call if None)
+    
+    Returns:
+        dict: Raw field -> contribution in MAD, largest effect first, and
+            the base value under BASE_VALUE
+    """
+    version = version or model.current_version()
+    X = version.schema.encode_row(input_data)
+    contributions, base_values = explain_matrix(X, approximate=approximate, version=version)
+    order = np.argsort(-np.abs(contributions[0]), kind="stable")
+    explanation = {RAW_FIELDS[i]: float(contributions[0, i]) for i in order}
+    explanation[BASE_VALUE] = float(base_values[0])
+    return explanation
@@ -0,0 +1,506 @@
+"""
+In-memory feature encoders shared by every prediction path.
+
+The encoding artifacts (frequency maps, city mapping) are loaded once, from
+the artifact bundle or the pickles, and kept in memory. A file is only reloaded when it changes on disk, so the hot
+path does no disk I/O or unpickling.
+
+The FeatureSchema compiles the column layout of a fitted model into direct
+column indices, so raw inputs are written straight into a NumPy matrix
+without building any DataFrame.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from bundle import ARTIFACTS, BUNDLE_PATH, ArtifactBundle
+
+# Raw input fields, as built by the Streamlit UI
+RAW_FIELDS = [
+    "marque",
+    "modele",
+    "annee_modele",
+    "kilometrage",
+    "nombre_de_portes",
+    "puissance_fiscale",
+    "premiere_main",
+    "boite_vitesses",
+    "type_de_carburant",
+    "origine",
+    "etat_du_vehicule",
+    "localisation"
+]
+
+NUMERIC_FEATURES = [
+    "annee_modele",
+    "kilometrage",
+    "nombre_de_portes",
+    "puissance_fiscale",
+    "premiere_main"
+]
+
+# Raw category value -> one-hot column, including the fallbacks the model
+# has always used (Diesel -> Essence, Dédouanée -> WW au Maroc)
+CARBURANT_COLUMNS = {
+    "Diesel": "type_carburant_Essence",
+    "Electrique": "type_carburant_Electrique",
+    "Essence": "type_carburant_Essence",
+    "Hybride": "type_carburant_Hybride",
+    "LPG": "type_carburant_LPG"
+}
+
+ORIGINE_COLUMNS = {
+    "Importée neuve": "origine_Importée neuve",
+    "Pas encore dédouanée": "origine_Pas encore dédouanée",
+    "WW au Maroc": "origine_WW au Maroc",
+    "Dédouanée": "origine_WW au Maroc"
+}
+
+ETAT_COLUMNS = {
+    "Correct": "etat_Correct",
+    "Endommagé": "etat_Endommagé",
+    "Excellent": "etat_Excellent",
+    "Neuf": "etat_Neuf",
+    "Pour Pièces": "etat_Pour Pièces",
+    "Très bon": "etat_Très bon"
+}
+
+# Unknown conditions are encoded as "Correct"
+DEFAULT_ETAT_COLUMN = "etat_Correct"
+
+# Every column this encoder can produce
+ENCODED_COLUMNS = set(NUMERIC_FEATURES) | {
+    "localisation",
+    "marque_freq",
+    "modele_freq",
+    "boite_vitesses_Manuelle"
+} | set(CARBURANT_COLUMNS.values()) | set(ORIGINE_COLUMNS.values()) | set(ETAT_COLUMNS.values())
+
+
+class ArtifactCache:
+    """
+    Keeps unpickled artifacts in memory and reloads them only when the file changes.
+    
+    A change is detected from the file's mtime and size. When verify_hash is
+    set, a changed mtime is confirmed against the SHA-256 of the content, so a
+    file that is merely touched is not reloaded.
+    
+    Args:
+        check_interval (float): Minimum seconds between two stat() calls for
+            the same file. 0 checks on every access.
+        verify_hash (bool): Confirm mtime changes with a content hash
+    """
+    
+    def __init__(self, check_interval=1.0, verify_hash=False):
+        self.check_interval = check_interval
+        self.verify_hash = verify_hash
+        self.hits = 0
+        self.reloads = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _sha256(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def get(self, path, loader=None):
+        """
+        Return the loaded content of path, loading it only if needed.
+        
+        Args:
+            path (str): Path to a joblib/pickle artifact
+            loader (callable): Called with the path to load it (joblib.load by default)
+        
+        Returns:
+            object: The loaded artifact
+        """
+        entry = self._entries.get(path)
+        now = time.monotonic()
+        if entry is not None and now - entry["checked"] < self.check_interval:
+            self.hits += 1
+            return entry["value"]
+        
+        with self._lock:
+            entry = self._entries.get(path)
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if entry is not None and entry["signature"] == signature:
+                entry["checked"] = now
+                self.hits += 1
+                return entry["value"]
+            
+            digest = self._sha256(path) if self.verify_hash else None
+            if entry is not None and digest is not None and entry["digest"] == digest:
+                # Touched but unchanged content
+                entry.update(signature=signature, checked=now)
+                self.hits += 1
+                return entry["value"]
+            
+            if loader is None:
+                import joblib
+                loader = joblib.load
+            value = loader(path)
+            self._entries[path] = {
+                "value": value,
+                "signature": signature,
+                "digest": digest,
+                "checked": now
+            }
+            self.reloads += 1
+            return value
+    
+    def stats(self):
+        """Return cache hit and reload counters."""
+        return {"hits": self.hits, "reloads": self.reloads, "files": len(self._entries)}
+
+
+class FeatureEncoder:
+    """
+    Lookup tables used to encode raw inputs, loaded lazily and cached in memory.
+    
+    Tables are read from the memory-mapped artifact bundle when there is one,
+    and from the individual pickles otherwise.
+    
+    Once verify_model() has tied the encoder to a model, every reload of a
+    changed bundle is checked against that model's SHA-256 too. A bundle
+    built for another model (e.g. a new train.py release copied over a
+    running app, whose model stays in memory) is rejected, and the previous
+    bundle keeps serving until the process is restarted with the new model.
+    
+    Args:
+        artifact_dir (str): Directory containing the bundle or the .pkl artifacts
+        cache (ArtifactCache): Cache to load them through (a new one by default)
+    """
+    
+    def __init__(self, artifact_dir=".", cache=None):
+        self.artifact_dir = artifact_dir
+        self.cache = cache if cache is not None else ArtifactCache()
+        self._bundle_checked = None
+        self._has_bundle = False
+        # SHA-256 of the model the bundle must match, set by verify_model
+        self.model_sha256 = None
+        self._bundle = None
+        self.bundle_errors = 0
+    
+    def _path(self, name):
+        return os.path.join(self.artifact_dir, name)
+    
+    def bundle(self):
+        """Return the current ArtifactBundle, or None when only pickles exist."""
+        now = time.monotonic()
+        if self._bundle_checked is None or now - self._bundle_checked >= self.cache.check_interval:
+            self._has_bundle = os.path.exists(self._path(BUNDLE_PATH))
+            self._bundle_checked = now
+        if self._has_bundle:
+            try:
+                self._bundle = self.cache.get(self._path(BUNDLE_PATH), loader=self._load_bundle)
+            except FileNotFoundError:
+                self._has_bundle = False
+            except ValueError:
+                # Keep the bundle matching the loaded model; the new file is
+                # checked again at the next interval
+                self.bundle_errors += 1
+                if self._bundle is None:
+                    raise
+            return self._bundle
+        return None
+    
+    def _load_bundle(self, path):
+        bundle = ArtifactBundle(path)
+        if self.model_sha256 is not None:
+            bundle.verify()
+            if bundle.model_sha256 != self.model_sha256:
+                raise ValueError(f"{path} was built for another model than the one loaded")
+        return bundle
+    
+    def artifact(self, name):
+        """
+        Return one artifact, e.g. "marque_freq" or "etat_list".
+        
+        Args:
+            name (str): Artifact name, see bundle.ARTIFACTS
+        """
+        bundle = self.bundle()
+        if bundle is not None:
+            return bundle.get(name)
+        return self.cache.get(self._path(ARTIFACTS[name]))
+    
+    @property
+    def marque_freq(self):
+        """dict: Brand -> frequency in the training data."""
+        return self.artifact("marque_freq")
+    
+    @property
+    def modele_freq(self):
+        """dict: Model -> frequency in the training data."""
+        return self.artifact("modele_freq")
+    
+    @property
+    def localisation_mapping(self):
+        """dict: City name -> integer code."""
+        try:
+            return self.artifact("localisation_mapping")
+        except (FileNotFoundError, KeyError):
+            # Rebuild the mapping from the city list, as the model did originally
+            localisation_list = self.artifact("localisation_list")
+            return {loc: i for i, loc in enumerate(localisation_list)}
+    
+    def verify_model(self, model_path):
+        """
+        Check that the artifact bundle, if any, was built for this model pickle.
+        
+        Later reloads of the bundle are checked against the same model.
+        
+        Raises:
+            ValueError: If the bundle is corrupted or built for another model
+        """
+        from bundle import file_sha256
+        
+        bundle = self.bundle()
+        if bundle is not None:
+            bundle.verify(model_path)
+        self.model_sha256 = file_sha256(model_path)
+    
+    def stats(self):
+        """Return cache hit, reload and rejected bundle counters."""
+        return dict(self.cache.stats(), bundle_errors=self.bundle_errors)
+
+
+# Shared encoder, loaded on first use
+encoder = FeatureEncoder()
+
+
+def model_feature_names(model):
+    """
+    Return the ordered feature names a fitted model was trained on.
+    
+    Args:
+        model: Fitted XGBoost or scikit-learn regressor
+    
+    Returns:
+        list[str]: Feature names in column order
+    """
+    if hasattr(model, "get_booster"):
+        names = model.get_booster().feature_names
+    else:
+        names = getattr(model, "feature_names_in_", None)
+    if names is None:
+        raise ValueError("The model does not record its feature names")
+    return list(names)
+
+
+def to_float(value):
+    """Scalar equivalent of pd.to_numeric(errors="coerce").fillna(0)."""
+    if value is None:
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class FeatureSchema:
+    """
+    Column layout of a fitted model, compiled into direct column indices.
+    
+    Construction fails immediately if the model expects a column this
+    encoder cannot produce, or the other way round.
+    
+    Args:
+        feature_names (list[str]): Model feature names, in column order
+        encoder (FeatureEncoder): Lookup tables (the shared encoder by default)
+    """
+    
+    def __init__(self, feature_names, encoder=encoder):
+        self.feature_names = list(feature_names)
+        self.encoder = encoder
+        
+        missing = sorted(set(self.feature_names) - ENCODED_COLUMNS)
+        unused = sorted(ENCODED_COLUMNS - set(self.feature_names))
+        if missing or unused or len(set(self.feature_names)) != len(self.feature_names):
+            raise ValueError(
+                "Model features and encoder disagree: "
+                f"not produced by the encoder {missing}, not expected by the model {unused}"
+            )
+        
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.n_features = len(self.feature_names)
+        self.numeric_index = [(f, self.index[f]) for f in NUMERIC_FEATURES]
+        self.carburant_index = {k: self.index[v] for k, v in CARBURANT_COLUMNS.items()}
+        self.origine_index = {k: self.index[v] for k, v in ORIGINE_COLUMNS.items()}
+        self.etat_index = {k: self.index[v] for k, v in ETAT_COLUMNS.items()}
+        self.default_etat_index = self.index[DEFAULT_ETAT_COLUMN]
+        self._local = threading.local()
+    
+    @classmethod
+    def from_model(cls, model, encoder=encoder):
+        """Compile the schema of a fitted model."""
+        return cls(model_feature_names(model), encoder=encoder)
+    
+    def row_buffer(self):
+        """Return this thread's reusable (1, n_features) float32 buffer."""
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.zeros((1, self.n_features), dtype=np.float32)
+        return row
+    
+    def encode_row(self, input_data, out=None):
+        """
+        Encode a single raw input into a feature row.
+        
+        Args:
+            input_data (dict): Raw input, as built by the Streamlit UI
+            out (np.ndarray): Row to write into. Defaults to the thread's
+                reusable buffer, which is overwritten by the next call.
+        
+        Returns:
+            np.ndarray: float32 array of shape (1, n_features)
+        """
+        row = self.row_buffer() if out is None else out
+        values = row[0] if row.ndim == 2 else row
+        values[:] = 0
+        index = self.index
+        
+        for feature, i in self.numeric_index:
+            values[i] = to_float(input_data[feature])
+        
+        values[index["marque_freq"]] = self.encoder.marque_freq.get(input_data["marque"], 0)
+        values[index["modele_freq"]] = self.encoder.modele_freq.get(input_data["modele"], 0)
+        values[index["boite_vitesses_Manuelle"]] = input_data["boite_vitesses"] == "Manuelle"
+        
+        i = self.carburant_index.get(input_data["type_de_carburant"])
+        if i is not None:
+            values[i] = 1
+        i = self.origine_index.get(input_data["origine"])
+        if i is not None:
+            values[i] = 1
+        values[self.etat_index.get(input_data["etat_du_vehicule"], self.default_etat_index)] = 1
+        
+        values[index["localisation"]] = self._localisation(input_data["localisation"])
+        return row
+    
+    def _localisation(self, value):
+        """Numeric localisations are used as-is, city names are mapped."""
+        if value is None:
+            return math.nan
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+        code = self.encoder.localisation_mapping.get(value)
+        if code is None:
+            raise ValueError(f"Unknown localisation: {value!r}")
+        return code
+    
+    def encode_frame(self, df, unknown_localisation="raise"):
+        """
+        Encode a DataFrame of raw inputs, one vectorized pass per field.
+        
+        Args:
+            df (pd.DataFrame): Raw inputs, one row per car
+            unknown_localisation (str): "raise" to reject unknown city names,
+                like predict_price, or "missing" to encode them as NaN, which
+                the model treats as a missing value
+        
+        Returns:
+            np.ndarray: float32 matrix of shape (len(df), n_features)
+        """
+        # Imported here so that single-row prediction never pays for pandas
+        import pandas as pd
+        
+        df = df.reset_index(drop=True)
+        X = np.zeros((len(df), self.n_features), dtype=np.float32)
+        index = self.index
+        
+        for feature, i in self.numeric_index:
+            X[:, i] = pd.to_numeric(df[feature], errors="coerce").fillna(0).to_numpy()
+        
+        X[:, index["marque_freq"]] = df["marque"].map(self.encoder.marque_freq).fillna(0).to_numpy()
+        X[:, index["modele_freq"]] = df["modele"].map(self.encoder.modele_freq).fillna(0).to_numpy()
+        X[:, index["boite_vitesses_Manuelle"]] = (df["boite_vitesses"] == "Manuelle").to_numpy()
+        
+        self._one_hot(X, df["type_de_carburant"], self.carburant_index)
+        self._one_hot(X, df["origine"], self.origine_index)
+        self._one_hot(X, df["etat_du_vehicule"], self.etat_index, default=self.default_etat_index)
+        
+        # Localisation: numeric values are used as-is, city names are mapped
+        localisation = pd.to_numeric(df["localisation"], errors="coerce")
+        names = localisation.isna() & df["localisation"].notna()
+        if names.any():
+            mapped = df.loc[names, "localisation"].map(self.encoder.localisation_mapping)
+            if mapped.isna().any() and unknown_localisation == "raise":
+                unknown = sorted(set(df.loc[mapped[mapped.isna()].index, "localisation"]))
+                raise ValueError(f"Unknown localisation: {unknown}")
+            localisation[names] = mapped
+        X[:, index["localisation"]] = localisation.to_numpy()
+        
+        return X
+    
+    def encode_listings(self, batch, unknown_localisation="raise"):
+        """
+        Encode a listing.CarListingBatch without building any DataFrame.
+        
+        Every distinct category value is looked up once, then its encoding is
+        gathered for all rows through the batch's integer codes.
+        
+        Args:
+            batch (listing.CarListingBatch): Columnar inputs
+            unknown_localisation (str): "raise" or "missing", see encode_frame
+        
+        Returns:
+            np.ndarray: float32 matrix of shape (len(batch), n_features)
+        """
+        X = np.zeros((len(batch), self.n_features), dtype=np.float32)
+        index = self.index
+        columns, categories = batch.columns, batch.categories
+        
+        def gather(field, lookup, dtype=np.float32):
+            table = np.array([lookup(value) for value in categories[field]], dtype=dtype)
+            return table[columns[field]] if len(table) else np.zeros(len(batch), dtype=dtype)
+        
+        for feature, i in self.numeric_index:
+            X[:, i] = columns[feature]
+        
+        X[:, index["marque_freq"]] = gather("marque", lambda v: self.encoder.marque_freq.get(v, 0))
+        X[:, index["modele_freq"]] = gather("modele", lambda v: self.encoder.modele_freq.get(v, 0))
+        X[:, index["boite_vitesses_Manuelle"]] = gather("boite_vitesses", lambda v: v == "Manuelle")
+        
+        rows = np.arange(len(batch))
+        one_hot = (
+            ("type_de_carburant", self.carburant_index, -1),
+            ("origine", self.origine_index, -1),
+            ("etat_du_vehicule", self.etat_index, self.default_etat_index)
+        )
+        for field, column_index, default in one_hot:
+            column = gather(field, lambda v: column_index.get(v, default), dtype=np.int64)
+            known = column >= 0
+            X[rows[known], column[known]] = 1
+        
+        def localisation(value):
+            try:
+                return self._localisation(value)
+            except ValueError:
+                if unknown_localisation == "raise":
+                    raise
+                return math.nan
+        
+        X[:, index["localisation"]] = gather("localisation", localisation)
+        return X
+    
+    @staticmethod
+    def _one_hot(X, values, column_index, default=None):
+        """Set one-hot columns of X from a Series of raw category values."""
+        for column in set(column_index.values()):
+            categories = [k for k, v in column_index.items() if v == column]
+            X[:, column] = values.isin(categories).to_numpy()
+        if default is not None:
+            unknown = ~values.isin(list(column_index)).to_numpy()
+            X[unknown, default] = 1
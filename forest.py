@@ -0,0 +1,357 @@
+"""
+Lightweight NumPy inference engine for the tree ensemble.
+
+The fitted XGBoost booster is flattened into compact per-node arrays
+(feature index, threshold, left/right child, default direction and leaf
+value) saved in an .npz file. The Forest predictor only needs NumPy: it walks
+all trees for a batch of rows level by level, so serverless workers do not
+need to import xgboost or scikit-learn.
+
+The price intervals are only calibrated when the forest is exported with
+held-out listings (sale prices the model was not trained on): the interval
+scale fitted on them is stored in the .npz with its coverage. Without it,
+the coverage of the intervals is nominal.
+
+Usage:
+    python forest.py export [--model best_car_price_model.pkl] [--output forest_model.npz]
+                            [--calibrate holdout.csv [...]] [--coverage 0.9]
+"""
+import argparse
+import hashlib
+import json
+
+import numpy as np
+
+FOREST_PATH = "forest_model.npz"
+
+# Rows x trees evaluated at once, keeps the working buffers in cache
+BLOCK_CELLS = 1 << 14
+
+# Up to this many rows the forest is faster than XGBoost's inplace_predict
+# (about 0.2 ms against 0.35 ms for one row on one core); beyond, XGBoost's
+# compiled predictor wins, by 3-4x on large batches
+FOREST_MAX_ROWS = 16
+
+# Early trees fit the bulk of the price; the size of the later residual
+# corrections measures how uncertain the ensemble is about a car
+INTERVAL_SKIP_TREES = 20
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _tree_depth(left, right):
+    depth = np.zeros(len(left), dtype=np.int32)
+    for node in range(len(left)):
+        if left[node] != -1:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max())
+
+
+def flatten_booster(booster):
+    """
+    Flatten a fitted XGBoost booster into padded (n_trees, max_nodes) arrays.
+    
+    Leaves point to themselves, so walking a fixed number of levels leaves
+    every row on its leaf.
+    
+    Args:
+        booster (xgboost.Booster): Fitted regression booster
+    
+    Returns:
+        dict: Arrays describing the ensemble, ready for np.savez
+    """
+    config = json.loads(booster.save_raw("json"))["learner"]
+    objective = config["objective"]["name"]
+    if objective not in ("reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror"):
+        raise ValueError(f"Unsupported objective {objective}: only identity-link regression can be flattened")
+    base_score = np.float32(config["learner_model_param"]["base_score"].strip("[]"))
+    
+    trees = config["gradient_booster"]["model"]["trees"]
+    max_nodes = max(len(t["left_children"]) for t in trees)
+    shape = (len(trees), max_nodes)
+    feature = np.zeros(shape, dtype=np.int32)
+    threshold = np.zeros(shape, dtype=np.float32)
+    left = np.tile(np.arange(max_nodes, dtype=np.int32), (len(trees), 1))
+    right = left.copy()
+    default_left = np.zeros(shape, dtype=bool)
+    value = np.zeros(shape, dtype=np.float32)
+    max_depth = 0
+    
+    for t, tree in enumerate(trees):
+        if any(tree.get("split_type", [])):
+            raise ValueError("Categorical splits are not supported")
+        children = np.array(tree["left_children"], dtype=np.int32)
+        right_children = np.array(tree["right_children"], dtype=np.int32)
+        conditions = np.array(tree["split_conditions"], dtype=np.float32)
+        n = len(children)
+        is_leaf = children == -1
+        split = ~is_leaf
+        
+        feature[t, :n] = np.where(split, tree["split_indices"], 0)
+        threshold[t, :n] = np.where(split, conditions, 0)
+        left[t, :n] = np.where(split, children, np.arange(n))
+        right[t, :n] = np.where(split, right_children, np.arange(n))
+        default_left[t, :n] = np.array(tree["default_left"], dtype=bool) & split
+        # Leaf values are stored in split_conditions
+        value[t, :n] = np.where(is_leaf, conditions, 0)
+        max_depth = max(max_depth, _tree_depth(children, right_children))
+    
+    return {
+        "feature": feature,
+        "threshold": threshold,
+        "left": left,
+        "right": right,
+        "default_left": default_left,
+        "value": value,
+        "base_score": np.array(base_score, dtype=np.float32),
+        "max_depth": np.array(max_depth, dtype=np.int32),
+        "feature_names": np.array(booster.feature_names or [], dtype=str)
+    }
+
+
+def export_forest(model_path="best_car_price_model.pkl", output_path=FOREST_PATH, calibration=None,
+                  coverage=0.9):
+    """
+    Export a pickled XGBoost model to a NumPy .npz forest.
+    
+    Args:
+        model_path (str): Pickled XGBRegressor (or Booster)
+        output_path (str): Where to write the .npz file
+        calibration (tuple): (X, y) held-out feature matrix and sale prices
+            to calibrate the intervals on, or None to leave them nominal
+        coverage (float): Interval coverage to calibrate for
+    
+    Returns:
+        Forest: The exported forest
+    """
+    import joblib
+    
+    fitted = joblib.load(model_path)
+    booster = fitted.get_booster() if hasattr(fitted, "get_booster") else fitted
+    arrays = flatten_booster(booster)
+    arrays["model_sha256"] = np.array(_file_sha256(model_path))
+    if calibration is not None:
+        X, y = calibration
+        arrays["interval_scale"] = np.array(Forest(arrays).calibrate_interval_scale(X, y, coverage))
+        arrays["interval_coverage"] = np.array(coverage)
+    np.savez(output_path, **arrays)
+    return Forest(arrays)
+
+
+class Forest:
+    """
+    Pure-NumPy predictor for a flattened tree ensemble.
+    
+    Args:
+        arrays (dict): Arrays produced by flatten_booster
+    """
+    
+    def __init__(self, arrays):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.default_left = arrays["default_left"]
+        self.value = arrays["value"]
+        self.base_score = np.float32(arrays["base_score"])
+        self.max_depth = int(arrays["max_depth"])
+        self.feature_names = [str(name) for name in arrays["feature_names"]]
+        self.model_sha256 = str(arrays["model_sha256"]) if "model_sha256" in arrays else None
+        # Set by export_forest when calibrated on held-out prices
+        self.interval_scale = float(arrays["interval_scale"]) if "interval_scale" in arrays else None
+        self.interval_coverage = float(arrays["interval_coverage"]) if "interval_coverage" in arrays else None
+        self.n_trees, self.max_nodes = self.feature.shape
+        
+        # Flat node tables indexed by the global node id tree * max_nodes + node.
+        # children[2 * id + go_left] is the global id of the next node.
+        offsets = (np.arange(self.n_trees, dtype=np.intp) * self.max_nodes)[:, None]
+        self._roots = offsets.ravel()
+        self._feature = self.feature.ravel().astype(np.intp)
+        self._threshold = self.threshold.ravel()
+        self._default_left = self.default_left.ravel()
+        self._value = self.value.ravel()
+        self._children = np.empty(2 * self.feature.size, dtype=np.intp)
+        self._children[0::2] = (self.right + offsets).ravel()
+        self._children[1::2] = (self.left + offsets).ravel()
+    
+    @classmethod
+    def load(cls, path=FOREST_PATH):
+        """Load a forest exported with export_forest."""
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+    
+    def leaf_values(self, X):
+        """
+        Return the leaf value reached in each tree by each row.
+        
+        Rows are processed in blocks; within a block every tree advances one
+        level per step, using preallocated buffers.
+        
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features)
+        
+        Returns:
+            np.ndarray: float32 array of shape (n_rows, n_trees)
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        out = np.empty((n_rows, self.n_trees), dtype=np.float32)
+        block = max(1, BLOCK_CELLS // self.n_trees)
+        shape = (min(block, n_rows), self.n_trees)
+        node = np.empty(shape, dtype=np.intp)
+        index = np.empty(shape, dtype=np.intp)
+        x = np.empty(shape, dtype=np.float32)
+        threshold = np.empty(shape, dtype=np.float32)
+        go_left = np.empty(shape, dtype=bool)
+        row_start = (np.arange(shape[0], dtype=np.intp) * n_features)[:, None]
+        
+        for start in range(0, n_rows, block):
+            rows = X[start:start + block]
+            m = len(rows)
+            nd, ix, xs, th, gl = node[:m], index[:m], x[:m], threshold[:m], go_left[:m]
+            has_missing = np.isnan(rows).any()
+            flat = rows.ravel()
+            nd[:] = self._roots
+            for _ in range(self.max_depth):
+                np.take(self._feature, nd, out=ix)
+                ix += row_start[:m]
+                np.take(flat, ix, out=xs)
+                np.take(self._threshold, nd, out=th)
+                np.less(xs, th, out=gl)
+                if has_missing:
+                    # NaN compares False, follow the default direction instead
+                    gl |= np.isnan(xs) & np.take(self._default_left, nd)
+                nd *= 2
+                nd += gl
+                np.take(self._children, nd, out=ix)
+                nd, ix = ix, nd
+            np.take(self._value, nd, out=out[start:start + m])
+        return out
+    
+    def predict(self, X):
+        """
+        Predict the target for every row of X.
+        
+        Trees are accumulated in float32 in booster order, like XGBoost.
+        
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features)
+        
+        Returns:
+            np.ndarray: float32 predictions
+        """
+        leaves = np.empty((len(X), self.n_trees + 1), dtype=np.float32)
+        leaves[:, 0] = self.base_score
+        leaves[:, 1:] = self.leaf_values(X)
+        # cumsum accumulates sequentially, unlike sum which adds pairwise
+        return np.cumsum(leaves, axis=1)[:, -1]
+    
+    def _point_and_spread(self, X, skip_trees):
+        leaves = np.empty((len(X), self.n_trees + 1), dtype=np.float32)
+        leaves[:, 0] = self.base_score
+        leaves[:, 1:] = self.leaf_values(X)
+        late = leaves[:, 1 + skip_trees:]
+        spread = np.sqrt(np.einsum("ij,ij->i", late, late, dtype=np.float64))
+        return np.cumsum(leaves, axis=1)[:, -1], spread
+    
+    def calibrated(self, coverage):
+        """Return whether intervals of this coverage were calibrated on held-out prices."""
+        return self.interval_scale is not None and self.interval_coverage == coverage
+    
+    def predict_interval(self, X, coverage=0.9, scale=None, skip_trees=INTERVAL_SKIP_TREES):
+        """
+        Predict the target with a per-row interval, from a single pass over the trees.
+        
+        The spread of a row is the L2 norm of the leaf values of the trees
+        after skip_trees, i.e. of the residual corrections the ensemble still
+        applies to it. It is treated as the expected absolute error (scaled
+        by scale) of a normal error, giving the half-width
+        z(coverage) * sqrt(pi / 2) * scale * spread.
+        
+        This is a heuristic: the share of prices actually inside the
+        interval is only close to coverage when calibrated(coverage).
+        
+        Args:
+            X (np.ndarray): Feature matrix of shape (n_rows, n_features)
+            coverage (float): Nominal probability that the price falls in the interval
+            scale (float): Calibration factor, see calibrate_interval_scale. By
+                default the stored one when calibrated(coverage), else 1.0
+            skip_trees (int): Leading trees left out of the spread
+        
+        Returns:
+            tuple: (predictions, lower, upper) float32 arrays; predictions are
+                identical to predict
+        """
+        if scale is None:
+            scale = self.interval_scale if self.calibrated(coverage) else 1.0
+        point, spread = self._point_and_spread(X, skip_trees)
+        half = _interval_factor(coverage) * scale * spread
+        # Prices are not negative, but the bound never exceeds the prediction
+        lower = np.minimum(np.maximum(point - half, 0), point).astype(np.float32)
+        return point, lower, (point + half).astype(np.float32)
+    
+    def calibrate_interval_scale(self, X, y, coverage=0.9, skip_trees=INTERVAL_SKIP_TREES):
+        """
+        Fit the scale for which predict_interval covers a share coverage of held-out prices.
+        
+        Split-conformal calibration: the scale is the coverage quantile of
+        the observed errors relative to the unscaled half-widths.
+        
+        Args:
+            X (np.ndarray): Held-out feature matrix
+            y (array-like): Observed prices of the same rows
+            coverage (float): Target coverage
+            skip_trees (int): Leading trees left out of the spread
+        
+        Returns:
+            float: The scale to pass to predict_interval
+        """
+        point, spread = self._point_and_spread(X, skip_trees)
+        ratio = np.abs(np.asarray(y, dtype=np.float64) - point) / (_interval_factor(coverage) * spread)
+        level = min(1.0, np.ceil((len(ratio) + 1) * coverage) / len(ratio))
+        return float(np.quantile(ratio, level))
+
+
+def _interval_factor(coverage):
+    if not 0 < coverage < 1:
+        raise ValueError(f"coverage must be between 0 and 1, got {coverage}")
+    # Imported here: statistics adds ~15 ms to the forest's cold start
+    from statistics import NormalDist
+    
+    # Half-width of a normal interval, in units of its expected absolute error
+    return NormalDist().inv_cdf(0.5 + coverage / 2) * np.sqrt(np.pi / 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the tree ensemble to a NumPy forest")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--model", default="best_car_price_model.pkl")
+    parser.add_argument("--output", default=FOREST_PATH)
+    parser.add_argument("--calibrate", nargs="+", metavar="LISTINGS",
+                        help="Held-out CSV or Parquet listings with a prix column, to calibrate the intervals")
+    parser.add_argument("--coverage", type=float, default=0.9, help="Interval coverage to calibrate for")
+    args = parser.parse_args()
+    
+    calibration = None
+    if args.calibrate:
+        from train import holdout_matrix
+        calibration = holdout_matrix(args.model, args.calibrate)
+    forest = export_forest(args.model, args.output, calibration, args.coverage)
+    print(f"Exported {forest.n_trees} trees (max depth {forest.max_depth}, "
+          f"{forest.max_nodes} nodes per tree) to {args.output}")
+    if calibration is not None:
+        X, y = calibration
+        _, lower, upper = forest.predict_interval(X, coverage=args.coverage)
+        inside = float(np.mean((lower <= y) & (y <= upper)))
+        print(f"    interval scale {forest.interval_scale:.3f} for {args.coverage:.0%} coverage "
+              f"({inside:.1%} of {len(y):,} held-out prices inside)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Optional instrumentation of the prediction path.
+
+When enabled, model.predict_price and the batch functions record per-stage
+timings (frame assembly, encoding, inference), row counts, unknown
+categories and errors. Caches and the model registry contribute their own
+counters when the metrics are rendered. Everything is exported in the
+Prometheus text format, to a file or through service.py.
+
+Disabled (the default), the hot path only tests one module-level flag.
+
+A sampling profiler can also be started at runtime: it periodically records
+the stacks of every thread and reports them in the collapsed format read by
+flame graph tools.
+
+Enable with enable(), or by setting CAR_PRICE_METRICS=1 before the first import.
+"""
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PREFIX = "car_price"
+
+# Upper bounds of the stage duration histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 2.5)
+
+enabled = os.environ.get("CAR_PRICE_METRICS", "") not in ("", "0")
+
+
+def enable():
+    """Start recording metrics on the prediction path."""
+    global enabled
+    enabled = True
+
+
+def disable():
+    """Stop recording metrics; the hot path goes back to a single flag test."""
+    global enabled
+    enabled = False
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    Thread-safe counters and stage histograms, rendered as Prometheus text.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = {}
+        self.gauges = {}
+        self.collectors = []
+    
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+    
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, stage, seconds):
+        """Record one duration of a stage."""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [[0] * (len(BUCKETS) + 1), 0.0]
+            histogram[0][bisect.bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+    
+    def register_collector(self, collect):
+        """
+        Add a function called at render time.
+        
+        Args:
+            collect (callable): Returns an iterable of (name, type, labels dict,
+                value), with type "counter" or "gauge"
+        """
+        self.collectors.append(collect)
+    
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+    
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        series = {}
+        with self._lock:
+            counters = list(self.counters.items())
+            histograms = {stage: (list(h[0]), h[1]) for stage, h in self.histograms.items()}
+        for (name, labels), value in counters:
+            series.setdefault((f"{name}_total", "counter"), []).append((labels, value))
+        for (name, labels), value in list(self.gauges.items()):
+            series.setdefault((name, "gauge"), []).append((labels, value))
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                name = f"{name}_total" if kind == "counter" else name
+                series.setdefault((name, kind), []).append((tuple(sorted(labels.items())), value))
+        
+        lines = []
+        for (name, kind), samples in sorted(series.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+        
+        lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+        for stage, (counts, total) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+    
+    def write(self, path):
+        """Write the metrics to a file atomically, e.g. for the node exporter textfile collector."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+# Shared metrics of the prediction path
+metrics = Metrics()
+
+
+class Stages:
+    """
+    Times consecutive stages of one call: each mark() closes the current stage.
+    
+    Only created when instrumentation is enabled.
+    """
+    
+    __slots__ = ("_last",)
+    
+    def __init__(self):
+        self._last = time.perf_counter()
+    
+    def mark(self, stage):
+        now = time.perf_counter()
+        metrics.observe(stage, now - self._last)
+        self._last = now
+
+
+def start_file_exporter(path, interval=15.0):
+    """
+    Rewrite the metrics file every interval seconds from a daemon thread.
+    
+    Returns:
+        threading.Event: Set it to stop the exporter
+    """
+    stop = threading.Event()
+    
+    def export():
+        while not stop.wait(interval):
+            metrics.write(path)
+    
+    threading.Thread(target=export, name="metrics-exporter", daemon=True).start()
+    return stop
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all other threads at a fixed interval.
+    
+    Args:
+        interval (float): Seconds between samples
+    """
+    
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self
+    
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+    
+    def stop(self):
+        """Stop sampling and return the collapsed stacks."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+    
+    def collapsed(self):
+        """Return 'frame;frame;frame count' lines, most sampled first."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+
+_profiler = None
+
+
+def start_profiler(interval=0.005):
+    """Start the shared sampling profiler (no-op if it is already running)."""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval).start()
+    return _profiler
+
+
+def stop_profiler(path=None):
+    """
+    Stop the shared sampling profiler.
+    
+    Args:
+        path (str): Optional file to write the collapsed stacks to
+    
+    Returns:
+        str: The collapsed stacks, or "" if the profiler was not running
+    """
+    global _profiler
+    if _profiler is None:
+        return ""
+    collapsed, _profiler = _profiler.stop(), None
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(collapsed)
+    return collapsed
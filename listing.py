@@ -0,0 +1,260 @@
+"""
+Compact, validated input records for high-volume callers.
+
+CarListing holds one car in __slots__ instead of a 12-key dict, and is
+validated when it is built. It can be used wherever an input dict is
+accepted (input["marque"] works), e.g. model.predict_price.
+
+CarListingBatch stores many cars by column: one small integer array of
+codes per categorical field, with its vocabulary, and one small integer
+array per numeric field (float32 when the batch is built without
+validation, since the values may not fit a narrow integer type). FeatureSchema.encode_listings encodes it by
+looking each vocabulary entry up once, without any per-row dict or
+DataFrame; model.predict_prices accepts it directly.
+
+Numeric fields are checked against the bounds of the app's widgets. Unlike
+the encoder, which reads a missing or non-numeric value as 0, validation
+rejects it.
+"""
+import numpy as np
+
+from features import NUMERIC_FEATURES, RAW_FIELDS
+
+CATEGORICAL_FIELDS = [field for field in RAW_FIELDS if field not in NUMERIC_FEATURES]
+
+# Inclusive integer bounds, as enforced by the widgets in app.py
+LIMITS = {
+    "annee_modele": (1990, 2024),
+    "kilometrage": (0, 500_000),
+    "nombre_de_portes": (3, 5),
+    "puissance_fiscale": (1, 20),
+    "premiere_main": (0, 1)
+}
+
+NUMERIC_DTYPES = {
+    "annee_modele": np.int16,
+    "kilometrage": np.int32,
+    "nombre_de_portes": np.int8,
+    "puissance_fiscale": np.int8,
+    "premiere_main": np.int8
+}
+
+
+def _to_number(value):
+    """Return a value as a float, NaN if it is missing or not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _check(field, value):
+    """Return a numeric field as an int, or raise ValueError if it is missing or out of bounds."""
+    low, high = LIMITS[field]
+    number = _to_number(value)
+    if not (number.is_integer() and low <= number <= high):
+        raise ValueError(f"{field} must be an integer between {low} and {high}, got {value!r}")
+    return int(number)
+
+
+def _validate(numeric):
+    """Raise ValueError if some values of the numeric arrays are missing (NaN) or out of bounds."""
+    errors = []
+    for field, values in numeric.items():
+        low, high = LIMITS[field]
+        missing = np.flatnonzero(np.isnan(values))
+        if len(missing):
+            errors.append(f"{field} is missing or not a number: "
+                          f"{len(missing)} row(s), first at row {missing[0]}")
+        bad = np.flatnonzero((values < low) | (values > high) | (values != np.floor(values)))
+        bad = bad[~np.isnan(values[bad])]
+        if len(bad):
+            errors.append(f"{field} must be an integer between {low} and {high}: "
+                          f"{len(bad)} row(s), first at row {bad[0]} ({values[bad[0]]:g})")
+    if errors:
+        raise ValueError("Invalid listings: " + "; ".join(errors))
+
+
+def _code_dtype(size):
+    """Smallest unsigned integer type able to hold codes 0..size-1."""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+class CarListing:
+    """
+    One car, validated on construction.
+    
+    Args:
+        marque, modele, boite_vitesses, type_de_carburant, origine,
+        etat_du_vehicule, localisation (str): Category values, as in the UI
+        annee_modele, kilometrage, nombre_de_portes, puissance_fiscale,
+        premiere_main (int): Numeric values, within LIMITS
+    
+    Raises:
+        ValueError: If a numeric field is missing, not a number or out of bounds
+    """
+    
+    __slots__ = tuple(RAW_FIELDS)
+    
+    def __init__(self, marque, modele, annee_modele, kilometrage, nombre_de_portes,
+                 puissance_fiscale, premiere_main, boite_vitesses, type_de_carburant,
+                 origine, etat_du_vehicule, localisation):
+        self.marque = marque
+        self.modele = modele
+        self.annee_modele = _check("annee_modele", annee_modele)
+        self.kilometrage = _check("kilometrage", kilometrage)
+        self.nombre_de_portes = _check("nombre_de_portes", nombre_de_portes)
+        self.puissance_fiscale = _check("puissance_fiscale", puissance_fiscale)
+        self.premiere_main = _check("premiere_main", premiere_main)
+        self.boite_vitesses = boite_vitesses
+        self.type_de_carburant = type_de_carburant
+        self.origine = origine
+        self.etat_du_vehicule = etat_du_vehicule
+        self.localisation = localisation
+    
+    @classmethod
+    def from_dict(cls, input_data):
+        """Build a listing from an input dict."""
+        return cls(**{field: input_data[field] for field in RAW_FIELDS})
+    
+    def __getitem__(self, field):
+        # Lets a listing stand in for an input dict
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+    
+    def get(self, field, default=None):
+        return getattr(self, field) if field in self.__slots__ else default
+    
+    def as_dict(self):
+        return {field: getattr(self, field) for field in RAW_FIELDS}
+    
+    def __eq__(self, other):
+        if not isinstance(other, CarListing):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in RAW_FIELDS)
+    
+    def __repr__(self):
+        return f"CarListing({', '.join(f'{field}={getattr(self, field)!r}' for field in RAW_FIELDS)})"
+
+
+class CarListingBatch:
+    """
+    Many cars stored by column.
+    
+    Args:
+        columns (dict): Field -> NumPy array; codes into categories for the
+            categorical fields, values for the numeric fields
+        categories (dict): Categorical field -> list of distinct values
+        validate (bool): Check the numeric fields against LIMITS
+    
+    Raises:
+        ValueError: If validate is set and some rows are missing a value or
+            are out of bounds
+    """
+    
+    def __init__(self, columns, categories, validate=True):
+        self.columns = columns
+        self.categories = categories
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        self._length = lengths.pop() if lengths else 0
+        if validate:
+            self.validate()
+    
+    @classmethod
+    def _build(cls, numeric, columns, categories, validate):
+        # Bounds are checked on the float values, before narrowing the types
+        if validate:
+            _validate(numeric)
+        for field, values in numeric.items():
+            if validate:
+                columns[field] = values.astype(NUMERIC_DTYPES[field])
+            else:
+                # Unchecked values would wrap around or be truncated in a
+                # narrow integer type: keep them as the encoder's float32,
+                # with missing values read as 0, as in the encoder
+                columns[field] = np.where(np.isnan(values), 0, values).astype(np.float32)
+        return cls(columns, categories, validate=False)
+    
+    @classmethod
+    def from_records(cls, records, validate=True):
+        """
+        Build a batch from input dicts or CarListings.
+        
+        Args:
+            records (list): Inputs in the predict_price format
+            validate (bool): Check the numeric fields against LIMITS
+        """
+        records = list(records)
+        columns, categories, numeric = {}, {}, {}
+        for field in CATEGORICAL_FIELDS:
+            vocabulary = {}
+            codes = [vocabulary.setdefault(record[field], len(vocabulary)) for record in records]
+            columns[field] = np.array(codes, dtype=_code_dtype(len(vocabulary)))
+            categories[field] = list(vocabulary)
+        for field in NUMERIC_FEATURES:
+            numeric[field] = np.fromiter((_to_number(record[field]) for record in records),
+                                         dtype=np.float64, count=len(records))
+        return cls._build(numeric, columns, categories, validate)
+    
+    @classmethod
+    def from_frame(cls, df, validate=True):
+        """
+        Build a batch from a DataFrame of raw inputs.
+        
+        Args:
+            df (pd.DataFrame): Inputs in the predict_price format
+            validate (bool): Check the numeric fields against LIMITS
+        """
+        import pandas as pd
+        
+        columns, categories, numeric = {}, {}, {}
+        for field in CATEGORICAL_FIELDS:
+            codes, uniques = pd.factorize(df[field], use_na_sentinel=False)
+            columns[field] = codes.astype(_code_dtype(len(uniques)))
+            categories[field] = list(uniques)
+        for field in NUMERIC_FEATURES:
+            # Missing and non-numeric values stay NaN, so validation rejects them
+            numeric[field] = pd.to_numeric(df[field], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+        return cls._build(numeric, columns, categories, validate)
+    
+    def validate(self):
+        """
+        Check the numeric fields against LIMITS.
+        
+        Raises:
+            ValueError: Listing, per field, how many rows are out of bounds
+        """
+        _validate({field: self.columns[field].astype(np.float64) for field in NUMERIC_FEATURES})
+    
+    def __len__(self):
+        return self._length
+    
+    def values(self, field):
+        """Return the values of one field, decoding categorical codes."""
+        if field in self.categories:
+            return np.asarray(self.categories[field], dtype=object)[self.columns[field]]
+        return self.columns[field]
+    
+    def __getitem__(self, i):
+        """Return row i as a CarListing."""
+        row = {}
+        for field in RAW_FIELDS:
+            value = self.columns[field][i]
+            row[field] = self.categories[field][value] if field in self.categories else value.item()
+        return CarListing(**row)
+    
+    def to_frame(self):
+        """Return the batch as a DataFrame of raw inputs."""
+        import pandas as pd
+        return pd.DataFrame({field: self.values(field) for field in RAW_FIELDS})
+    
+    @property
+    def nbytes(self):
+        """Bytes used by the column arrays (vocabularies excluded)."""
+        return sum(values.nbytes for values in self.columns.values())
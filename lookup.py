@@ -0,0 +1,250 @@
+"""
+String-interning index for brand, model and city lookups, with fuzzy fallback.
+
+Upstream data spells categories in many ways ("Mercedes-Benz", "mercedes",
+"Casa"), and every unrecognized spelling silently becomes a frequency of 0 or
+an unknown city. CategoryIndex interns the known categories to integer ids and
+resolves raw strings in stages:
+
+1. exact match, vectorized over the unique strings of the batch
+2. normalized key (case, accents and punctuation removed) or known alias
+3. prefix of a normalized key, the most frequent category when several
+   match ("casa" -> "Casablanca")
+4. character-trigram similarity ("peugot" -> "Peugeot")
+
+Only the distinct strings of a batch are resolved, and fuzzy results are
+memoized, so dirty columns of millions of rows resolve in seconds.
+"""
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+from features import encoder
+
+STAGES = ("exact", "normalized", "prefix", "fuzzy", "unresolved")
+
+# Minimum Dice similarity between trigram sets for a fuzzy match
+FUZZY_THRESHOLD = 0.6
+
+# Shortest normalized string accepted as a prefix
+MIN_PREFIX = 3
+
+# Common abbreviations that no string similarity can recover
+MARQUE_ALIASES = {
+    "vw": "Volkswagen",
+    "merc": "Mercedes-Benz",
+    "benz": "Mercedes-Benz",
+    "range rover": "Land Rover",
+    "chevy": "Chevrolet"
+}
+
+
+def normalize_key(value):
+    """
+    Normalize a category spelling: lowercase, no accents, alphanumerics only.
+    
+    Args:
+        value (str): Raw spelling
+    
+    Returns:
+        str: Normalized key, e.g. "Mercedes-Benz" -> "mercedes benz"
+    """
+    value = unicodedata.normalize("NFKD", str(value))
+    value = "".join(c for c in value if not unicodedata.combining(c)).lower()
+    return " ".join(re.findall(r"[a-z0-9]+", value))
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CategoryIndex:
+    """
+    Interned categories with exact, normalized, prefix and fuzzy lookups.
+    
+    Args:
+        categories (list[str]): Canonical spellings; their position is their id
+        frequencies (dict): Optional category -> frequency, used to break ties
+            in favour of the most common category
+        threshold (float): Minimum trigram similarity for a fuzzy match
+        aliases (dict): Optional alternative spelling -> canonical category
+    """
+    
+    def __init__(self, categories, frequencies=None, threshold=FUZZY_THRESHOLD, aliases=None):
+        import pandas as pd
+        
+        self.categories = np.array(list(categories), dtype=object)
+        self.threshold = threshold
+        self._index = pd.Index(self.categories)
+        frequencies = frequencies or {}
+        self._weight = np.array([frequencies.get(c, 0) for c in self.categories], dtype=float)
+        
+        # Normalized key -> id, keeping the most frequent category on collisions
+        self._normalized = {}
+        for i in np.argsort(-self._weight, kind="stable"):
+            self._normalized.setdefault(normalize_key(self.categories[i]), int(i))
+        self._keys = list(self._normalized)
+        self._key_ids = np.array(list(self._normalized.values()), dtype=np.int32)
+        for alias, category in (aliases or {}).items():
+            if category in self._index:
+                self._normalized.setdefault(normalize_key(alias), int(self._index.get_loc(category)))
+        
+        # Trigram -> ids of the normalized keys containing it
+        postings = {}
+        self._key_sizes = np.zeros(len(self._keys), dtype=np.int32)
+        for k, key in enumerate(self._keys):
+            grams = _trigrams(key)
+            self._key_sizes[k] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(k)
+        self._postings = {gram: np.array(ks, dtype=np.int32) for gram, ks in postings.items()}
+        self._memo = {}
+    
+    def __len__(self):
+        return len(self.categories)
+    
+    def _resolve_dirty(self, value):
+        """Resolve one string that has no exact match: (id, stage)."""
+        if value in self._memo:
+            return self._memo[value]
+        key = normalize_key(value)
+        result = (-1, "unresolved")
+        if key in self._normalized:
+            result = (self._normalized[key], "normalized")
+        elif len(key) >= MIN_PREFIX:
+            prefixed = [k for k, known in enumerate(self._keys) if known.startswith(key)]
+            if prefixed:
+                ids = self._key_ids[prefixed]
+                result = (int(ids[np.argmax(self._weight[ids])]), "prefix")
+            else:
+                grams = [self._postings[g] for g in _trigrams(key) if g in self._postings]
+                if grams:
+                    common = np.bincount(np.concatenate(grams), minlength=len(self._keys))
+                    dice = 2 * common / (len(_trigrams(key)) + self._key_sizes)
+                    best = int(np.argmax(dice))
+                    if dice[best] >= self.threshold:
+                        result = (int(self._key_ids[best]), "fuzzy")
+        self._memo[value] = result
+        return result
+    
+    def resolve(self, values):
+        """
+        Map raw strings to category ids.
+        
+        Args:
+            values (array-like): Raw spellings (missing values stay unresolved)
+        
+        Returns:
+            tuple: (ids, counts) where ids is an int32 array (-1 when
+                unresolved) and counts maps each stage to a number of rows
+        """
+        import pandas as pd
+        
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        unique_ids = self._index.get_indexer(uniques).astype(np.int32)
+        unique_stages = np.where(unique_ids >= 0, 0, STAGES.index("unresolved")).astype(np.int8)
+        for u in np.flatnonzero(unique_ids < 0):
+            unique_ids[u], stage = self._resolve_dirty(uniques[u])
+            unique_stages[u] = STAGES.index(stage)
+        
+        # Missing values have code -1, which picks the trailing unresolved sentinel
+        ids = np.append(unique_ids, -1)[codes]
+        stages = np.append(unique_stages, STAGES.index("unresolved"))[codes]
+        counts = np.bincount(stages, minlength=len(STAGES))
+        return ids, dict(zip(STAGES, counts.tolist()))
+    
+    def canonical(self, values):
+        """
+        Return the canonical spelling of each value, keeping unresolved values as-is.
+        
+        Returns:
+            tuple: (np.ndarray of objects, stage counts)
+        """
+        values = np.asarray(values, dtype=object)
+        ids, counts = self.resolve(values)
+        return np.where(ids >= 0, self.categories[np.maximum(ids, 0)], values), counts
+
+
+class ListingResolver:
+    """
+    Cleans the brand, model and city columns of listing batches.
+    
+    Models are matched against the resolved brand's own models first, then
+    against every known model.
+    
+    Args:
+        threshold (float): Minimum trigram similarity for a fuzzy match
+    """
+    
+    def __init__(self, threshold=FUZZY_THRESHOLD):
+        marque_freq = encoder.marque_freq
+        modele_freq = encoder.modele_freq
+        self.brand_models = encoder.artifact("brand_model_dict")
+        self.marques = CategoryIndex(
+            sorted(set(marque_freq) | set(self.brand_models)), marque_freq, threshold, MARQUE_ALIASES)
+        self.modeles = CategoryIndex(sorted(modele_freq), modele_freq, threshold)
+        self.localisations = CategoryIndex(list(encoder.localisation_mapping), threshold=threshold)
+        self._modele_freq = modele_freq
+        self._threshold = threshold
+        self._brand_indexes = {}
+        self.totals = {field: Counter() for field in ("marque", "modele", "localisation")}
+    
+    def _brand_index(self, brand):
+        if brand not in self._brand_indexes:
+            models = self.brand_models.get(brand, [])
+            self._brand_indexes[brand] = CategoryIndex(models, self._modele_freq, self._threshold)
+        return self._brand_indexes[brand]
+    
+    def clean(self, df):
+        """
+        Return a copy of df with canonical marque, modele and localisation spellings.
+        
+        Unresolved values are left untouched, so they are encoded exactly as
+        before (frequency 0, unknown city).
+        
+        Args:
+            df (pd.DataFrame): Raw inputs, one row per car
+        
+        Returns:
+            tuple: (cleaned DataFrame, {field: stage counts} for this batch)
+        """
+        df = df.copy()
+        report = {}
+        
+        df["marque"], report["marque"] = self.marques.canonical(df["marque"].to_numpy())
+        
+        # Models: within the brand first, then across all models
+        # Copies: under copy-on-write, to_numpy may return a read-only view
+        modeles = df["modele"].to_numpy(dtype=object, copy=True)
+        counts = Counter()
+        for brand, rows in df.groupby("marque", sort=False, dropna=False).indices.items():
+            ids, brand_counts = self._brand_index(brand).resolve(modeles[rows])
+            resolved = ids >= 0
+            modeles[rows[resolved]] = self._brand_index(brand).categories[ids[resolved]]
+            rest = rows[~resolved]
+            brand_counts["unresolved"] = 0
+            counts.update(brand_counts)
+            if len(rest):
+                modeles[rest], rest_counts = self.modeles.canonical(modeles[rest])
+                counts.update(rest_counts)
+        df["modele"] = modeles
+        report["modele"] = {stage: counts.get(stage, 0) for stage in STAGES}
+        
+        # Numeric city codes are already encoded, only resolve names
+        localisation = df["localisation"].to_numpy(dtype=object, copy=True)
+        names = np.array([isinstance(v, str) and not v.strip().lstrip("-").isdigit()
+                          for v in localisation], dtype=bool)
+        localisation[names], report["localisation"] = self.localisations.canonical(localisation[names])
+        df["localisation"] = localisation
+        
+        for field, field_counts in report.items():
+            self.totals[field].update(field_counts)
+        return df, report
+
+
+def format_report(report):
+    """Format per-field stage counts as one line, e.g. for a progress display."""
+    return ", ".join(f"{field}: {counts['unresolved']:,} unresolved" for field, counts in report.items())
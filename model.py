@@ -1,155 +1,341 @@
-import joblib
-import pandas as pd
+"""
+Price prediction for the Streamlit app and batch callers.
+
+Importing this module is cheap: the model pickle and the encoders are loaded
+lazily, on first use, behind a thread-safe accessor. Call warmup() at
+startup to load everything up front and fail fast if the model and the
+encoder disagree.
+
+Prediction intervals are computed by the NumPy forest (forest.py) from the
+per-tree outputs of the same pass that produces the price.
+
+With enable_registry(), predictions are routed between the versions of a
+watched models directory (see registry.py) instead of the single pickle.
+
+With instrumentation enabled (see instrumentation.py), every call records
+its stage timings, row counts and unknown categories.
+"""
+import threading
+import time
+
 import numpy as np
 
-# Load the model
-model = joblib.load("best_car_price_model.pkl")
+import instrumentation
+from features import ETAT_COLUMNS, encoder
+from instrumentation import metrics
+from listing import CarListingBatch
+from registry import MODELS_DIR, ModelRegistry, ModelVersion
+
+MODEL_PATH = "best_car_price_model.pkl"
+
+# Default interval coverage. It is only the actual coverage when the forest
+# was calibrated for it (python forest.py export --calibrate), else nominal
+INTERVAL_COVERAGE = 0.9
+
+_lock = threading.Lock()
+_default = None
+_registry = None
+
+
+def _default_version():
+    global _default
+    if _default is None:
+        with _lock:
+            if _default is None:
+                import joblib
+                start = time.perf_counter()
+                fitted = joblib.load(MODEL_PATH)
+                encoder.verify_model(MODEL_PATH)
+                # Compiles the model's own column layout; fails here if the
+                # pickle's features and the encoder disagree
+                _default = ModelVersion("default", MODEL_PATH, fitted)
+                metrics.set("model_load_seconds", time.perf_counter() - start, version="default")
+    return _default
+
 
-def predict_price(input_data):
+def current_version():
     """
-    Transform raw input data from the UI into the format expected by the model,
-    then predict the car price.
+    Return the ModelVersion serving the next call.
     
-    Args:
-        input_data (dict): User input from the Streamlit interface
-        
-    Returns:
-        float: Predicted price in MAD
+    With a registry, each call is routed to the active or the candidate
+    version; callers use the returned version for the whole call.
     """
-    # Create a DataFrame with a single row for the input data
-    df = pd.DataFrame([input_data])
-    
-    # Extract the necessary features for prediction
-    numeric_features = [
-        "annee_modele", 
-        "kilometrage", 
-        "nombre_de_portes", 
-        "puissance_fiscale", 
-        "premiere_main"
-    ]
-    
-    # Start building the feature set for prediction
-    X = pd.DataFrame()
-    
-    # Add numeric features
-    for feature in numeric_features:
-        X[feature] = df[feature]
-    
-    # Calculate frequency-based features (if needed)
-    # Load frequency mappings
-    marque_freq = joblib.load("marque_freq.pkl")
-    modele_freq = joblib.load("modele_freq.pkl")
-    
-    X["marque_freq"] = df["marque"].map(marque_freq).fillna(0)
-    X["modele_freq"] = df["modele"].map(modele_freq).fillna(0)
-    
-    # Boite vitesses - USING ONLY MANUAL FLAG PER ERROR MESSAGE
-    X["boite_vitesses_Manuelle"] = df["boite_vitesses"].iloc[0] == "Manuelle"
-    
-    # Type de carburant - Handle all types including Diesel
-    # Map Diesel to either default or nearest appropriate value since model doesn't support it
-    carburant = df["type_de_carburant"].iloc[0]
+    if _registry is not None:
+        version = _registry.route()
+        if version is not None:
+            return version
+    return _default_version()
+
+
+def enable_registry(models_dir=MODELS_DIR, candidate_share=0.0, poll_interval=5.0):
+    """
+    Serve predictions from a watched models directory, with hot reload and A/B routing.
     
-    # Initialize all to False
-    X["type_carburant_Electrique"] = False
-    X["type_carburant_Essence"] = False
-    X["type_carburant_Hybride"] = False
-    X["type_carburant_LPG"] = False
+    Every version must use the same feature columns as MODEL_PATH, which
+    stays in use until the directory holds a valid model.
     
-    # Set the appropriate one to True
-    if carburant == "Diesel":  
-        # Map Diesel to Essence as a fallback since model doesn't have Diesel
-        X["type_carburant_Essence"] = True
-    elif carburant == "Electrique":
-        X["type_carburant_Electrique"] = True
-    elif carburant == "Essence":
-        X["type_carburant_Essence"] = True
-    elif carburant == "Hybride":
-        X["type_carburant_Hybride"] = True
-    elif carburant == "LPG":
-        X["type_carburant_LPG"] = True
+    Args:
+        models_dir (str): Directory of <version>/ artifact directories and
+            <version>.pkl files
+        candidate_share (float): Share of traffic sent to the newest version
+        poll_interval (float): Seconds between directory scans
     
-    # Origine - Handle all types including Dédouanée
-    origine = df["origine"].iloc[0]
+    Returns:
+        ModelRegistry: The started registry
+    """
+    global _registry
+    # Loaded before taking _lock, which _default_version acquires itself
+    expected_columns = _default_version().schema.feature_names
+    with _lock:
+        if _registry is None:
+            _registry = ModelRegistry(models_dir, expected_columns, candidate_share, poll_interval).start()
+    return _registry
+
+
+def get_registry():
+    """Return the model registry, or None when it is not enabled."""
+    return _registry
+
+
+def get_model():
+    """Return the fitted model, loading it on first use."""
+    return current_version().model
+
+
+def get_schema():
+    """Return the FeatureSchema compiled from the model, loading it on first use."""
+    return current_version().schema
+
+
+def get_forest():
+    """Return the NumPy forest of the model, loading it on first use."""
+    return current_version().forest()
+
+
+def predict_interval_matrix(X, coverage=INTERVAL_COVERAGE):
+    """
+    Predict prices with lower and upper bounds for an encoded feature matrix.
     
-    # Initialize all to False
-    X["origine_Importée neuve"] = False
-    X["origine_Pas encore dédouanée"] = False
-    X["origine_WW au Maroc"] = False
+    The coverage is nominal unless the forest was calibrated for it.
     
-    # Set the appropriate one to True
-    if origine == "Importée neuve":
-        X["origine_Importée neuve"] = True
-    elif origine == "Pas encore dédouanée":
-        X["origine_Pas encore dédouanée"] = True
-    elif origine == "WW au Maroc":
-        X["origine_WW au Maroc"] = True
-    elif origine == "Dédouanée":
-        # Map Dédouanée to WW au Maroc as closest equivalent
-        X["origine_WW au Maroc"] = True
+    Returns:
+        tuple: (prices, lower, upper) float32 arrays; prices are identical
+            to predict_matrix
+    """
+    return get_forest().predict_interval(X, coverage=coverage)
+
+
+def __getattr__(name):
+    # Backwards-compatible lazy module attributes
+    if name == "model":
+        return get_model()
+    if name == "schema":
+        return get_schema()
+    if name == "EXPECTED_COLUMNS":
+        return get_schema().feature_names
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def predict_matrix(X):
+    """Run the model on an encoded float32 feature matrix."""
+    return current_version().predict_matrix(X)
+
+
+def warmup():
+    """Load the model and the encoding lookup tables now instead of on the first prediction."""
+    get_model()
+    encoder.marque_freq
+    encoder.modele_freq
+    encoder.localisation_mapping
+
+
+def predict_price(input_data, return_interval=False, coverage=INTERVAL_COVERAGE, version=None):
+    """
+    Transform raw input data from the UI into the format expected by the model,
+    then predict the car price.
     
-    # Etat du vehicule
-    etat_cols = [
-        "etat_Correct",
-        "etat_Endommagé",
-        "etat_Excellent",
-        "etat_Neuf",
-        "etat_Pour Pièces",
-        "etat_Très bon"
-    ]
+    The input is written straight into a reused NumPy row by the compiled
+    feature schema, without building any DataFrame.
     
-    # Initialize all to False
-    for col in etat_cols:
-        X[col] = False
-        
-    # Set the appropriate one to True
-    etat = df["etat_du_vehicule"].iloc[0]
-    etat_mapped = f"etat_{etat}"
-    if etat_mapped in etat_cols:
-        X[etat_mapped] = True
-    else:
-        # Default to "Correct" if not found
-        X["etat_Correct"] = True
+    Args:
+        input_data (dict): User input from the Streamlit interface
+        return_interval (bool): Also return the bounds of a price interval
+        coverage (float): Nominal coverage of the interval (calibrated only
+            when forest.Forest.calibrated(coverage))
+        version (ModelVersion): Version to score with, e.g. the one a cached
+            price is keyed on (routed by default)
     
-    # Handle localisation as integer
+    Returns:
+        float: Predicted price in MAD, or (price, lower, upper) with return_interval
+    """
+    if instrumentation.enabled:
+        return _predict_price_instrumented(input_data, return_interval, coverage, version)
+    version = version or current_version()
+    X = version.schema.encode_row(input_data)
+    if return_interval:
+        price, lower, upper = version.forest().predict_interval(X, coverage=coverage)
+        return price[0], lower[0], upper[0]
+    return version.predict_matrix(X)[0]
+
+
+def _predict_price_instrumented(input_data, return_interval, coverage, version):
+    """predict_price, recording stage timings, unknown categories and errors."""
+    stages = instrumentation.Stages()
     try:
-        X["localisation"] = pd.to_numeric(df["localisation"])
-    except:
-        try:
-            loc_mapping = joblib.load("localisation_mapping.pkl")
-            X["localisation"] = df["localisation"].map(loc_mapping).astype(int)
-        except:
-            localisation_list = joblib.load("localisation_list.pkl")
-            loc_mapping = {loc: i for i, loc in enumerate(localisation_list)}
-            X["localisation"] = df["localisation"].map(loc_mapping).astype(int)
-    
-    # Get the exact columns needed by the model from the error message
-    expected_columns = [
-        'annee_modele', 'kilometrage', 'nombre_de_portes', 'premiere_main', 
-        'puissance_fiscale', 'localisation', 'modele_freq', 'marque_freq',
-        'boite_vitesses_Manuelle', 'type_carburant_Electrique', 
-        'type_carburant_Essence', 'type_carburant_Hybride', 'type_carburant_LPG',
-        'origine_Importée neuve', 'origine_Pas encore dédouanée', 'origine_WW au Maroc',
-        'etat_Correct', 'etat_Endommagé', 'etat_Excellent', 'etat_Neuf', 
-        'etat_Pour Pièces', 'etat_Très bon'
-    ]
+        version = version or current_version()
+        X = version.schema.encode_row(input_data)
+        stages.mark("encode")
+        _record_unknown_row(version.schema, X[0], input_data)
+        if return_interval:
+            price, lower, upper = version.forest().predict_interval(X, coverage=coverage)
+            stages.mark("interval")
+            result = price[0], lower[0], upper[0]
+        else:
+            result = version.predict_matrix(X)[0]
+            stages.mark("inference")
+    except Exception:
+        metrics.inc("errors", path="single")
+        raise
+    metrics.inc("predictions", path="single")
+    metrics.inc("rows", path="single")
+    return result
+
+
+def _record_unknown_row(schema, row, input_data):
+    """Single-row _record_unknown, on scalars."""
+    index = schema.index
+    if row[index["marque_freq"]] == 0:
+        metrics.inc("unknown_category", field="marque")
+    if row[index["modele_freq"]] == 0:
+        metrics.inc("unknown_category", field="modele")
+    if input_data.get("etat_du_vehicule") not in ETAT_COLUMNS:
+        metrics.inc("unknown_category", field="etat_du_vehicule")
+
+
+def _record_unknown(schema, X, unknown_etats):
+    """Count inputs encoded with a fallback: zero frequencies, missing cities, default condition."""
+    index = schema.index
+    unknown = {
+        "marque": int((X[:, index["marque_freq"]] == 0).sum()),
+        "modele": int((X[:, index["modele_freq"]] == 0).sum()),
+        "localisation": int(np.isnan(X[:, index["localisation"]]).sum()),
+        "etat_du_vehicule": unknown_etats
+    }
+    for field, count in unknown.items():
+        if count:
+            metrics.inc("unknown_category", count, field=field)
+
+
+def _as_frame(records):
+    import pandas as pd
+    if isinstance(records, pd.DataFrame):
+        return records
+    return pd.DataFrame.from_records(list(records))
+
+
+def _encode(schema, records, unknown_localisation):
+    """Encode a CarListingBatch directly, anything else through a DataFrame."""
+    if isinstance(records, CarListingBatch):
+        return schema.encode_listings(records, unknown_localisation=unknown_localisation)
+    return schema.encode_frame(records, unknown_localisation=unknown_localisation)
+
+
+def _count_unknown_etats(records):
+    if isinstance(records, CarListingBatch):
+        vocabulary = records.categories["etat_du_vehicule"]
+        unknown = [i for i, etat in enumerate(vocabulary) if etat not in ETAT_COLUMNS]
+        return int(np.isin(records.columns["etat_du_vehicule"], unknown).sum())
+    return int((~records["etat_du_vehicule"].isin(list(ETAT_COLUMNS))).sum())
+
+
+def encode_batch(records, unknown_localisation="raise", version=None):
+    """
+    Encode many raw inputs at once into the feature matrix expected by the model.
     
-    # Create a DataFrame with all expected columns initialized to 0
-    final_X = pd.DataFrame(0, index=[0], columns=expected_columns)
+    Applies exactly the same rules as predict_price, but on whole columns.
     
-    # Fill in the values we have
-    for col in X.columns:
-        if col in expected_columns:
-            final_X[col] = X[col]
+    Args:
+        records (list[dict] | pd.DataFrame | CarListingBatch): Raw inputs, one per car
+        unknown_localisation (str): "raise" (like predict_price) or "missing"
+            to score unknown cities as a missing value
+        version (ModelVersion): Model whose column layout to encode for
+            (routed per call if None)
     
-    # Make sure all columns are of numeric type
-    for col in final_X.columns:
-        if final_X[col].dtype == 'object':
-            final_X[col] = pd.to_numeric(final_X[col], errors='coerce').fillna(0)
-        elif final_X[col].dtype == 'bool':
-            final_X[col] = final_X[col].astype(int)
+    Returns:
+        np.ndarray: float32 matrix of shape (n_rows, len(EXPECTED_COLUMNS))
+    """
+    if not isinstance(records, CarListingBatch):
+        records = _as_frame(records)
+    version = version or current_version()
+    return _encode(version.schema, records, unknown_localisation)
+
+
+def predict_prices(records, unknown_localisation="raise", return_interval=False,
+                   coverage=INTERVAL_COVERAGE, version=None):
+    """
+    Predict the price of many cars with a single model call.
     
-    # Make prediction
-    predicted_price = model.predict(final_X)[0]
+    Args:
+        records (list[dict] | pd.DataFrame | CarListingBatch): Raw inputs in
+            the same format as predict_price, one per car; a CarListingBatch
+            is encoded without building a DataFrame
+        unknown_localisation (str): "raise" (like predict_price) or "missing"
+            to score unknown cities as a missing value
+        return_interval (bool): Also return the bounds of a price interval
+        coverage (float): Nominal coverage of the interval (calibrated only
+            when forest.Forest.calibrated(coverage))
+        version (ModelVersion): Version to score with (routed by default)
     
-    return predicted_price
\ No newline at end of file
+    Returns:
+        np.ndarray: Predicted prices in MAD, in input order, or
+            (prices, lower, upper) with return_interval
+    """
+    stages = instrumentation.Stages() if instrumentation.enabled else None
+    try:
+        if not isinstance(records, CarListingBatch):
+            records = _as_frame(records)
+        if stages:
+            stages.mark("frame")
+        version = version or current_version()
+        X = _encode(version.schema, records, unknown_localisation)
+        if stages:
+            stages.mark("encode_batch")
+        if len(X) == 0:
+            empty = np.empty(0, dtype=np.float32)
+            return (empty, empty, empty) if return_interval else empty
+        if return_interval:
+            result = version.forest().predict_interval(X, coverage=coverage)
+        else:
+            result = version.predict_matrix(X)
+        if stages:
+            stages.mark("interval_batch" if return_interval else "inference_batch")
+            _record_unknown(version.schema, X, _count_unknown_etats(records))
+            metrics.inc("predictions", path="batch")
+            metrics.inc("rows", len(X), path="batch")
+        return result
+    except Exception:
+        if stages:
+            metrics.inc("errors", path="batch")
+        raise
+
+
+def _collect():
+    """Encoder and model registry counters, exported with the metrics."""
+    artifact_stats = encoder.stats()
+    yield "artifact_cache_hits", "counter", {}, artifact_stats["hits"]
+    yield "artifact_cache_reloads", "counter", {}, artifact_stats["reloads"]
+    yield "artifact_bundle_errors", "counter", {}, artifact_stats["bundle_errors"]
+    if _registry is not None:
+        stats = _registry.stats()
+        yield "model_swaps", "counter", {}, stats["swaps"]
+        for version, version_stats in stats["versions"].items():
+            role = "active" if version == stats["active"] else "candidate" if version == stats["candidate"] else "idle"
+            yield "model_version_rows", "counter", {"version": version, "role": role}, version_stats["rows"]
+            yield "model_version_errors", "counter", {"version": version, "role": role}, version_stats["errors"]
+            if version_stats["mean_price"] is not None:
+                yield "model_version_mean_price", "gauge", {"version": version, "role": role}, version_stats["mean_price"]
+            if version_stats["drift"] is not None:
+                yield "model_version_drift", "gauge", {"version": version, "role": role}, version_stats["drift"]
+
+
+metrics.register_collector(_collect)
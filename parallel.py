@@ -0,0 +1,115 @@
+"""
+Multi-core batch scoring.
+
+The input is split into shards that are encoded and scored in a pool of
+worker processes (or threads). Each worker loads the model and encoders once,
+when it starts, and results are returned in input order. Rows are scored
+independently, so the output is identical to model.predict_prices.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import model
+
+
+def _init_worker(nthread):
+    """Load the model and encoders once per worker process."""
+    model.warmup()
+    if nthread and hasattr(model.get_model(), "get_booster"):
+        # One booster thread per process, the pool provides the parallelism
+        model.get_model().get_booster().set_param({"nthread": nthread})
+
+
+def _score_shard(args):
+    shard, unknown_localisation = args
+    return model.predict_prices(shard, unknown_localisation=unknown_localisation)
+
+
+class ParallelScorer:
+    """
+    Pool of workers scoring shards of a batch with model.predict_prices.
+    
+    Use it as a context manager to keep the pool (and the models loaded in
+    its workers) alive across several calls.
+    
+    Args:
+        workers (int): Number of workers (all cores by default)
+        backend (str): "process", or "thread" when the booster releases the
+            GIL during prediction (XGBoost does)
+        shard_size (int): Rows per task (by default the batch is split
+            evenly, four shards per worker)
+        nthread (int): Booster threads per worker process (process backend only)
+    """
+    
+    def __init__(self, workers=None, backend="process", shard_size=None, nthread=1):
+        if backend not in ("process", "thread"):
+            raise ValueError(f"Unknown backend {backend!r}, use 'process' or 'thread'")
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = backend
+        self.shard_size = shard_size
+        if backend == "process":
+            # spawn avoids forking a parent whose booster already started OpenMP threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(nthread,)
+            )
+        else:
+            model.warmup()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+    
+    def _shards(self, df):
+        size = self.shard_size or max(1, -(-len(df) // (self.workers * 4)))
+        for start in range(0, len(df), size):
+            yield df.iloc[start:start + size]
+    
+    def score(self, records, unknown_localisation="raise"):
+        """
+        Predict the price of every car, in input order.
+        
+        Args:
+            records (list[dict] | pd.DataFrame): Raw inputs, one per car
+            unknown_localisation (str): "raise" or "missing", see model.predict_prices
+        
+        Returns:
+            np.ndarray: Predicted prices in MAD
+        """
+        df = records if isinstance(records, pd.DataFrame) else pd.DataFrame.from_records(list(records))
+        if len(df) == 0:
+            return np.empty(0, dtype=np.float32)
+        tasks = ((shard, unknown_localisation) for shard in self._shards(df))
+        # map() yields results in submission order
+        return np.concatenate(list(self._pool.map(_score_shard, tasks)))
+    
+    def close(self):
+        self._pool.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def score_parallel(records, workers=None, backend="process", shard_size=None,
+                   unknown_localisation="raise"):
+    """
+    Score a batch once with a temporary pool, see ParallelScorer.
+    
+    Args:
+        records (list[dict] | pd.DataFrame): Raw inputs, one per car
+        workers (int): Number of workers (all cores by default)
+        backend (str): "process" or "thread"
+        shard_size (int): Rows per task
+        unknown_localisation (str): "raise" or "missing"
+    
+    Returns:
+        np.ndarray: Predicted prices in MAD, in input order
+    """
+    with ParallelScorer(workers, backend, shard_size) as scorer:
+        return scorer.score(records, unknown_localisation=unknown_localisation)
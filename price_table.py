@@ -0,0 +1,411 @@
+"""
+Precomputed price table for the most common cars, with model fallback.
+
+Most queries fall into a small space: the most frequent brand/model pairs,
+recent model years, mileages on 5000 km steps and the usual conditions. An
+offline job scores that whole grid with the current model, once per
+"context" (doors, fiscal power, first owner, transmission, fuel, origin and
+city, by default the app's initial values), and stores it as one float32
+array:
+
+    magic (8 bytes) | header length (uint64) | JSON header | aligned prices
+
+The file is memory-mapped read-only. A query on the grid is answered with
+a few dict lookups and an array index; any other query goes to the live
+model. The header records the SHA-256 of the model and of the artifact
+bundle's lookup tables the prices were computed with: a query routed to
+another model, or scored with other frequency tables (e.g. after an
+encoder-only update of artifacts.bundle), is not answered from the table.
+
+Usage:
+    python price_table.py build [price_table.bin] [--top-models 100] [--queries log.csv --contexts 8]
+    python price_table.py info [price_table.bin] [--queries log.csv]
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+import model
+from features import encoder, to_float
+from instrumentation import metrics
+
+TABLE_PATH = "price_table.bin"
+MAGIC = b"CARPTBL\x00"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+
+# Grid axes
+YEARS = np.arange(2005, 2025)
+KILOMETRAGE_STEP = 5000
+KILOMETRAGES = np.arange(0, 500_001, KILOMETRAGE_STEP)
+ETATS = ["Correct", "Très bon", "Excellent", "Neuf"]
+
+# Fields fixed within one context
+CONTEXT_FIELDS = [
+    "nombre_de_portes",
+    "puissance_fiscale",
+    "premiere_main",
+    "boite_vitesses",
+    "type_de_carburant",
+    "origine",
+    "localisation"
+]
+
+
+def default_context():
+    """Return the context of the app's initial inputs."""
+    return {
+        "nombre_de_portes": 3,
+        "puissance_fiscale": 6,
+        "premiere_main": 0,
+        "boite_vitesses": encoder.artifact("boite_list")[0],
+        "type_de_carburant": "Essence",
+        "origine": "Dédouanée",
+        "localisation": encoder.artifact("localisation_list")[0]
+    }
+
+
+def _context_key(input_data):
+    """Key of a context, equal for two inputs exactly when they encode the same way."""
+    return (
+        to_float(input_data["nombre_de_portes"]),
+        to_float(input_data["puissance_fiscale"]),
+        to_float(input_data["premiere_main"]),
+        input_data["boite_vitesses"] == "Manuelle",
+        input_data["type_de_carburant"],
+        input_data["origine"],
+        input_data["localisation"]
+    )
+
+
+def top_pairs(n, encoder=encoder):
+    """Return the n (brand, model) pairs with the highest model frequency."""
+    modele_freq = encoder.modele_freq
+    pairs = [
+        (marque, modele)
+        for marque, modeles in encoder.artifact("brand_model_dict").items()
+        for modele in modeles
+    ]
+    pairs.sort(key=lambda pair: -modele_freq.get(pair[1], 0))
+    return pairs[:n]
+
+
+def top_contexts(queries, n):
+    """
+    Return the n most frequent contexts of a query log.
+    
+    Args:
+        queries (pd.DataFrame): Past inputs, in the predict_price format
+        n (int): Number of contexts
+    
+    Returns:
+        list[dict]: Contexts, most frequent first
+    """
+    counts = Counter()
+    first = {}
+    for record in queries[CONTEXT_FIELDS].to_dict("records"):
+        key = _context_key(record)
+        counts[key] += 1
+        first.setdefault(key, record)
+    return [first[key] for key, _ in counts.most_common(n)]
+
+
+def _to_json(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _artifacts_sha256(encoder):
+    """Return the data checksum of the encoder's bundle, or None when it only uses pickles."""
+    bundle = encoder.bundle()
+    return bundle.data_sha256 if bundle is not None else None
+
+
+def build_table(output_path=TABLE_PATH, top_models=100, contexts=None):
+    """
+    Score the whole grid with the current model and write the table file.
+    
+    Args:
+        output_path (str): Table file to write
+        top_models (int): Number of most frequent brand/model pairs
+        contexts (list[dict]): Values of CONTEXT_FIELDS to tabulate
+            (the app's initial values if None)
+    
+    Returns:
+        dict: The table header
+    """
+    start = time.perf_counter()
+    version = model.current_version()
+    schema = version.schema
+    pairs = top_pairs(top_models, encoder=version.encoder)
+    contexts = [{field: _to_json(context[field]) for field in CONTEXT_FIELDS}
+                for context in (contexts or [default_context()])]
+    shape = [len(contexts), len(pairs), len(YEARS), len(KILOMETRAGES), len(ETATS)]
+    
+    header = {
+        "format_version": FORMAT_VERSION,
+        "model_sha256": version.sha256,
+        "artifacts_sha256": _artifacts_sha256(version.encoder),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "contexts": contexts,
+        "pairs": pairs,
+        "years": [int(YEARS[0]), len(YEARS)],
+        "kilometrages": [int(KILOMETRAGES[0]), KILOMETRAGE_STEP, len(KILOMETRAGES)],
+        "etats": ETATS,
+        "shape": shape,
+        "dtype": "<f4"
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix = len(MAGIC) + 8 + len(header_bytes)
+    padding = -prefix % ALIGNMENT
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes) + padding))
+        f.write(header_bytes + b" " * padding)
+    prices = np.memmap(tmp_path, dtype="<f4", mode="r+", offset=prefix + padding, shape=tuple(shape))
+    
+    # One block of rows per (context, pair): year x mileage x condition,
+    # broadcast from a single encoded row as in depreciation.price_surface
+    n_years, n_km, n_etats = shape[2:]
+    block_years = np.repeat(YEARS, n_km * n_etats)
+    block_km = np.tile(np.repeat(KILOMETRAGES, n_etats), n_years)
+    etat_columns = sorted(set(schema.etat_index.values()) | {schema.default_etat_index})
+    block_etat = np.tile([schema.etat_index.get(etat, schema.default_etat_index) for etat in ETATS],
+                         n_years * n_km)
+    rows = np.arange(n_years * n_km * n_etats)
+    for c, context in enumerate(contexts):
+        for p, (marque, modele) in enumerate(pairs):
+            input_data = dict(context, marque=marque, modele=modele, annee_modele=int(YEARS[0]),
+                              kilometrage=0, etat_du_vehicule=ETATS[0])
+            base = schema.encode_row(input_data, out=np.empty((1, schema.n_features), dtype=np.float32))
+            X = np.repeat(base, len(rows), axis=0)
+            X[:, schema.index["annee_modele"]] = block_years
+            X[:, schema.index["kilometrage"]] = block_km
+            X[:, etat_columns] = 0
+            X[rows, block_etat] = 1
+            prices[c, p] = version.predict_matrix(X, record=False).reshape(n_years, n_km, n_etats)
+    prices.flush()
+    del prices
+    # Atomic replace, so readers never see a half-written table
+    os.replace(tmp_path, output_path)
+    
+    header["build_seconds"] = round(time.perf_counter() - start, 2)
+    return header
+
+
+class PriceTable:
+    """
+    Read-only, memory-mapped price table.
+    
+    Args:
+        path (str): Table file
+    """
+    
+    def __init__(self, path=TABLE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a price table")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(header_length))
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported price table format version {self.header['format_version']}")
+        self.prices = np.memmap(path, dtype=self.header["dtype"], mode="r",
+                                offset=len(MAGIC) + 8 + header_length, shape=tuple(self.header["shape"]))
+        
+        self._contexts = {_context_key(context): i for i, context in enumerate(self.header["contexts"])}
+        self._pairs = {tuple(pair): i for i, pair in enumerate(self.header["pairs"])}
+        self._etats = {etat: i for i, etat in enumerate(self.header["etats"])}
+        self._year_start, self._n_years = self.header["years"]
+        self._km_start, self._km_step, self._n_km = self.header["kilometrages"]
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def model_sha256(self):
+        """str: SHA-256 of the model pickle the table was built from."""
+        return self.header["model_sha256"]
+    
+    @property
+    def artifacts_sha256(self):
+        """str: Data checksum of the artifact bundle the table was built with (None without one)."""
+        return self.header["artifacts_sha256"]
+    
+    def matches(self, version):
+        """
+        Return whether the table was computed by this model version with its current lookup tables.
+        
+        Args:
+            version (ModelVersion): Version serving the query
+        """
+        return version.sha256 == self.model_sha256 and _artifacts_sha256(version.encoder) == self.artifacts_sha256
+    
+    def index(self, input_data):
+        """
+        Return the grid cell of an input, or None if it is off the grid.
+        
+        Args:
+            input_data (dict): Input in the predict_price format
+        
+        Returns:
+            tuple: (context, pair, year, kilometrage, etat) indices, or None
+        """
+        context = self._contexts.get(_context_key(input_data))
+        pair = self._pairs.get((input_data["marque"], input_data["modele"]))
+        etat = self._etats.get(input_data["etat_du_vehicule"])
+        if context is None or pair is None or etat is None:
+            return None
+        year = to_float(input_data["annee_modele"]) - self._year_start
+        if not (year.is_integer() and 0 <= year < self._n_years):
+            return None
+        km, remainder = divmod(to_float(input_data["kilometrage"]) - self._km_start, self._km_step)
+        if remainder or not 0 <= km < self._n_km:
+            return None
+        return context, pair, int(year), int(km), etat
+    
+    def lookup(self, input_data, version=None):
+        """
+        Return the tabulated price of an input, or None if the live model is needed.
+        
+        Inputs routed to another model version than the table's, or encoded
+        with other lookup tables, are not answered from it. A price answered
+        is recorded in the statistics of the version serving it, like a
+        model call.
+        
+        Args:
+            input_data (dict): Input in the predict_price format
+            version (ModelVersion): Version the input was routed to; callers
+                that fall back to the model pass the same one to it, so the
+                input is routed only once (routed here if None)
+        
+        Returns:
+            np.float32: Price in MAD, identical to model.predict_price, or None
+        """
+        start = time.perf_counter()
+        if version is None:
+            version = model.current_version()
+        cell = self.index(input_data)
+        if cell is None or not self.matches(version):
+            self.misses += 1
+            return None
+        self.hits += 1
+        price = self.prices[cell]
+        version.stats.record(time.perf_counter() - start, np.array([price]))
+        return price
+    
+    def predict_price(self, input_data, version=None):
+        """model.predict_price, answered from the table when the input is on the grid."""
+        if version is None:
+            version = model.current_version()
+        price = self.lookup(input_data, version=version)
+        if price is None:
+            return model.predict_price(input_data, version=version)
+        return price
+    
+    def coverage(self, queries):
+        """
+        Return the share of a query log the table answers.
+        
+        Args:
+            queries (pd.DataFrame): Past inputs, in the predict_price format
+        """
+        if len(queries) == 0:
+            return 0.0
+        records = queries.to_dict("records")
+        return sum(self.index(record) is not None for record in records) / len(records)
+
+
+_lock = threading.Lock()
+_table = None
+
+
+def get_table(path=TABLE_PATH):
+    """Return the shared price table, or None if the file does not exist."""
+    global _table
+    if _table is None and os.path.exists(path):
+        with _lock:
+            if _table is None:
+                _table = PriceTable(path)
+    return _table
+
+
+def table_predict_price(input_data):
+    """
+    Predict one car's price from the shared table, falling back to the model.
+    
+    Args:
+        input_data (dict): User input from the Streamlit interface
+    
+    Returns:
+        float: Predicted price in MAD
+    """
+    table = get_table()
+    version = model.current_version()
+    if table is None:
+        return model.predict_price(input_data, version=version)
+    return table.predict_price(input_data, version=version)
+
+
+def _collect():
+    if _table is not None:
+        yield "price_table_lookups", "counter", {"result": "hit"}, _table.hits
+        yield "price_table_lookups", "counter", {"result": "miss"}, _table.misses
+
+
+metrics.register_collector(_collect)
+
+
+def _report(header, path, queries=None, table=None):
+    modele_freq = encoder.modele_freq
+    covered = {modele for _, modele in header["pairs"]}
+    mass = sum(modele_freq.get(modele, 0) for modele in covered) / sum(modele_freq.values())
+    cells = int(np.prod(header["shape"]))
+    artifacts = (header["artifacts_sha256"] or "pickles")[:12]
+    print(f"{path}: model {header['model_sha256'][:12]}, artifacts {artifacts}, shape {header['shape']} "
+          f"(contexts, pairs, years, mileages, conditions)")
+    print(f"    {cells:,} prices, {os.path.getsize(path) / 2 ** 20:.1f} MiB")
+    print(f"    pairs cover {mass:.1%} of the training listings by model frequency")
+    if "build_seconds" in header:
+        print(f"    built in {header['build_seconds']:.1f} s ({cells / header['build_seconds']:,.0f} prices/s)")
+    if queries is not None:
+        print(f"    answers {table.coverage(queries):.1%} of the {len(queries):,} logged queries")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the precomputed price table")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("path", nargs="?", default=TABLE_PATH)
+    parser.add_argument("--top-models", type=int, default=100,
+                        help="Number of most frequent brand/model pairs to tabulate")
+    parser.add_argument("--queries", help="CSV log of past inputs, for the coverage report and --contexts")
+    parser.add_argument("--contexts", type=int, default=0,
+                        help="Also tabulate the N most frequent contexts of the query log")
+    args = parser.parse_args()
+    
+    queries = None
+    if args.queries:
+        import pandas as pd
+        queries = pd.read_csv(args.queries)
+    
+    if args.command == "build":
+        contexts = [default_context()]
+        if queries is not None and args.contexts:
+            keys = {_context_key(contexts[0])}
+            for context in top_contexts(queries, args.contexts):
+                if _context_key(context) not in keys:
+                    keys.add(_context_key(context))
+                    contexts.append(context)
+        header = build_table(args.path, args.top_models, contexts)
+    else:
+        header = PriceTable(args.path).header
+    _report(header, args.path, queries, PriceTable(args.path) if queries is not None else None)
+
+
+if __name__ == "__main__":
+    main()
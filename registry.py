@@ -0,0 +1,415 @@
+"""
+Model registry: hot reload and A/B routing of model versions.
+
+A models directory is watched by a background thread. Every version is
+loaded off the request path, validated against the expected feature schema
+and smoke-tested before it can receive traffic. Routing is one tuple
+(active, candidate, share) replaced atomically, so in-flight predictions
+finish on the version they started with.
+
+A version is either a ``<version>/`` directory holding a complete artifact
+set (a train.py output directory), which is encoded with its own lookup
+tables, or a bare ``<version>.pkl`` file, which is encoded with the shared
+ones. A directory's bundle must have been built for its model; a bare
+pickle is only accepted if the shared bundle was built for it, so a model
+is never scored with encoders it was not trained with.
+
+Which versions serve traffic is decided by ``routing.json`` in the models
+directory when it exists::
+
+    {"active": "2025-06", "candidate": "2025-07", "candidate_share": 0.1}
+
+Otherwise the newest file is the active version, or, when a candidate share
+is configured, the candidate next to the previous newest file. An invalid
+routing.json is reported as a load error and the previous routing is kept.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from bundle import file_sha256
+from features import FeatureEncoder, FeatureSchema, encoder
+from instrumentation import metrics
+
+MODELS_DIR = "models"
+ROUTING_FILE = "routing.json"
+# Model pickle of a version directory, as written by train.py
+MODEL_FILE = "best_car_price_model.pkl"
+
+
+class VersionStats:
+    """
+    Latency and prediction statistics of one model version.
+    
+    Args:
+        window (int): Number of most recent call latencies kept for percentiles
+    """
+    
+    def __init__(self, window=10_000):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.rows = 0
+        self.errors = 0
+        self.price_sum = 0.0
+        self.price_sumsq = 0.0
+    
+    def record(self, seconds, prices):
+        self.latencies.append(seconds)
+        self.calls += 1
+        self.rows += len(prices)
+        prices = prices.astype(np.float64)
+        self.price_sum += float(prices.sum())
+        self.price_sumsq += float(np.dot(prices, prices))
+    
+    @property
+    def mean_price(self):
+        return self.price_sum / self.rows if self.rows else None
+    
+    def snapshot(self):
+        """Return the statistics as a JSON-serializable dict."""
+        latencies = np.fromiter(self.latencies, dtype=float) * 1000
+        percentiles = {}
+        if len(latencies):
+            for p in (50, 90, 99):
+                percentiles[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 3)
+        std = None
+        if self.rows:
+            std = round(max(self.price_sumsq / self.rows - self.mean_price ** 2, 0) ** 0.5, 2)
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "errors": self.errors,
+            "latency": percentiles,
+            "mean_price": None if self.mean_price is None else round(self.mean_price, 2),
+            "std_price": std
+        }
+
+
+class ModelVersion:
+    """
+    One loaded model with its compiled schema, forest and statistics.
+    
+    Args:
+        version (str): Version name
+        path (str): Model pickle
+        fitted: The unpickled model
+        expected_columns (list[str]): Required feature names, in order
+            (None to accept any layout the encoder can produce)
+        encoder (FeatureEncoder): Lookup tables the model was trained with
+            (the shared encoder by default)
+    
+    Raises:
+        ValueError: If the model's features do not match expected_columns
+    """
+    
+    def __init__(self, version, path, fitted, expected_columns=None, encoder=encoder):
+        self.version = version
+        self.path = path
+        self.model = fitted
+        self.encoder = encoder
+        # Fails if the encoder cannot produce the model's columns
+        self.schema = FeatureSchema.from_model(fitted, encoder=encoder)
+        if expected_columns is not None and self.schema.feature_names != list(expected_columns):
+            raise ValueError(
+                f"Model {version} expects columns {self.schema.feature_names}, "
+                f"not the schema {list(expected_columns)}"
+            )
+        self.loaded_at = time.time()
+        self.stats = VersionStats()
+        self._forest = None
+        self._sha256 = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, version, path, expected_columns=None, artifact_dir=None):
+        """
+        Unpickle, validate and smoke-test a model file.
+        
+        Args:
+            version (str): Version name
+            path (str): Model pickle
+            expected_columns (list[str]): Required feature names, in order
+            artifact_dir (str): Directory of the model's own artifacts (None
+                for the shared encoder)
+        
+        Raises:
+            ValueError: If the model does not match its artifact bundle or
+                expected_columns, or predicts non-finite values
+        """
+        import joblib
+        
+        start = time.perf_counter()
+        if artifact_dir is not None:
+            version_encoder = FeatureEncoder(artifact_dir)
+            # Fails if its bundle was built for another model; later reloads
+            # of the bundle are checked against this model too
+            version_encoder.verify_model(path)
+        else:
+            version_encoder = encoder
+            bundle = encoder.bundle()
+            if bundle is not None and bundle.model_sha256 != file_sha256(path):
+                raise ValueError(
+                    f"The shared artifact bundle was not built for {path}; put the model in a "
+                    f"{version}/ directory with its own artifacts (train.py --output-dir)"
+                )
+        model_version = cls(version, path, joblib.load(path), expected_columns, encoder=version_encoder)
+        smoke = model_version.predict_matrix(np.zeros((1, model_version.schema.n_features), dtype=np.float32),
+                                             record=False)
+        if not np.isfinite(smoke).all():
+            raise ValueError(f"Model {version} predicts non-finite values")
+        metrics.set("model_load_seconds", time.perf_counter() - start, version=version)
+        return model_version
+    
+    def predict_matrix(self, X, record=True):
+        """
+        Run the model on an encoded float32 feature matrix.
+        
+        Once the NumPy forest is loaded, batches of up to FOREST_MAX_ROWS
+        rows are scored by it, which is faster there; larger batches always
+        go to XGBoost. Both give identical prices.
+        """
+        from forest import FOREST_MAX_ROWS
+        
+        start = time.perf_counter()
+        try:
+            if self._forest is not None and len(X) <= FOREST_MAX_ROWS:
+                prices = self._forest.predict(X)
+            elif hasattr(self.model, "get_booster"):
+                # Skips the DMatrix construction done by XGBRegressor.predict
+                prices = self.model.get_booster().inplace_predict(X)
+            else:
+                prices = self.model.predict(X)
+        except Exception:
+            self.stats.errors += 1
+            raise
+        if record:
+            self.stats.record(time.perf_counter() - start, prices)
+        return prices
+    
+    @property
+    def sha256(self):
+        """str: SHA-256 of the model file, computed on first use."""
+        if self._sha256 is None:
+            self._sha256 = file_sha256(self.path)
+        return self._sha256
+    
+    def forest(self):
+        """
+        Return the NumPy forest of this model, loading it on first use.
+        
+        Uses the exported .npz next to the pickle (or a forest_model.npz in
+        its directory or the working directory) when it was exported from
+        this exact file, else flattens the booster.
+        """
+        if self._forest is None:
+            with self._lock:
+                if self._forest is None:
+                    self._forest = self._load_forest()
+        return self._forest
+    
+    def _load_forest(self):
+        from forest import FOREST_PATH, Forest, flatten_booster
+        
+        sha256 = self.sha256
+        candidates = (os.path.splitext(self.path)[0] + ".npz",
+                      os.path.join(os.path.dirname(self.path), FOREST_PATH), FOREST_PATH)
+        for path in candidates:
+            if os.path.exists(path):
+                forest = Forest.load(path)
+                if forest.model_sha256 == sha256:
+                    return forest
+        booster = self.model.get_booster() if hasattr(self.model, "get_booster") else self.model
+        arrays = flatten_booster(booster)
+        arrays["model_sha256"] = np.array(sha256)
+        return Forest(arrays)
+
+
+class ModelRegistry:
+    """
+    Watches a models directory and routes predictions between versions.
+    
+    Args:
+        models_dir (str): Directory of <version>/ artifact directories and
+            <version>.pkl files
+        expected_columns (list[str]): Feature names every version must use
+        candidate_share (float): Share of traffic sent to the newest version
+            when routing.json does not say otherwise (0 swaps it in directly)
+        poll_interval (float): Seconds between directory scans
+    """
+    
+    def __init__(self, models_dir=MODELS_DIR, expected_columns=None, candidate_share=0.0,
+                 poll_interval=5.0):
+        if not 0 <= candidate_share <= 1:
+            raise ValueError(f"candidate_share must be between 0 and 1, got {candidate_share}")
+        self.models_dir = models_dir
+        self.expected_columns = expected_columns
+        self.candidate_share = candidate_share
+        self.poll_interval = poll_interval
+        self.versions = {}
+        self.load_errors = {}
+        self.swaps = 0
+        # (active, candidate, share), replaced as a whole
+        self._routing = (None, None, 0.0)
+        self._signatures = {}
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _scan(self):
+        """Return {version: (path, artifact_dir, mtime_ns, size)} of the model files."""
+        found = {}
+        try:
+            entries = list(os.scandir(self.models_dir))
+        except FileNotFoundError:
+            return found
+        for entry in entries:
+            if entry.name.endswith(".pkl") and entry.is_file():
+                stat = entry.stat()
+                found[entry.name[:-len(".pkl")]] = (entry.path, None, stat.st_mtime_ns, stat.st_size)
+            elif entry.is_dir():
+                path = os.path.join(entry.path, MODEL_FILE)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found[entry.name] = (path, entry.path, stat.st_mtime_ns, stat.st_size)
+        return found
+    
+    def _read_routing(self):
+        """
+        Return the routing.json settings, or None when there is no such file.
+        
+        Raises:
+            ValueError: If the file is not valid JSON or its values are invalid
+        """
+        path = os.path.join(self.models_dir, ROUTING_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                routing = json.load(f)
+        except FileNotFoundError:
+            return None
+        if not isinstance(routing, dict):
+            raise ValueError(f"{ROUTING_FILE} must hold a JSON object")
+        for key in ("active", "candidate"):
+            if not isinstance(routing.get(key), (str, type(None))):
+                raise ValueError(f"{key} must be a version name, got {routing[key]!r}")
+        share = routing.get("candidate_share", 0.0)
+        # bool is an int subclass, but true/false is not a share
+        if isinstance(share, bool) or not isinstance(share, (int, float)) or not 0 <= share <= 1:
+            raise ValueError(f"candidate_share must be a number between 0 and 1, got {share!r}")
+        return routing
+    
+    def refresh(self):
+        """
+        Load new or changed model files and update the routing.
+        
+        Called periodically by the watcher thread; safe to call directly.
+        
+        Returns:
+            tuple: The (active, candidate, share) version names now routed
+        """
+        found = self._scan()
+        for version, (path, artifact_dir, mtime, size) in found.items():
+            if self._signatures.get(version) == (mtime, size):
+                continue
+            self._signatures[version] = (mtime, size)
+            try:
+                self.versions[version] = ModelVersion.load(version, path, self.expected_columns, artifact_dir)
+                self.load_errors.pop(version, None)
+            except Exception as e:
+                # Keep serving the previous versions
+                self.load_errors[version] = f"{type(e).__name__}: {e}"
+        for version in set(self.versions) - set(found):
+            # In-flight predictions keep their own reference
+            del self.versions[version]
+            self._signatures.pop(version, None)
+        
+        try:
+            active, candidate, share = self._choose(found)
+        except ValueError as e:
+            # Keep routing as before until the file is fixed
+            self.load_errors[ROUTING_FILE] = f"{type(e).__name__}: {e}"
+            return self.routing()
+        self.load_errors.pop(ROUTING_FILE, None)
+        routing = (self.versions.get(active), self.versions.get(candidate), share)
+        if routing[1] is None:
+            routing = (routing[0], None, 0.0)
+        if routing[0] is not None and routing != self._routing:
+            self._routing = routing
+            self.swaps += 1
+        return self.routing()
+    
+    def _choose(self, found):
+        routing = self._read_routing()
+        if routing is not None:
+            return routing.get("active"), routing.get("candidate"), float(routing.get("candidate_share", 0.0))
+        by_age = sorted((v for v in found if v in self.versions), key=lambda v: found[v][2])
+        if not by_age:
+            return None, None, 0.0
+        if self.candidate_share > 0 and len(by_age) >= 2:
+            return by_age[-2], by_age[-1], self.candidate_share
+        return by_age[-1], None, 0.0
+    
+    def routing(self):
+        """Return the (active, candidate, share) version names."""
+        active, candidate, share = self._routing
+        return (active and active.version, candidate and candidate.version, share)
+    
+    def route(self):
+        """Pick the version serving one call, or None if no version is loaded."""
+        active, candidate, share = self._routing
+        if candidate is not None and random.random() < share:
+            return candidate
+        return active
+    
+    def start(self):
+        """Load the current versions, then keep watching the directory in the background."""
+        self.refresh()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+            self._thread.start()
+        return self
+    
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+                self.load_errors.pop("refresh", None)
+            except Exception as e:
+                # Never let one bad scan stop hot reload for the process
+                self.load_errors["refresh"] = f"{type(e).__name__}: {e}"
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def stats(self):
+        """
+        Return routing, per-version statistics and load errors.
+        
+        Each version's drift is its mean predicted price relative to the
+        active version's, over the traffic each one served.
+        """
+        active, _, _ = self._routing
+        reference = active.stats.mean_price if active is not None else None
+        versions = {}
+        for name, model_version in list(self.versions.items()):
+            snapshot = model_version.stats.snapshot()
+            mean = model_version.stats.mean_price
+            snapshot["drift"] = round(mean / reference - 1, 4) if mean and reference else None
+            versions[name] = snapshot
+        active_name, candidate_name, share = self.routing()
+        return {
+            "active": active_name,
+            "candidate": candidate_name,
+            "candidate_share": share,
+            "swaps": self.swaps,
+            "versions": versions,
+            "load_errors": dict(self.load_errors)
+        }
@@ -0,0 +1,414 @@
+"""
+Headless JSON prediction service with micro-batching.
+
+Concurrent requests are gathered into micro-batches so that each batch is
+encoded and scored with a single vectorized model call. With a precomputed
+price table (see price_table.py), cars on its grid are answered directly
+without joining a batch; with a prediction cache (see cache.py), so are the
+cars the serving model version has already priced.
+
+Usage:
+    python service.py --port 8000 --max-batch-size 256 --max-wait-ms 5 \
+        [--models-dir models --candidate-share 0.1] [--instrument --metrics-file metrics.prom] \
+        [--price-table price_table.bin] [--cache-size 100000]
+
+Endpoints:
+    POST /predict   A JSON object (one car) or a list of objects, in the same
+                    format as model.predict_price. Returns {"price": ...} or
+                    {"prices": [...]}.
+    GET  /metrics   Latency percentiles, batch-size histogram, cache counters
+                    and, with a models directory, per-version routing and drift
+    GET  /metrics/prometheus
+                    Prediction-path metrics (see instrumentation.py) in the
+                    Prometheus text format
+    POST /debug/profile?seconds=5
+                    Runs the sampling profiler and returns collapsed stacks
+    GET  /health    Liveness check
+"""
+import argparse
+import asyncio
+import functools
+import json
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qs
+
+import numpy as np
+
+import instrumentation
+import model
+from features import RAW_FIELDS
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error"
+}
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+class ServiceMetrics:
+    """
+    Request latency and batch-size statistics.
+    
+    Args:
+        window (int): Number of most recent request latencies kept for percentiles
+    """
+    
+    def __init__(self, window=100_000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.started = time.monotonic()
+    
+    def record_batch(self, size):
+        # Power-of-two buckets: 1, 2, 4, 8, ...
+        self.batch_sizes[1 << (size - 1).bit_length()] += 1
+        self.batches += 1
+    
+    def record_request(self, seconds, ok=True):
+        self.latencies.append(seconds)
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+    
+    def snapshot(self):
+        """Return the current metrics as a JSON-serializable dict."""
+        latencies = np.fromiter(self.latencies, dtype=float) * 1000
+        percentiles = {}
+        if len(latencies):
+            for p in (50, 90, 99):
+                percentiles[f"p{p}_ms"] = round(float(np.percentile(latencies, p)), 3)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "uptime_s": round(time.monotonic() - self.started, 1),
+            "latency": percentiles,
+            "batch_size_histogram": {f"<={k}": v for k, v in sorted(self.batch_sizes.items())}
+        }
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent predictions into batches scored with model.predict_prices.
+    
+    A batch is flushed when it reaches max_batch_size, or max_wait seconds
+    after its first request arrived, whichever comes first.
+    
+    Args:
+        max_batch_size (int): Maximum number of cars per model call
+        max_wait (float): Maximum seconds a request waits for others to join its batch
+        metrics (ServiceMetrics): Where to record batch sizes
+        table (price_table.PriceTable): Answers the cars on its grid without batching
+        cache (cache.PredictionCache): Answers the cars already priced by the
+            version serving them without batching
+    """
+    
+    def __init__(self, max_batch_size=256, max_wait=0.005, metrics=None, table=None, cache=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics if metrics is not None else ServiceMetrics()
+        self.table = table
+        self.cache = cache
+        self._queue = asyncio.Queue()
+        self._task = None
+    
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def predict(self, record):
+        """
+        Queue one car and wait for its price.
+        
+        Raises:
+            TypeError: If the car is not a JSON object
+            KeyError: If it lacks some input fields; checked before batching,
+                since the batch encoder would score them as missing values
+        """
+        if not isinstance(record, dict):
+            raise TypeError(f"Expected a JSON object per car, got {type(record).__name__}")
+        missing = [field for field in RAW_FIELDS if field not in record]
+        if missing:
+            raise KeyError(f"Missing fields: {', '.join(missing)}")
+        # Routed once per car, so that the table, the cache and the batch all
+        # answer with the version serving it
+        version = model.current_version()
+        if self.table is not None:
+            try:
+                price = self.table.lookup(record, version=version)
+            except (KeyError, TypeError):
+                # Malformed cars get their error from the model
+                price = None
+            if price is not None:
+                return float(price)
+        if self.cache is not None:
+            key = self.cache.key(record, version.sha256)
+            price = self.cache.get(key)
+            if price is not None:
+                return price
+            generation = self.cache.generation
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, version, future))
+        price = await future
+        if self.cache is not None:
+            self.cache.put(key, price, generation)
+        return price
+    
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.metrics.record_batch(len(batch))
+            # One model call per version routed to (a single one without A/B routing)
+            by_version = {}
+            for record, version, future in batch:
+                by_version.setdefault(version, []).append((record, future))
+            for version, items in by_version.items():
+                records = [record for record, _ in items]
+                try:
+                    # Score off the event loop so new requests keep being accepted
+                    prices = await loop.run_in_executor(
+                        None, functools.partial(model.predict_prices, records, version=version)
+                    )
+                    results = [float(p) for p in prices]
+                except Exception:
+                    # Isolate the failing cars instead of failing the whole batch
+                    results = await loop.run_in_executor(None, _predict_each, records, version)
+                for (_, future), result in zip(items, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+
+def _predict_each(records, version):
+    results = []
+    for record in records:
+        try:
+            results.append(float(model.predict_price(record, version=version)))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+class PredictionServer:
+    """
+    Minimal HTTP/1.1 JSON server around a MicroBatcher.
+    
+    Args:
+        batcher (MicroBatcher): Batcher used for /predict
+    """
+    
+    def __init__(self, batcher):
+        self.batcher = batcher
+        self.metrics = batcher.metrics
+        instrumentation.metrics.register_collector(self._collect)
+    
+    def _collect(self):
+        yield "service_requests", "counter", {}, self.metrics.requests
+        yield "service_errors", "counter", {}, self.metrics.errors
+        yield "service_batches", "counter", {}, self.metrics.batches
+    
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._send(writer, 400, {"error": "Malformed request line"}, False)
+                    break
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self._send(writer, 400, {"error": "Invalid Content-Length"}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._send(writer, 413, {"error": "Request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "").lower() != "close"
+                
+                status, payload = await self.route(method, path, body)
+                await self._send(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    
+    async def route(self, method, path, body):
+        """Dispatch one request and return (status, JSON payload or text)."""
+        path, _, query = path.partition("?")
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            snapshot = self.metrics.snapshot()
+            if model.get_registry() is not None:
+                snapshot["models"] = model.get_registry().stats()
+            if self.batcher.cache is not None:
+                snapshot["cache"] = self.batcher.cache.stats()
+            return 200, snapshot
+        if path == "/metrics/prometheus":
+            return 200, instrumentation.metrics.render()
+        if path == "/debug/profile":
+            if method != "POST":
+                return 405, {"error": "Use POST"}
+            try:
+                seconds = float(parse_qs(query).get("seconds", ["5"])[0])
+            except ValueError:
+                return 400, {"error": "seconds must be a number"}
+            instrumentation.start_profiler()
+            await asyncio.sleep(min(seconds, 60))
+            return 200, instrumentation.stop_profiler()
+        if path != "/predict":
+            return 404, {"error": f"Unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST"}
+        
+        start = time.perf_counter()
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            self.metrics.record_request(time.perf_counter() - start, ok=False)
+            return 400, {"error": f"Invalid JSON: {e}"}
+        
+        try:
+            if isinstance(data, list):
+                prices = await asyncio.gather(*(self.batcher.predict(r) for r in data))
+                payload = {"prices": prices}
+            else:
+                payload = {"price": await self.batcher.predict(data)}
+        except (KeyError, ValueError, TypeError) as e:
+            self.metrics.record_request(time.perf_counter() - start, ok=False)
+            return 400, {"error": f"Invalid input: {e!r}"}
+        except Exception as e:
+            self.metrics.record_request(time.perf_counter() - start, ok=False)
+            return 500, {"error": f"Error during prediction: {e}"}
+        
+        self.metrics.record_request(time.perf_counter() - start)
+        return 200, payload
+    
+    @staticmethod
+    async def _send(writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json"
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(host="127.0.0.1", port=8000, max_batch_size=256, max_wait=0.005,
+                models_dir=None, candidate_share=0.0, metrics_file=None, metrics_interval=15.0,
+                price_table_path=None, cache_size=0):
+    """Run the prediction service until cancelled."""
+    # Load the model and encoders before accepting requests
+    model.warmup()
+    if models_dir:
+        model.enable_registry(models_dir, candidate_share=candidate_share)
+    if metrics_file:
+        instrumentation.start_file_exporter(metrics_file, metrics_interval)
+    table = None
+    if price_table_path:
+        from price_table import get_table
+        table = get_table(price_table_path)
+        if table is None:
+            raise FileNotFoundError(f"No price table at {price_table_path}")
+    cache = None
+    if cache_size:
+        from cache import PredictionCache
+        # Exact mileages: API callers are not limited to the UI's 5000 km step
+        cache = PredictionCache(maxsize=cache_size, kilometrage_step=None)
+    batcher = MicroBatcher(max_batch_size=max_batch_size, max_wait=max_wait, table=table, cache=cache)
+    batcher.start()
+    server = await asyncio.start_server(PredictionServer(batcher).handle, host, port)
+    print(f"Serving predictions on http://{host}:{port} "
+          f"(max batch {max_batch_size}, max wait {max_wait * 1000:g} ms)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Car price prediction service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--models-dir", help="Watch this directory for new model versions")
+    parser.add_argument("--candidate-share", type=float, default=0.0,
+                        help="Share of traffic routed to the newest model version")
+    parser.add_argument("--instrument", action="store_true",
+                        help="Record stage timings and unknown categories on the prediction path")
+    parser.add_argument("--metrics-file", help="Also write the Prometheus metrics to this file")
+    parser.add_argument("--metrics-interval", type=float, default=15.0)
+    parser.add_argument("--price-table", help="Answer the cars on this precomputed table's grid from it")
+    parser.add_argument("--cache-size", type=int, default=0,
+                        help="Keep the prices of up to this many recent cars (0 disables the cache)")
+    args = parser.parse_args()
+    if args.instrument:
+        instrumentation.enable()
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_batch_size, args.max_wait_ms / 1000,
+                          args.models_dir, args.candidate_share, args.metrics_file,
+                          args.metrics_interval, args.price_table, args.cache_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+"""
+Tests run from the repository root, so the model artifacts are found with
+the same relative paths as the Streamlit app.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.chdir(ROOT)
@@ -0,0 +1,82 @@
+"""
+Parity of the NumPy forest (forest.py) with the pickled XGBoost model.
+
+Small and fast enough to run on every change; benchmarks/bench_forest.py
+checks the same on a million rows and times both.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import model
+from bundle import file_sha256, load_artifact
+from forest import FOREST_PATH, Forest, flatten_booster
+
+ROWS = 3000
+
+
+def listings(n, seed=0):
+    """Random inputs drawn from the real category lists."""
+    rng = np.random.default_rng(seed)
+    pairs = [(b, m) for b, models in load_artifact("brand_model_dict").items() for m in models]
+    pair_idx = rng.integers(0, len(pairs), n)
+    return pd.DataFrame({
+        "marque": [pairs[i][0] for i in pair_idx],
+        "modele": [pairs[i][1] for i in pair_idx],
+        "annee_modele": rng.integers(1990, 2025, n),
+        "kilometrage": rng.integers(0, 101, n) * 5000,
+        "nombre_de_portes": rng.choice([3, 4, 5], n),
+        "puissance_fiscale": rng.integers(1, 21, n),
+        "premiere_main": rng.integers(0, 2, n),
+        "boite_vitesses": rng.choice(load_artifact("boite_list"), n),
+        "type_de_carburant": rng.choice(["Essence", "Diesel", "Electrique", "Hybride", "LPG"], n),
+        "origine": rng.choice(["Dédouanée", "Importée neuve", "Pas encore dédouanée", "WW au Maroc"], n),
+        "etat_du_vehicule": rng.choice(load_artifact("etat_list"), n),
+        "localisation": rng.choice(load_artifact("localisation_list"), n)
+    })
+
+
+@pytest.fixture(scope="module")
+def flattened():
+    booster = model.get_model().get_booster()
+    return Forest(dict(flatten_booster(booster), model_sha256=np.array(model.current_version().sha256)))
+
+
+@pytest.fixture(scope="module")
+def encoded():
+    X = model.encode_batch(listings(ROWS))
+    # Missing cities, as scored by bulk.py
+    X[::13, model.get_schema().index["localisation"]] = np.nan
+    return X
+
+
+@pytest.fixture(scope="module")
+def random_rows(encoded):
+    # Uniformly random values around the real ranges, with random missing values
+    rng = np.random.default_rng(1)
+    R = (rng.random((ROWS, encoded.shape[1])) * np.nanmax(encoded, axis=0) * 1.2).astype(np.float32)
+    R[rng.random(R.shape) < 0.05] = np.nan
+    return R
+
+
+def test_flattened_forest_matches_xgboost(flattened, encoded, random_rows):
+    for X in (encoded, random_rows):
+        np.testing.assert_array_equal(flattened.predict(X), model.predict_matrix(X))
+
+
+def test_small_batches_match_xgboost(flattened, encoded):
+    # The forest serves batches of up to FOREST_MAX_ROWS rows in production
+    for size in (1, 2, 16):
+        X = encoded[:size]
+        np.testing.assert_array_equal(flattened.predict(X), model.get_model().get_booster().inplace_predict(X))
+
+
+@pytest.mark.skipif(not os.path.exists(FOREST_PATH), reason="no exported forest")
+def test_exported_forest_is_current(encoded, random_rows):
+    forest = Forest.load()
+    assert forest.model_sha256 == file_sha256(model.MODEL_PATH), \
+        f"{FOREST_PATH} was exported from another model; run `python forest.py export`"
+    for X in (encoded, random_rows):
+        np.testing.assert_array_equal(forest.predict(X), model.predict_matrix(X))
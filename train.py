@@ -0,0 +1,337 @@
+"""
+Incremental retraining from new listing files.
+
+Listing files (CSV or Parquet, the predict_price input columns plus the
+sale price) are streamed in chunks, twice:
+
+1. The brand, model and city counts and the brand -> models dictionary are
+   updated with every chunk. Counts are kept next to the artifacts
+   (counts.pkl), so each update starts from the previous one instead of
+   rescanning the history. The first update seeds them from the frequency
+   pickles and the size of the original training set, which is recovered
+   from the frequencies themselves.
+2. The chunks are encoded with the updated frequencies and fed to XGBoost
+   through a data iterator into a quantized matrix, without ever holding
+   the float feature matrix of all rows. Boosting then continues from the
+   existing booster: only --rounds new trees are fitted, on the new
+   listings.
+
+The output directory receives a complete artifact set: model pickle,
+frequency and dropdown pickles, artifacts.bundle and forest_model.npz, all
+consistent with each other. With --holdout, listings kept out of training
+calibrate the forest's price intervals. Copy it over the application directory to
+deploy it. "rebuild" fits a new model from scratch on the given files
+instead, for comparison.
+
+Usage:
+    python train.py update new_listings.csv [...] --output-dir release [--rounds 20] [--holdout held_out.csv]
+    python train.py rebuild all_listings.csv [...] --output-dir release
+"""
+import argparse
+import json
+import os
+import resource
+import time
+from collections import Counter
+
+import joblib
+import numpy as np
+
+from bulk import read_chunks
+from bundle import BUNDLE_PATH, build_bundle, load_artifact
+from features import RAW_FIELDS, FeatureEncoder, FeatureSchema, model_feature_names
+from forest import FOREST_PATH, export_forest
+
+MODEL_FILE = "best_car_price_model.pkl"
+COUNTS_FILE = "counts.pkl"
+PRICE_COLUMN = "prix"
+
+# Dropdown lists carried over unchanged from the base artifacts
+STATIC_LISTS = ["boite_list", "carburant_list", "etat_list", "origine_list"]
+
+
+def training_rows(*frequency_tables, max_count=1000):
+    """
+    Recover the number of listings frequency tables were computed over.
+    
+    Each frequency is count / rows, so rows is the smallest integer making
+    every frequency times rows an integer. The rarest value was seen c times,
+    for some small c: rows = c / min(frequency) is tried for c = 1, 2, ...
+    
+    Args:
+        frequency_tables (dict): Value -> frequency, e.g. marque_freq and modele_freq
+        max_count (int): Largest count of the rarest value to try
+    
+    Returns:
+        int: Number of listings
+    
+    Raises:
+        ValueError: If no row count fits every frequency
+    """
+    values = np.array([v for table in frequency_tables for v in table.values()], dtype=np.float64)
+    values = values[values > 0]
+    for count in range(1, max_count + 1):
+        rows = round(count / values.min())
+        counts = values * rows
+        if np.abs(counts - np.round(counts)).max() < 1e-6:
+            return rows
+    raise ValueError("The frequencies are not counts over a whole number of listings; pass --prior-rows")
+
+
+class ListingCounts:
+    """
+    Brand, model and city statistics of the training listings, updated chunk by chunk.
+    """
+    
+    def __init__(self):
+        self.rows = 0
+        self.marques = Counter()
+        self.modeles = Counter()
+        # Brand -> {model: None}, keeping the models in order of appearance
+        self.brand_models = {}
+        self.localisations = {}
+    
+    @classmethod
+    def from_artifacts(cls, artifact_dir=".", prior_rows=None):
+        """
+        Seed the counts from an artifact set.
+        
+        Uses its counts.pkl when there is one, else turns the frequency
+        pickles back into counts over prior_rows listings (by default the
+        size of the training set, recovered with training_rows).
+        """
+        counts = cls()
+        path = os.path.join(artifact_dir, COUNTS_FILE)
+        if os.path.exists(path):
+            state = joblib.load(path)
+            counts.rows = state["rows"]
+            counts.marques.update(state["marques"])
+            counts.modeles.update(state["modeles"])
+            counts.brand_models = {k: dict.fromkeys(v) for k, v in state["brand_models"].items()}
+            counts.localisations = state["localisations"]
+            return counts
+        marque_freq = load_artifact("marque_freq", artifact_dir)
+        modele_freq = load_artifact("modele_freq", artifact_dir)
+        if prior_rows is None:
+            prior_rows = training_rows(marque_freq, modele_freq)
+        counts.rows = prior_rows
+        # Whole counts, the original ones when prior_rows is the true size
+        counts.marques.update({k: round(v * prior_rows) for k, v in marque_freq.items()})
+        counts.modeles.update({k: round(v * prior_rows) for k, v in modele_freq.items()})
+        for marque, modeles in load_artifact("brand_model_dict", artifact_dir).items():
+            counts.brand_models[marque] = dict.fromkeys(modeles)
+        counts.localisations = dict(load_artifact("localisation_mapping", artifact_dir))
+        return counts
+    
+    def update(self, df):
+        """Add the listings of one chunk."""
+        self.rows += len(df)
+        self.marques.update(df["marque"].value_counts().to_dict())
+        self.modeles.update(df["modele"].value_counts().to_dict())
+        for marque, modele in df[["marque", "modele"]].drop_duplicates().dropna().itertuples(index=False):
+            self.brand_models.setdefault(marque, {}).setdefault(modele)
+        # New cities get the next codes, existing codes never change
+        for city in df["localisation"].dropna().unique():
+            if city not in self.localisations:
+                self.localisations[city] = len(self.localisations)
+    
+    def save(self, path):
+        """Write the counts as plain dicts and lists, for the next update."""
+        joblib.dump({
+            "rows": self.rows,
+            "marques": dict(self.marques),
+            "modeles": dict(self.modeles),
+            "brand_models": {k: list(v) for k, v in self.brand_models.items()},
+            "localisations": dict(self.localisations)
+        }, path)
+    
+    def artifacts(self):
+        """Return the encoding artifacts derived from the counts, by artifact name."""
+        return {
+            "marque_freq": {k: v / self.rows for k, v in self.marques.items()},
+            "modele_freq": {k: v / self.rows for k, v in self.modeles.items()},
+            "brand_model_dict": {k: list(v) for k, v in sorted(self.brand_models.items())},
+            "marque_list": sorted(self.marques),
+            "modele_list": sorted(self.modeles),
+            "localisation_mapping": dict(self.localisations),
+            "localisation_list": sorted(self.localisations, key=self.localisations.get)
+        }
+
+
+def _listing_chunks(paths, chunk_size):
+    """Yield the chunks of every file, keeping only the rows with a positive price."""
+    import pandas as pd
+    
+    for path in paths:
+        for chunk in read_chunks(path, chunk_size):
+            missing = sorted(set(RAW_FIELDS + [PRICE_COLUMN]) - set(chunk.columns))
+            if missing:
+                raise ValueError(f"{path} is missing the columns {missing}")
+            price = pd.to_numeric(chunk[PRICE_COLUMN], errors="coerce")
+            yield chunk[price > 0].assign(**{PRICE_COLUMN: price[price > 0]})
+
+
+def _training_matrix(paths, chunk_size, schema):
+    """Stream the encoded chunks into an XGBoost QuantileDMatrix."""
+    import xgboost as xgb
+    
+    class Chunks(xgb.DataIter):
+        def __init__(self):
+            super().__init__()
+            self._chunks = None
+        
+        def next(self, input_data):
+            if self._chunks is None:
+                self._chunks = _listing_chunks(paths, chunk_size)
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            X = schema.encode_frame(chunk, unknown_localisation="missing")
+            input_data(data=X, label=chunk[PRICE_COLUMN].to_numpy(dtype=np.float32),
+                       feature_names=schema.feature_names)
+            return True
+        
+        def reset(self):
+            self._chunks = None
+    
+    return xgb.QuantileDMatrix(Chunks())
+
+
+def holdout_matrix(model_path, paths, chunk_size=100_000):
+    """
+    Encode held-out listings for a model, with the artifacts next to it.
+    
+    Args:
+        model_path (str): Model pickle; its directory holds its artifact set
+        paths (list[str]): CSV or Parquet listing files, with a PRICE_COLUMN
+        chunk_size (int): Rows per chunk
+    
+    Returns:
+        tuple: (X, y) float32 feature matrix and sale prices
+    """
+    encoder = FeatureEncoder(os.path.dirname(model_path) or ".")
+    schema = FeatureSchema(model_feature_names(joblib.load(model_path)), encoder=encoder)
+    X, y = [], []
+    for chunk in _listing_chunks(paths, chunk_size):
+        X.append(schema.encode_frame(chunk, unknown_localisation="missing"))
+        y.append(chunk[PRICE_COLUMN].to_numpy(dtype=np.float32))
+    if not X:
+        raise ValueError(f"No listing with a positive {PRICE_COLUMN} in {paths}")
+    return np.concatenate(X), np.concatenate(y)
+
+
+def train(paths, output_dir, base_dir=".", incremental=True, rounds=20, chunk_size=100_000,
+          prior_rows=None, holdout=None):
+    """
+    Update (or rebuild) the model and its encoding artifacts from listing files.
+    
+    Args:
+        paths (list[str]): CSV or Parquet listing files, with a PRICE_COLUMN
+        output_dir (str): Directory receiving the new artifact set
+        base_dir (str): Artifact set to start from (the application directory)
+        incremental (bool): Continue from the base model and counts; False
+            fits a model with the base parameters from scratch on paths
+        rounds (int): Trees added by an incremental update
+        chunk_size (int): Rows per chunk
+        prior_rows (int): Weight of the base frequencies without a counts.pkl
+            (None to recover the original training set size from them)
+        holdout (list[str]): Listing files kept out of training, to calibrate
+            the price intervals on (nominal intervals if None)
+    
+    Returns:
+        dict: Report with row counts, tree counts, per-step seconds and peak memory
+    """
+    import xgboost as xgb
+    
+    start = time.perf_counter()
+    seconds = {}
+    base = joblib.load(os.path.join(base_dir, MODEL_FILE))
+    feature_names = model_feature_names(base)
+    
+    # Pass 1: encoder statistics
+    counts = ListingCounts.from_artifacts(base_dir, prior_rows) if incremental else ListingCounts()
+    previous_rows = counts.rows
+    for chunk in _listing_chunks(paths, chunk_size):
+        counts.update(chunk)
+    if counts.rows == previous_rows:
+        raise ValueError(f"No listing with a positive {PRICE_COLUMN} in {paths}")
+    os.makedirs(output_dir, exist_ok=True)
+    for name, value in counts.artifacts().items():
+        joblib.dump(value, os.path.join(output_dir, f"{name}.pkl"))
+    for name in STATIC_LISTS:
+        joblib.dump(load_artifact(name, base_dir), os.path.join(output_dir, f"{name}.pkl"))
+    counts.save(os.path.join(output_dir, COUNTS_FILE))
+    seconds["counts"] = time.perf_counter() - start
+    
+    # Pass 2: encode with the new frequencies and boost
+    step = time.perf_counter()
+    # Encode from the new pickles; the bundle is rebuilt from them below
+    if os.path.exists(os.path.join(output_dir, BUNDLE_PATH)):
+        os.remove(os.path.join(output_dir, BUNDLE_PATH))
+    schema = FeatureSchema(feature_names, encoder=FeatureEncoder(output_dir))
+    dtrain = _training_matrix(paths, chunk_size, schema)
+    seconds["encode"] = time.perf_counter() - step
+    
+    step = time.perf_counter()
+    params = base.get_xgb_params()
+    if incremental:
+        booster = xgb.train(params, dtrain, num_boost_round=rounds, xgb_model=base.get_booster())
+    else:
+        booster = xgb.train(params, dtrain, num_boost_round=base.n_estimators)
+    seconds["boost"] = time.perf_counter() - step
+    
+    step = time.perf_counter()
+    fitted = type(base)(**dict(base.get_params(), n_estimators=booster.num_boosted_rounds()))
+    fitted.load_model(bytearray(booster.save_raw("json")))
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    joblib.dump(fitted, model_path)
+    build_bundle(os.path.join(output_dir, BUNDLE_PATH), model_path, artifact_dir=output_dir)
+    calibration = holdout_matrix(model_path, holdout, chunk_size) if holdout else None
+    forest = export_forest(model_path, os.path.join(output_dir, FOREST_PATH), calibration)
+    seconds["write"] = time.perf_counter() - step
+    seconds["total"] = time.perf_counter() - start
+    
+    return {
+        "mode": "update" if incremental else "rebuild",
+        "rows": dtrain.num_row(),
+        "counted_rows": round(counts.rows),
+        "trees": booster.num_boosted_rounds(),
+        "brands": len(counts.marques),
+        "models": len(counts.modeles),
+        # None when the intervals were not calibrated
+        "interval_scale": forest.interval_scale,
+        "seconds": {k: round(v, 2) for k, v in seconds.items()},
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update or rebuild the model and its encoders")
+    parser.add_argument("command", choices=["update", "rebuild"])
+    parser.add_argument("paths", nargs="+", help="CSV or Parquet listing files with a prix column")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--base-dir", default=".", help="Artifact set to start from")
+    parser.add_argument("--rounds", type=int, default=20, help="Trees added by an update")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--prior-rows", type=int,
+                        help="Listings behind the base frequencies, when there is no counts.pkl "
+                             "(recovered from the frequencies by default)")
+    parser.add_argument("--holdout", nargs="+", metavar="LISTINGS",
+                        help="Listing files kept out of training, to calibrate the price intervals on")
+    parser.add_argument("--report", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+    
+    report = train(args.paths, args.output_dir, args.base_dir, incremental=args.command == "update",
+                   rounds=args.rounds, chunk_size=args.chunk_size, prior_rows=args.prior_rows,
+                   holdout=args.holdout)
+    print(f"{report['mode']}: {report['rows']:,} listings -> {report['trees']} trees in "
+          f"{args.output_dir} ({report['seconds']['total']:.1f} s, peak RSS {report['peak_rss_mib']:,.0f} MiB)")
+    print("    " + ", ".join(f"{step} {s:.1f} s" for step, s in report["seconds"].items() if step != "total"))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()